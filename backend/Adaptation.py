@@ -0,0 +1,281 @@
+import os, sys
+import numpy as np
+import pandas as pd
+
+from backend import ImpactsElectricNetwork
+from backend import RoadNetwork
+
+
+"""
+What-if engine for adaptation measures.
+An AdaptationScenario holds asset-level modifications (elevating buildings,
+raising road segments, hardening substations) and recomputes the combined
+impact tables (bldg-exp, elec-accs, trans-accs) only for the assets that the
+modifications affect. The map_* methods of MapWaterLevels are then run on
+those assets only (run()), so a what-if for a few thousand assets does not
+rerun pyincore, exposure, access or the full time aggregation.
+
+The slr layers are 1 ft apart, so raising an asset by d ft is treated as
+seeing the water of layer k - d at layer k (bathtub assumption):
+    buildings: damage state probabilities are shifted along the building's own
+        curve over the layers (interpolated between layers; clamped at layer
+        0). site exposure (haz_expose) is unchanged.
+    roads: the depth on the segment is lowered by d at each layer; travel
+        times are recomputed from the depth-speed relationship.
+    substations: not inundated at layers where the depth is at most the
+        protection height.
+
+Shortest paths are only recomputed for the layers where a modified road has a
+different travel time; other layers reuse the results in the combined tables.
+Baseline routes are kept on the scenario, so further modifications only
+reroute the adapted network.
+
+e.g.
+    A = AdaptationScenario(MWL)
+    A.elevate_buildings(guids, raise_ft=3)
+    A.raise_roads(edge_guids, raise_ft=2)
+    results = A.run('map_bldg_damage_continuous')
+    baseline = A.run('map_bldg_damage_continuous', baseline=True)
+"""
+
+N_LAYERS = 11
+
+
+class AdaptationScenario():
+    def __init__(self, mwl, name='adapted'):
+        """ mwl: MapWaterLevelsToImpacts.MapWaterLevels instance (provides the
+                combined impact tables and the water levels)
+        """
+        self.mwl = mwl
+        self.name = name
+        self.file_dir = mwl.file_dir
+        self.bldg_raise = pd.Series(dtype=float)       # building id -> ft
+        self.road_raise = pd.Series(dtype=float)       # edge guid -> ft
+        self.ss_protect = pd.Series(dtype=float)       # substation guid -> ft
+        self._tables = {}
+
+    ###########################################################################
+    def elevate_buildings(self, guids, raise_ft):
+        """ raising the first floor (found_ht) of buildings by raise_ft (scalar
+            or one value per building)
+        """
+        ids = self.mwl.registry.ids('buildings', guids)
+        self.bldg_raise = self.add(self.bldg_raise, ids, raise_ft)
+        self._tables.pop('bldg_exp_df', None)
+
+    def raise_roads(self, guids, raise_ft):
+        """ raising road segments (edge guids) by raise_ft """
+        self.road_raise = self.add(self.road_raise, pd.Index(guids).astype(str), raise_ft)
+        self._tables.pop('trns_acc_df', None)
+
+    def harden_substations(self, guids, protect_ft=np.inf):
+        """ protecting substations from inundation up to protect_ft (default:
+            fully protected)
+        """
+        new = pd.Series(protect_ft, index=pd.Index(guids).astype(str), dtype=float)
+        self.ss_protect = pd.concat([self.ss_protect.drop(new.index, errors='ignore'), new])
+        self._tables.pop('elec_acc_df', None)
+
+    def add(self, modifications, index, raise_ft):
+        new = pd.Series(raise_ft, index=index, dtype=float)
+        return modifications.add(new.groupby(level=0).sum(), fill_value=0)
+
+    ###########################################################################
+    def tables(self):
+        """ adapted combined tables of the affected assets only; same columns
+            and int building ids as the MapWaterLevels tables
+        """
+        if 'bldg_exp_df' not in self._tables:
+            self._tables['bldg_exp_df'] = self.adapted_bldg_exp()
+        if 'elec_acc_df' not in self._tables:
+            self._tables['elec_acc_df'] = self.adapted_elec_acc()
+        if 'trns_acc_df' not in self._tables:
+            self._tables['trns_acc_df'] = {runname: self.adapted_trns_acc(runname) for runname in self.mwl.destination_points}
+        return self._tables
+
+    def adapted_bldg_exp(self):
+        df = self.mwl.bldg_exp_df
+        raise_ft = self.bldg_raise.reindex(df.index).dropna()
+        raise_ft = raise_ft[raise_ft != 0]
+        df = df.loc[raise_ft.index].copy()
+
+        ds_cols = [["slr{}ft_DS_{}" .format(slr_ft, ds) for slr_ft in range(N_LAYERS)] for ds in range(4)]
+        for cols in ds_cols:
+            df[cols] = self.shift_layers(df[cols].values.astype(float), raise_ft.values)
+        return df
+
+    def shift_layers(self, values, shift):
+        """ values: (assets x layers); returns the values at layer k - shift
+            (linear between layers, clamped at the first and last layer)
+        """
+        pos = np.clip(np.arange(values.shape[1])[None, :] - np.asarray(shift)[:, None], 0, values.shape[1]-1)
+        lower = np.floor(pos).astype(int)
+        upper = np.minimum(lower + 1, values.shape[1]-1)
+        frac = pos - lower
+        rows = np.arange(len(values))[:, None]
+        return values[rows, lower]*(1 - frac) + values[rows, upper]*frac
+
+    ###########################################################################
+    def adapted_elec_acc(self):
+        """ substation outages (with the network cascade) before and after
+            hardening; buildings served by a substation whose outage changes
+            at any layer are affected
+        """
+        df = self.mwl.elec_acc_df
+        if len(self.ss_protect) == 0:
+            return df.iloc[:0].copy()
+        registry = self.mwl.registry
+
+        ss_exposure = np.full((len(registry.lookup('substations')), N_LAYERS), -1, dtype=np.int8)
+        ss_adapted = ss_exposure.copy()
+        for slr_ft in range(N_LAYERS):
+            path_to_ss_exposure = os.path.join(self.file_dir, "output", "electric", "substation-exposure-{}ft.csv" .format(slr_ft))
+            exposure = pd.read_csv(path_to_ss_exposure, dtype={"guid": str})
+            ss_ids = registry.ids('substations', exposure['guid'])
+            protect = self.ss_protect.reindex(exposure['guid']).fillna(-np.inf).values
+            ss_exposure[ss_ids, slr_ft] = exposure['haz_expose'].values
+            ss_adapted[ss_ids, slr_ft] = exposure['haz_expose'].values & (exposure['hazard_values'].values > protect)
+
+        network = ImpactsElectricNetwork.ElectricNetwork(self.file_dir)
+        changed = (network.substation_outage(ss_exposure) != network.substation_outage(ss_adapted)).any(axis=1)
+        outage = network.substation_outage(ss_adapted)
+
+        bldg2elec_df = pd.read_csv(os.path.join(self.file_dir, "infrastructure", "bldg2elec_galveston.csv"))
+        ss_of_bldg = pd.Series(registry.ids('substations', bldg2elec_df['node_guid']),
+                               index=registry.ids('buildings', bldg2elec_df['bldg_guid']))
+        ss_of_bldg = ss_of_bldg.reindex(df.index)
+        ss_of_bldg = ss_of_bldg[ss_of_bldg.notna()].astype(int)
+        ss_of_bldg = ss_of_bldg[changed[ss_of_bldg.values]]
+
+        df = df.loc[ss_of_bldg.index].copy()
+        cols = ["elec_{}ft" .format(slr_ft) for slr_ft in range(N_LAYERS)]
+        df[cols] = 1 - outage[ss_of_bldg.values]
+        return df
+
+    ###########################################################################
+    def adapted_trns_acc(self, runname):
+        """ travel times to the nearest end node are rerouted (all sources at
+            once, from the end nodes) at the layers where a raised road has a
+            different travel time. buildings whose routed travel time changes
+            are affected; all their layers are taken from the routes (baseline
+            routes at the unchanged layers), so that norm_tt never mixes 
+            combined table and rerouted values.
+        """
+        df = self.mwl.trns_acc_df[runname]
+        if len(self.road_raise) == 0:
+            return df.iloc[:0].copy()
+
+        RN = RoadNetwork.RoadNetwork(self.file_dir)
+        nodes, adjacency, edge_nodes = RN.read_graph(epsg=32615)
+        node_index = pd.Index(nodes)
+
+        bldg2trns_df = pd.read_csv(os.path.join(self.file_dir, "infrastructure", "bldg2trns_galveston.csv"))
+        end_nodes = pd.read_csv(os.path.join(self.file_dir, "infrastructure", "{}-end-nodes.csv" .format(runname)))
+        bldg_ids = self.mwl.registry.ids('buildings', bldg2trns_df['bldg_guid'])
+        bldg_node = pd.Series(node_index.get_indexer(bldg2trns_df['node_guid'].astype(str)), index=bldg_ids).reindex(df.index)
+        targets = node_index.get_indexer(end_nodes['node'].astype(str))
+        targets = targets[targets >= 0]
+        CN = RN.contract(np.concatenate([bldg2trns_df['node_guid'].values.astype(str), end_nodes['node'].values.astype(str)]))
+
+        travel_time = np.full((len(df), N_LAYERS), np.inf)
+        affected = np.zeros(len(df), dtype=bool)
+        has_node = (bldg_node >= 0).values
+        for slr_ft in range(N_LAYERS):
+            weights = self.road_weights(RN, slr_ft)
+            weights_adapted = RN.travel_times(slr_ft, 32615, self.road_raise)
+            key = ('route', runname, slr_ft)        # baseline routes are kept across what-ifs
+            if key not in self._tables:
+                self._tables[key] = self.route(CN, weights, targets)
+            tt = self._tables[key][bldg_node.values[has_node]]
+            travel_time[has_node, slr_ft] = tt
+            if np.array_equal(weights, weights_adapted):
+                continue            # no modified road changes at this layer
+            tt_adapted = self.route(CN, weights_adapted, targets)[bldg_node.values[has_node]]
+            changed = np.zeros(len(df), dtype=bool)
+            changed[has_node] = ~np.isclose(tt, tt_adapted)
+            travel_time[has_node, slr_ft] = tt_adapted
+            affected |= changed
+
+        df = df.loc[affected].copy()
+        travel_time = travel_time[affected]
+        for slr_ft in range(N_LAYERS):
+            df["travel_time_{}ft" .format(slr_ft)] = travel_time[:, slr_ft]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                df["norm_tt_{}ft" .format(slr_ft)] = travel_time[:, 0]/travel_time[:, slr_ft]
+        df["norm_tt_0ft"] = 1.0
+        return df
+
+    def road_weights(self, RN, slr_ft):
+        """ baseline travel time of each edge at slr_ft (RoadNetwork.travel_times);
+            kept across what-ifs
+        """
+        key = ('road_weights', slr_ft)
+        if key not in self._tables:
+            self._tables[key] = RN.travel_times(slr_ft, 32615)
+        return self._tables[key]
+
+    def route(self, CN, weights, targets):
+        """ travel time from every node (original positions) to the nearest
+            target, routed on the contracted network CN; inf at contracted
+            nodes
+        """
+        from scipy.sparse import csgraph
+
+        graph, edge_of = CN.routing_graph(weights)
+        dist = np.full(len(CN.node_pos), np.inf)
+        dist[CN.nodes] = csgraph.dijkstra(graph, directed=False, indices=CN.node_pos[targets], min_only=True)
+        return dist
+
+    ###########################################################################
+    def threshold_layers(self):
+        """ first slr layer at which each affected asset is damaged (P(DS >=
+            DS_1) > 0), without electricity or with low access (norm_tt <
+            1/1.25), before and after adaptation; 11 if never
+        """
+        tables = self.tables()
+        out = {}
+        frames = [
+            ('bldg_damage', self.mwl.bldg_exp_df, tables['bldg_exp_df'],
+                lambda df, k: 1 - df["slr{}ft_DS_0" .format(k)] > 0),
+            ('elec_no_access', self.mwl.elec_acc_df, tables['elec_acc_df'],
+                lambda df, k: df["elec_{}ft" .format(k)] == 0),
+            ]
+        for runname in self.mwl.destination_points:
+            frames.append(('low_access_{}' .format(runname), self.mwl.trns_acc_df[runname], tables['trns_acc_df'][runname],
+                           lambda df, k: df["norm_tt_{}ft" .format(k)] < 1/1.25))
+
+        for name, base_df, adapted_df, func in frames:
+            for label, table in [('baseline', base_df.loc[adapted_df.index]), (self.name, adapted_df)]:
+                exposed = np.column_stack([func(table, k).values for k in range(N_LAYERS)]).reshape(len(table), N_LAYERS)
+                out[(name, label)] = pd.Series(self.first_layer(exposed), index=table.index)
+        df = pd.DataFrame(out)
+        return self.mwl.registry.decode(df, 'buildings')
+
+    def first_layer(self, exposed):
+        return np.where(exposed.any(axis=1), exposed.argmax(axis=1), N_LAYERS)
+
+    ###########################################################################
+    def run(self, map_name, store=None, baseline=False, **kwargs):
+        """ runs a MapWaterLevels map_* method (e.g. 'map_bldg_impacts') on the
+            affected assets only, with the adapted tables (or the baseline
+            tables of the same assets if baseline is True).
+            returns {(metric, scenario, ne): df} of per-year results indexed by
+            guid; also written to store if one is provided
+        """
+        tables = self.tables()
+        swapped = {
+            'bldg_exp_df': self.mwl.bldg_exp_df.loc[tables['bldg_exp_df'].index] if baseline else tables['bldg_exp_df'],
+            'elec_acc_df': self.mwl.elec_acc_df.loc[tables['elec_acc_df'].index] if baseline else tables['elec_acc_df'],
+            }
+        trns_acc_df = {}
+        for runname in self.mwl.destination_points:
+            adapted = tables['trns_acc_df'][runname]
+            trns_acc_df[runname] = self.mwl.trns_acc_df[runname].loc[adapted.index] if baseline else adapted
+
+        swapped['trns_acc_df'] = trns_acc_df
+        results = self.mwl.run_subset(map_name, swapped, **kwargs)
+
+        if store is not None:
+            for (metric, scenario_name, ne), df in results.items():
+                store.write(metric, scenario_name, ne, df)
+        return results
@@ -0,0 +1,109 @@
+import os, sys
+import numpy as np
+import pandas as pd
+
+from backend import Cache
+
+
+"""
+Integer asset registry.
+Assigns stable int32 ids to the guids of buildings, road nodes and
+substations so that internal tables and arrays can be keyed by ids
+(joins become array gathers). The mapping for each asset kind is persisted
+in output/asset-registry/<kind>.csv (local, ignored by git); ids are never
+reassigned, new guids are appended. GUIDs are restored with decode() when
+results are exported.
+"""
+
+ASSET_KINDS = ['buildings', 'road_nodes', 'substations']
+
+_registries = {}
+
+def get_registry(file_dir=None):
+    """ process-wide AssetRegistry """
+    if file_dir is None:
+        file_dir = os.path.dirname(os.path.realpath(__file__))
+    if file_dir not in _registries:
+        _registries[file_dir] = AssetRegistry(file_dir)
+    return _registries[file_dir]
+
+
+class AssetRegistry():
+    def __init__(self, file_dir=None):
+        if file_dir is None:
+            file_dir = os.path.dirname(os.path.realpath(__file__))
+        self.file_dir = file_dir
+        self.path = os.path.join(self.file_dir, 'output', "asset-registry")
+        self.makedir(self.path)
+        self._lookup = {}       # kind -> pd.Index of guids; position is the id
+
+    def lookup(self, kind):
+        if kind not in ASSET_KINDS:
+            raise ValueError("unknown asset kind: {}" .format(kind))
+        if kind not in self._lookup:
+            self._lookup[kind] = self.read_registry(kind)
+        return self._lookup[kind]
+
+    def read_registry(self, kind):
+        fname = self.registry_fname(kind)
+        if not os.path.exists(fname):
+            return pd.Index([], dtype=object)
+        df = pd.read_csv(fname, dtype={"guid": str})
+        return pd.Index(df['guid'].values)
+
+    def ids(self, kind, guids, add=True):
+        """ int32 ids of guids; unknown guids are registered if add is True.
+            missing guids (NaN/None) are rejected so that they never get an id
+        """
+        guids = pd.Index(guids)
+        if guids.isna().any():
+            raise ValueError("{} guids are missing for {} assets" .format(kind, guids.isna().sum()))
+        guids = guids.astype(str)
+        ids = self.lookup(kind).get_indexer(guids)
+        if (ids < 0).any():
+            if add == False:
+                raise KeyError("{} not in registry: {}" .format(kind, list(guids[ids < 0][:5])))
+            self.register(kind, guids[ids < 0])
+            ids = self.lookup(kind).get_indexer(guids)
+        return ids.astype(np.int32)
+
+    def guids(self, kind, ids):
+        return self.lookup(kind).values[np.asarray(ids)]
+
+    def register(self, kind, guids):
+        """ appends new guids to the registry; locked so that concurrent
+            processes don't assign the same id twice
+        """
+        fname = self.registry_fname(kind)
+        with Cache.FileLock(fname):
+            current = self.read_registry(kind)        # may have been extended by another process
+            new = pd.Index(guids).unique()
+            new = new[current.get_indexer(new) < 0]
+            if len(new) > 0:
+                df_new = pd.DataFrame({"id": np.arange(len(current), len(current)+len(new)), "guid": new})
+                df_new.to_csv(fname, mode='a', header=not os.path.exists(fname), index=False)
+            self._lookup[kind] = current.append(new)
+
+    ###########################################################################
+    def encode(self, df, kind):
+        """ returns df indexed by int32 ids instead of guids """
+        return df.set_axis(pd.Index(self.ids(kind, df.index), name='id'), axis=0)
+
+    def decode(self, df, kind, name='guid'):
+        """ returns df indexed by guids; used when exporting results """
+        return df.set_axis(pd.Index(self.guids(kind, df.index), name=name), axis=0)
+
+    def registry_fname(self, kind):
+        return os.path.join(self.path, '{}.csv' .format(kind))
+
+    def makedir(self, path):
+        """ checking if path exists and making it if it doesn't.
+            if the path doesn't exist, make dir and return False (e.g. didn't exist
+                before)
+            if the path does exist, return True
+        """
+        if not os.path.exists(path):
+            os.makedirs(path, exist_ok=True)
+            return False
+        else:
+            return True
@@ -0,0 +1,134 @@
+import os, sys
+import json
+import hashlib
+import numpy as np
+
+
+"""
+On-disk cache shared by the backend modules. Cached artifacts are stored in
+backend/cache/<name> and keyed by a hash of the parameters and the contents
+of the input files that they were built from, so they are invalidated when
+either changes.
+"""
+
+class DiskCache():
+    _file_hashes = {}       # (path, size, mtime) -> content hash; shared across instances
+
+    def __init__(self, name):
+        self.file_dir = os.path.dirname(os.path.realpath(__file__))
+        self.cache_dir = os.path.join(self.file_dir, 'cache', name)
+        self.makedir(self.cache_dir)
+
+    def hash_key(self, params, files=[]):
+        """ hash of json-serializable parameters and the contents of files """
+        h = hashlib.sha256()
+        h.update(json.dumps(params, sort_keys=True, default=str).encode())
+        for fname in files:
+            h.update(self.hash_file(fname).encode())
+        return h.hexdigest()[:24]
+
+    def hash_file(self, fname):
+        stat = os.stat(fname)
+        stat_key = (os.path.realpath(fname), stat.st_size, stat.st_mtime_ns)
+        if stat_key not in self._file_hashes:
+            h = hashlib.sha256()
+            with open(fname, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    h.update(chunk)
+            self._file_hashes[stat_key] = h.hexdigest()
+        return self._file_hashes[stat_key]
+
+    @staticmethod
+    def hash_array(*arrs):
+        h = hashlib.sha256()
+        for arr in arrs:
+            h.update(np.ascontiguousarray(arr).tobytes())
+        return h.hexdigest()
+
+    def path(self, key, ext):
+        return os.path.join(self.cache_dir, '{}.{}' .format(key, ext))
+
+    def exists(self, key, ext):
+        return os.path.exists(self.path(key, ext))
+
+    ###########################################################################
+    def save_array(self, key, arr, ext='npy'):
+        with self.atomic_write(key, ext) as f:
+            np.save(f, arr, allow_pickle=False)
+
+    def load_array(self, key, ext='npy', mmap_mode='c'):
+        """ memory-mapped (copy-on-write by default) array """
+        return np.load(self.path(key, ext), mmap_mode=mmap_mode, allow_pickle=False)
+
+    def save_json(self, key, d, ext='json'):
+        with self.atomic_write(key, ext, mode='w') as f:
+            json.dump(d, f)
+
+    def load_json(self, key, ext='json'):
+        with open(self.path(key, ext)) as f:
+            return json.load(f)
+
+    def atomic_write(self, key, ext, mode='wb'):
+        return AtomicWrite(self.path(key, ext), mode)
+
+    ###########################################################################
+    def makedir(self, path):
+        """ checking if path exists and making it if it doesn't.
+            if the path doesn't exist, make dir and return False (e.g. didn't exist
+                before)
+            if the path does exist, return True
+        """
+        if not os.path.exists(path):
+            os.makedirs(path, exist_ok=True)
+            return False
+        else:
+            return True
+
+
+class AtomicWrite():
+    """ writes to a temporary file that replaces the target on success so that
+        concurrent readers never see a partially written file
+    """
+    def __init__(self, path, mode='wb'):
+        self.path = path
+        self.tmp_path = '{}.tmp{}' .format(path, os.getpid())
+        self.mode = mode
+
+    def __enter__(self):
+        self.f = open(self.tmp_path, self.mode)
+        return self.f
+
+    def __exit__(self, exc_type, exc, tb):
+        self.f.close()
+        if exc_type is None:
+            os.replace(self.tmp_path, self.path)
+        else:
+            os.remove(self.tmp_path)
+        return False
+
+
+class FileLock():
+    """ exclusive lock on a file (via a sidecar .lock file), e.g. for the
+        read-modify-write of chunks or registries shared by worker processes.
+        no-op where fcntl is unavailable (windows).
+    """
+    def __init__(self, path):
+        self.path = path + ".lock"
+
+    def __enter__(self):
+        self.f = open(self.path, 'a')
+        try:
+            import fcntl
+            fcntl.flock(self.f, fcntl.LOCK_EX)
+        except ImportError:
+            pass
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            import fcntl
+            fcntl.flock(self.f, fcntl.LOCK_UN)
+        except ImportError:
+            pass
+        self.f.close()
+        return False
@@ -0,0 +1,68 @@
+import os, sys
+import subprocess
+
+
+"""
+Import-time budget check for the backend modules.
+Each module is imported in a fresh interpreter (as a worker process in a
+parallel sweep would be) and checked against a time budget. Plotting, IN-CORE
+and NOAA dependencies should only load inside the code paths that use them,
+so importing a backend module must not pull them in.
+
+usage: python -m backend.CheckImportTime
+"""
+
+DEFERRED_MODULES = ['matplotlib', 'geopandas', 'networkx', 'pyincore', 'noaa_coops']
+
+
+def backend_modules():
+    file_dir = os.path.dirname(os.path.realpath(__file__))
+    this_module = os.path.splitext(os.path.basename(__file__))[0]
+    modules = [os.path.splitext(i)[0] for i in sorted(os.listdir(file_dir)) if i.endswith(".py")]
+    return [i for i in modules if i != this_module]
+
+
+def time_import(module, deferred_modules=DEFERRED_MODULES):
+    """ imports backend.<module> in a new interpreter
+        returns import time (s), the deferred modules that were loaded anyway,
+        and the last line of stderr if the import failed (None otherwise)
+    """
+    repo_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+    code = ("import sys, time\n"
+            "t0 = time.perf_counter()\n"
+            "import backend.{}\n"
+            "print(time.perf_counter() - t0)\n"
+            "print(','.join(m for m in {!r} if m in sys.modules))\n" .format(module, deferred_modules))
+    out = subprocess.run([sys.executable, '-c', code], cwd=repo_dir, capture_output=True, text=True)
+    if out.returncode != 0:
+        stderr = out.stderr.strip().split("\n")
+        return float('nan'), [], stderr[-1] if stderr[-1] else "exit code {}" .format(out.returncode)
+    lines = out.stdout.strip().split("\n")
+    import_time = float(lines[0])
+    loaded = [i for i in lines[1].split(",") if i] if len(lines) > 1 else []
+    return import_time, loaded, None
+
+
+def check_import_time(modules=None, budget_s=1.5, deferred_modules=DEFERRED_MODULES):
+    """ returns list of (module, import time, loaded deferred modules, 
+        import error) that fail to import, exceed the budget or import a 
+        deferred module
+    """
+    if modules is None:
+        modules = backend_modules()
+
+    failures = []
+    for module in modules:
+        import_time, loaded, error = time_import(module, deferred_modules)
+        ok = (error is None) and (import_time <= budget_s) and (len(loaded) == 0)
+        detail = error if error is not None else ", ".join(loaded)
+        time_str = "{:6.2f}s" .format(import_time) if error is None else "      -"
+        print("{:<28} {}  {}  {}" .format(module, time_str, "ok  " if ok else "FAIL", detail))
+        if not ok:
+            failures.append((module, import_time, loaded, error))
+    return failures
+
+
+if __name__ == "__main__":
+    failures = check_import_time()
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,115 @@
+import os, sys
+import numpy as np
+import pandas as pd
+
+
+"""
+Expected annual damage (EAD) engine.
+Building losses at each slr layer are the damage state probabilities
+(CombineBuildingExpSLR: slr{n}ft_DS_0 - DS_3) weighted by repair cost ratios
+and the building replacement cost, i.e. an assets x layers x states tensor
+contraction. Annual losses follow from the per-year histograms of the layers
+reached by the largest water level events in each year, for all scenarios and
+nonexceedance probabilities at once.
+
+The repair cost ratios are an input of the study (e.g. the HAZUS flood
+damage-to-loss ratios for the building occupancies); there is no default.
+
+e.g.
+    ED = ExpectedDamage(mwl, repair_ratios=[0.0, 0.1, 0.5, 1.0])   # illustrative values
+    df = ED.island_losses(discount_rate=0.03)
+"""
+
+N_LAYERS = 11
+
+
+class ExpectedDamage():
+    def __init__(self, mwl, repair_ratios, value_col='repl_cst'):
+        """ mwl: MapWaterLevelsToImpacts.MapWaterLevels instance (provides the
+                building exposure, inventory and water levels)
+            repair_ratios: repair cost as a fraction of the replacement cost 
+                for DS_0 - DS_3
+        """
+        self.mwl = mwl
+        self.repair_ratios = np.asarray(repair_ratios, dtype=float)
+        self.value_col = value_col
+
+    def ds_tensor(self):
+        """ (assets x slr layers x damage states) damage state probabilities """
+        df = self.mwl.bldg_exp_df
+        n_states = len(self.repair_ratios)
+        cols = ["slr{}ft_DS_{}" .format(slr_ft, ds) for slr_ft in range(N_LAYERS) for ds in range(n_states)]
+        return df[cols].values.astype(float).reshape(len(df), N_LAYERS, n_states)
+
+    def building_values(self):
+        return self.mwl.bldg_df[self.value_col].reindex(self.mwl.bldg_exp_df.index).fillna(0).values.astype(float)
+
+    def layer_losses(self):
+        """ (assets x slr layers) expected loss of a water level event at each layer """
+        return np.einsum('als,s,a->al', self.ds_tensor(), self.repair_ratios, self.building_values())
+
+    ###########################################################################
+    def event_histogram(self, scenario, ne, n_events=1):
+        """ (years x slr layers) number of the n_events largest daily water
+            levels in each year at each slr layer (n_events=1: annual max)
+        """
+        max_elev = self.mwl.daily_max_elev(scenario, ne)
+        df = pd.DataFrame({"year": max_elev.index.year, "elev": max_elev.values})
+        df = df.sort_values(["year", "elev"], ascending=[True, False])
+        df = df.loc[df.groupby("year").cumcount() < n_events]
+
+        years = self.mwl.waterlevels.index.year.unique().to_list()
+        year_pos = pd.Index(years).get_indexer(df["year"])
+        hist = np.zeros((len(years), N_LAYERS))
+        np.add.at(hist, (year_pos, self.mwl.return_slr_layers(df["elev"].values)), 1)
+        return hist, years
+
+    def grid_histograms(self, scenarios=None, n_events=1):
+        """ (scenarios x nes x years x slr layers) event histograms """
+        if scenarios == None:
+            source = list(self.mwl.scenarios.keys())[0]
+            scenarios = self.mwl.scenarios[source]
+        hists = np.stack([np.stack([self.event_histogram(scenario, ne, n_events)[0]
+                                    for ne in self.mwl.nonexceendance_probs])
+                          for scenario in scenarios])
+        years = self.mwl.waterlevels.index.year.unique().to_list()
+        return hists, scenarios, years
+
+    ###########################################################################
+    def building_losses(self, scenarios=None, n_events=1, write=False, store=None):
+        """ (scenarios x nes x assets x years) expected losses per building and
+            year; written with MapWaterLevels.write_out ('EAL') if write is True
+        """
+        hists, scenarios, years = self.grid_histograms(scenarios, n_events)
+        losses = np.einsum('al,snyl->snay', self.layer_losses(), hists)
+        if write:
+            for scenario_i, scenario in enumerate(scenarios):
+                for ne_i, ne in enumerate(self.mwl.nonexceendance_probs):
+                    df = pd.DataFrame(losses[scenario_i, ne_i], index=self.mwl.bldg_exp_df.index, columns=years)
+                    self.mwl.write_out(df, 'EAL', self.mwl.scenario_to_name(scenario), ne, store)
+        return losses
+
+    def island_losses(self, scenarios=None, n_events=1, discount_rate=0.0, base_year=None):
+        """ island total expected losses per year for each (scenario, ne),
+            discounted to base_year (default first year) at discount_rate.
+            summing over buildings before applying the histograms, so the
+            building x year grid is never formed.
+        """
+        hists, scenarios, years = self.grid_histograms(scenarios, n_events)
+        totals = hists @ self.layer_losses().sum(axis=0)             # scenarios x nes x years
+
+        if base_year is None:
+            base_year = years[0]
+        discount = (1 + discount_rate)**-(np.asarray(years) - base_year)
+        totals = totals*discount
+
+        index = pd.MultiIndex.from_product([[self.mwl.scenario_to_name(i) for i in scenarios],
+                                            self.mwl.nonexceendance_probs], names=["scenario", "ne"])
+        df = pd.DataFrame(totals.reshape(-1, len(years)), index=index, columns=years)
+        df["total"] = df[years].sum(axis=1)
+        return df
+
+    def write_island_losses(self, df, discount_rate=0.0):
+        fn = os.path.join(self.mwl.path_out, "EAL_island_r{}.csv" .format(discount_rate))
+        df.to_csv(fn)
+
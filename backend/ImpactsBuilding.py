@@ -1,11 +1,9 @@
 import os, sys
 import pandas as pd
 import json
-import geopandas as gpd
 
-from pyincore import IncoreClient, Dataset, FragilityService, DataService, MappingSet, HazardService, FragilityCurveSet, Mapping, Flood
-from pyincore.analyses.housingunitallocation import HousingUnitAllocation
-from pyincore.analyses.buildingdamage import BuildingDamage
+from backend import AssetRegistry
+from backend import Inventory
 
 
 """
@@ -19,6 +17,8 @@ TODO:
 
 class BuildingExposureSLR():
     def __init__(self):
+        from pyincore import IncoreClient
+
         self.client = IncoreClient()
         self.file_dir = os.path.dirname(os.path.realpath(__file__))
         self.output_dir = os.path.join(self.file_dir, 'output', "buildings")
@@ -30,6 +30,8 @@ class BuildingExposureSLR():
         self.RunSLRDmg(bldg_dataset, slr_ft)
     
     def read_bldg_dataset_local(self):
+        from pyincore import Dataset
+
         path_to_bldg_dataset = os.path.join(self.file_dir, "infrastructure", 'bldgs_drs.json')
         bldg_dataset = Dataset.from_file(path_to_bldg_dataset, data_type="ergo:buildingInventoryVer7")
         return bldg_dataset
@@ -43,6 +45,8 @@ class BuildingExposureSLR():
                     - I'm unsure how DS0, DS1, and DS2 are combined to get fragility 
                       curves in IN-CORE. DS3 matches.
         """
+        from pyincore.analyses.buildingdamage import BuildingDamage
+
         hazard_type = "flood"                                                  # Galveston deterministic Hurricane, 3 datasets - Kriging
 
         # SLR building content dmg mapping
@@ -70,6 +74,8 @@ class BuildingExposureSLR():
         return flood
 
     def define_dataset_json(self, SLR_ft):
+        from pyincore import Flood
+
         slr_dataset_data = {
           "name":"Galveston SLR - {}ft. (MHHW)" .format(SLR_ft),
           "description":"Galveston Sea Level Rise (SLR) - {}ft. (above MHHW); Data from NOAA Digital Coast; SLR relative to MHHW; Map of inundation footprint in feet." .format(SLR_ft),
@@ -91,6 +97,8 @@ class BuildingExposureSLR():
         return Flood.from_json_str(json.dumps(slr_dataset_data))
 
     def create_mappingset_slr(self):
+        from pyincore import FragilityService
+
         fragilitysvc = FragilityService(self.client)                           # setting up IN-CORE fragility service
         existing_flood_mapping = self.read_existing_flood_mapping(fragilitysvc) # getting existing flood mapping (for content damage)
         # dfr3_mapping_template = self.read_mapping_template()                   # read template for new mapping
@@ -114,6 +122,8 @@ class BuildingExposureSLR():
         sets up fragilty sets for each archetyp
         returns dictionary of archetyp number (key): fragility set (value)
         """
+        from pyincore import FragilityCurveSet
+
         frag_sets = {}
 
         # loop through each mapping in the mapping set
@@ -174,6 +184,8 @@ class BuildingExposureSLR():
             set provided by the previous functions
             returns pyincore mapping set
         """
+        from pyincore import MappingSet, Mapping
+
         newmapping = existing_flood_mapping.copy()
         del newmapping['id']                # removing; updating later
         del newmapping['name']              # removing; updating later
@@ -231,6 +243,7 @@ class CombineBuildingExpSLR:
 
     def combine_bldg_dmg(self):
         path_to_bldg_dmg = os.path.join(self.file_dir,  'output', 'buildings')
+        registry = AssetRegistry.get_registry(self.file_dir)
         combined_df = pd.DataFrame()
         
         for slr in range(self.slr_start, self.slr_end+1):
@@ -238,6 +251,7 @@ class CombineBuildingExpSLR:
             fname = os.path.join(path_to_bldg_dmg, fname)
             df = pd.read_csv(fname)
             df.set_index('guid', inplace=True)
+            df = registry.encode(df, 'buildings')       # joining on int ids
             if slr == 0:
                 combined_df.index = df.index
 
@@ -252,14 +266,12 @@ class CombineBuildingExpSLR:
                             }
             df.rename(columns=rename_dict, inplace=True)
             combined_df = pd.merge(combined_df, df, left_index=True, right_index=True)
-        return combined_df
+        return registry.decode(combined_df, 'buildings')
 
 
 
     def read_bldg_df(self):
-        path_to_bldgs = os.path.join(self.file_dir, "infrastructure", 'bldgs_drs.json')
-        gdf = gpd.read_file(path_to_bldgs)
-        gdf.set_index('guid', inplace=True)
+        gdf = Inventory.get_inventory(self.file_dir).read()
 
         return gdf
 
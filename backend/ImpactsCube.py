@@ -0,0 +1,213 @@
+import os, sys
+import json
+import numpy as np
+import pandas as pd
+
+from backend import Cache
+
+
+"""
+Chunked store for the impacts-time results: an asset x year x scenario x
+percentile (ne) x metric cube. Metrics are the MapWaterLevels output prefixes
+(e.g. 'nTimesExp', 'nNoAccess', 'nTTIncrease_utmb-hospital').
+
+Each (metric, scenario, ne) slab is split into asset x year chunks that are
+stored as separate compressed files, so that reading one year or one asset's
+history only touches the chunks that contain it. Chunks are written
+atomically under a per-chunk file lock, so concurrent sweep workers can fill
+the store. The asset and year axes are the union of the assets and years
+written so far: new ones are appended under a lock on the store's metadata,
+so existing positions (and chunks) never move, and chunks written before an
+axis grew are padded with NaN when they are read.
+
+layout:
+    impacts-cube/meta.json, assets.npy
+    impacts-cube/<metric>/sc<scenario>_ne<ne>/<asset chunk>.<year chunk>.npz
+"""
+
+class ImpactCubeStore():
+    def __init__(self, path=None, asset_chunk=2048, year_chunk=16):
+        self.file_dir = os.path.dirname(os.path.realpath(__file__))
+        if path is None:
+            path = os.path.join(self.file_dir, 'output', "impacts-cube")
+        self.path = path
+        self.makedir(self.path)
+        self.asset_chunk = asset_chunk
+        self.year_chunk = year_chunk
+        self.meta = None
+        self.assets = None
+        self.read_meta()
+
+    def read_meta(self):
+        path_to_meta = os.path.join(self.path, "meta.json")
+        if not os.path.exists(path_to_meta):
+            return
+        with open(path_to_meta) as f:
+            self.meta = json.load(f)
+        self.asset_chunk = self.meta['asset_chunk']
+        self.year_chunk = self.meta['year_chunk']
+        assets = np.load(os.path.join(self.path, "assets.npy"), allow_pickle=False)
+        self.assets = pd.Index(assets)
+        self.years = pd.Index(self.meta['years'])
+
+    def create(self, assets, years):
+        """ sets or extends the asset (guid) and year coordinates of the 
+            store; assets and years that are not in the store are appended.
+            the metadata is re-read under the lock, so concurrent workers 
+            agree on the coordinates.
+        """
+        with Cache.FileLock(os.path.join(self.path, "meta.json")):
+            self.read_meta()
+            assets = pd.Index(assets).astype(str)
+            years = pd.Index(years).astype(int)
+            if self.meta is not None:
+                assets = self.assets.append(assets[self.assets.get_indexer(assets) < 0].unique())
+                years = self.years.append(years[self.years.get_indexer(years) < 0].unique())
+                if len(assets) == len(self.assets) and len(years) == len(self.years):
+                    return
+            else:
+                assets, years = assets.unique(), years.unique()
+            with Cache.AtomicWrite(os.path.join(self.path, "assets.npy")) as f:
+                np.save(f, np.asarray(assets).astype(str), allow_pickle=False)
+            meta = {
+                "years": [int(i) for i in years],
+                "asset_chunk": self.asset_chunk,
+                "year_chunk": self.year_chunk,
+                }
+            with Cache.AtomicWrite(os.path.join(self.path, "meta.json"), mode='w') as f:
+                json.dump(meta, f)
+            self.read_meta()
+
+    ###########################################################################
+    def write(self, metric, scenario, ne, df):
+        """ writes an (assets x years) dataframe, e.g. the output of
+            MapWaterLevels.map_bldg_impacts, to the store.
+            assets and years that are not in the store yet are appended.
+        """
+        if (self.meta is None or (self.assets.get_indexer(pd.Index(df.index).astype(str)) < 0).any()
+                or (self.years.get_indexer(pd.Index(df.columns).astype(int)) < 0).any()):
+            self.create(df.index, df.columns)
+        rows = self.asset_positions(df.index)
+        cols = self.year_positions(df.columns)
+        values = df.values.astype(np.float32)
+
+        a_chunks = rows // self.asset_chunk
+        y_chunks = cols // self.year_chunk
+        for a_i in np.unique(a_chunks):
+            r_mask = a_chunks == a_i
+            for y_i in np.unique(y_chunks):
+                c_mask = y_chunks == y_i
+                self.write_chunk(metric, scenario, ne, a_i, y_i,
+                                 rows[r_mask] - a_i*self.asset_chunk,
+                                 cols[c_mask] - y_i*self.year_chunk,
+                                 values[np.ix_(r_mask, c_mask)])
+
+    def write_chunk(self, metric, scenario, ne, a_i, y_i, rows, cols, block):
+        path_to_chunk = self.chunk_path(metric, scenario, ne, a_i, y_i)
+        self.makedir(os.path.dirname(path_to_chunk))
+        with Cache.FileLock(path_to_chunk):
+            chunk = self.read_chunk(metric, scenario, ne, a_i, y_i)
+            chunk[np.ix_(rows, cols)] = block
+            with Cache.AtomicWrite(path_to_chunk) as f:
+                np.savez_compressed(f, values=chunk)
+
+    ###########################################################################
+    def read(self, metric, scenario, ne, assets=None, years=None):
+        """ (assets x years) dataframe; only the chunks that contain the
+            requested assets and years are read
+        """
+        rows = np.arange(len(self.assets)) if assets is None else self.asset_positions(assets)
+        cols = np.arange(len(self.years)) if years is None else self.year_positions(years)
+        out = np.full((len(rows), len(cols)), np.nan, dtype=np.float32)
+
+        a_chunks = rows // self.asset_chunk
+        y_chunks = cols // self.year_chunk
+        for a_i in np.unique(a_chunks):
+            r_mask = a_chunks == a_i
+            for y_i in np.unique(y_chunks):
+                c_mask = y_chunks == y_i
+                chunk = self.read_chunk(metric, scenario, ne, a_i, y_i)
+                out[np.ix_(r_mask, c_mask)] = chunk[np.ix_(rows[r_mask] - a_i*self.asset_chunk,
+                                                           cols[c_mask] - y_i*self.year_chunk)]
+        return pd.DataFrame(out, index=self.assets[rows], columns=self.years[cols])
+
+    def read_year(self, metric, scenario, ne, year):
+        return self.read(metric, scenario, ne, years=[year])[year]
+
+    def read_asset(self, metric, scenario, ne, guid):
+        return self.read(metric, scenario, ne, assets=[guid]).loc[guid]
+
+    def read_cube(self, metric, scenarios, nes, assets=None, years=None):
+        """ (assets x years x scenarios x nes) array for one metric """
+        return np.stack([np.stack([self.read(metric, scenario, ne, assets, years).values for ne in nes], axis=-1)
+                         for scenario in scenarios], axis=-2)
+
+    def read_chunk(self, metric, scenario, ne, a_i, y_i):
+        path_to_chunk = self.chunk_path(metric, scenario, ne, a_i, y_i)
+        shape = self.chunk_shape(a_i, y_i)
+        if not os.path.exists(path_to_chunk):
+            return np.full(shape, np.nan, dtype=np.float32)
+        with np.load(path_to_chunk) as npz:
+            values = npz['values']
+        if values.shape != shape:
+            # written before an axis grew (or after, by another worker); padded with NaN
+            padded = np.full(np.maximum(values.shape, shape), np.nan, dtype=np.float32)
+            padded[:values.shape[0], :values.shape[1]] = values
+            values = padded
+        return values
+
+    ###########################################################################
+    def to_csv(self, metric, scenario, ne, path_out=None):
+        """ exports one (metric, scenario, ne) slab in the same format as the
+            MapWaterLevels csv files
+        """
+        if path_out is None:
+            path_out = os.path.join(self.file_dir, 'output', "impacts-time")
+        if "_" in metric:
+            prefix, runname = metric.split("_", 1)
+            fn = '{}_years_sc{}_ne{}_{}.csv' .format(prefix, scenario, ne, runname)
+        else:
+            fn = '{}_years_sc{}_ne{}.csv' .format(metric, scenario, ne)
+        df = self.read(metric, scenario, ne)
+        df.index.name = "guid"
+        df.to_csv(os.path.join(path_out, fn))
+        return fn
+
+    def metrics(self):
+        return sorted([i for i in os.listdir(self.path) if os.path.isdir(os.path.join(self.path, i))])
+
+    def has_slab(self, metric, scenario, ne):
+        """ True if any chunk of the (metric, scenario, ne) slab was written """
+        return os.path.isdir(os.path.join(self.path, metric, "sc{}_ne{}" .format(scenario, ne)))
+
+    def asset_positions(self, assets):
+        rows = self.assets.get_indexer(pd.Index(assets).astype(str))
+        if (rows < 0).any():
+            raise KeyError("assets not in store: {}" .format(list(pd.Index(assets)[rows < 0][:5])))
+        return rows
+
+    def year_positions(self, years):
+        cols = self.years.get_indexer(pd.Index(years).astype(int))
+        if (cols < 0).any():
+            raise KeyError("years not in store: {}" .format(list(pd.Index(years)[cols < 0])))
+        return cols
+
+    def chunk_shape(self, a_i, y_i):
+        n_rows = min(self.asset_chunk, len(self.assets) - a_i*self.asset_chunk)
+        n_cols = min(self.year_chunk, len(self.years) - y_i*self.year_chunk)
+        return (n_rows, n_cols)
+
+    def chunk_path(self, metric, scenario, ne, a_i, y_i):
+        return os.path.join(self.path, metric, "sc{}_ne{}" .format(scenario, ne), "{}.{}.npz" .format(a_i, y_i))
+
+    def makedir(self, path):
+        """ checking if path exists and making it if it doesn't.
+            if the path doesn't exist, make dir and return False (e.g. didn't exist
+                before)
+            if the path does exist, return True
+        """
+        if not os.path.exists(path):
+            os.makedirs(path, exist_ok=True)
+            return False
+        else:
+            return True
@@ -1,12 +1,11 @@
 import os, sys
 import numpy as np
 import pandas as pd
-import geopandas as gpd
-import json
-import networkx as nx
 
-import time
-from pyincore import IncoreClient, GeoUtil, Flood
+from backend import AssetRegistry
+from backend import ImpactsElectricNetwork
+from backend import Inventory
+from backend import RasterAccess
 
 """
 TODO: 
@@ -24,13 +23,12 @@ class electricity_access():
         self.read_bldg2elec_df()
 
     def read_bldg_inv(self):
-        path_to_bldg_inv = os.path.join(self.file_dir, "infrastructure", 'bldgs_drs.json')
-        G_df = gpd.read_file(path_to_bldg_inv)
-        G_df.to_crs(epsg=4269, inplace=True)
-        G_df.set_index("guid", inplace=True)
+        G_df = Inventory.get_inventory(self.file_dir).read(crs=4269)
         self.bldg_df = G_df
 
     def read_elec_inv(self):
+        import geopandas as gpd
+
         path_to_elec_inv = os.path.join(self.file_dir, "infrastructure", 'substation-galveston.shp')
         G_df = gpd.read_file(path_to_elec_inv)
         G_df.to_crs(epsg=4269, inplace=True)
@@ -50,50 +48,92 @@ class electricity_access():
         path_to_ss_exposure = os.path.join(self.file_dir, "output", "electric", "substation-exposure-{}ft.csv" .format(slr_ft))
         substation_exposure = pd.read_csv(path_to_ss_exposure)
         substation_exposure.set_index("guid", inplace=True)
-        df_out = pd.merge(self.bldg2elec_df, substation_exposure["haz_expose"], left_on="node_guid", right_index=True)
-        df_out['elec'] = ~df_out['haz_expose']
-        df_out['elec'] = df_out['elec']*1
-        del df_out['haz_expose']
+
+        # joining buildings to substations by int id (array gather)
+        registry = AssetRegistry.get_registry(self.file_dir)
+        ss_ids = registry.ids('substations', substation_exposure.index)
+        node_ids = registry.ids('substations', self.bldg2elec_df['node_guid'])
+        haz_expose = np.full(len(registry.lookup('substations')), -1, dtype=np.int8)     # -1: no exposure result
+        haz_expose[ss_ids] = substation_exposure['haz_expose'].values
+        bldg_haz_expose = haz_expose[node_ids]
+
+        df_out = self.bldg2elec_df.loc[bldg_haz_expose >= 0].copy()
+        df_out['elec'] = 1 - bldg_haz_expose[bldg_haz_expose >= 0]
         
         self.write_out(df_out, slr_ft, "elec-access")
 
+    def run_elec_access_all_levels(self, slr_levels=range(0, 11), write_levels=True, network=None):
+        """ electric access for all slr levels at once.
+            building access only depends on the substation that serves it, so
+            the (buildings x levels) access matrix is a single gather from the
+            (substations x levels) exposure matrix.
+            writes elec-accs-combined.csv (replaces combine_elec_access) and,
+            if write_levels, the per-level elec-access files.
+            network: ElectricNetwork for cascading failures; defaults to the
+                topology in infrastructure (single hop if there is none).
+        """
+        slr_levels = list(slr_levels)
+        registry = AssetRegistry.get_registry(self.file_dir)
+        if network is None:
+            network = ImpactsElectricNetwork.ElectricNetwork(self.file_dir)
+        ss_exposure = self.substation_exposure_matrix(slr_levels)
+        ss_exposure = network.substation_outage(ss_exposure)          # de-energized substations
+        node_ids = registry.ids('substations', self.bldg2elec_df['node_guid'])
+        bldg_exposure = ss_exposure[node_ids]                   # buildings x levels
+
+        if write_levels:
+            for slr_i, slr_ft in enumerate(slr_levels):
+                valid = bldg_exposure[:, slr_i] >= 0
+                df_out = self.bldg2elec_df.loc[valid].copy()
+                df_out['elec'] = 1 - bldg_exposure[valid, slr_i]
+                self.write_out(df_out, slr_ft, "elec-access")
+
+        valid = (bldg_exposure >= 0).all(axis=1)        # buildings w/ results at all levels (as in the combine step)
+        combined_df = pd.DataFrame(1 - bldg_exposure[valid],
+                                   index=pd.Index(self.bldg2elec_df.index[valid], name="guid"),
+                                   columns=["elec_{}ft" .format(slr_ft) for slr_ft in slr_levels])
+        fn_out = os.path.join(self.file_dir,  'output', "elec-accs-combined.csv")
+        combined_df.to_csv(fn_out)
+        return combined_df
+
+    def substation_exposure_matrix(self, slr_levels):
+        """ (substation ids x levels) int8 array; 1 exposed, 0 not exposed,
+            -1 no exposure result
+        """
+        registry = AssetRegistry.get_registry(self.file_dir)
+        exposure = {}
+        for slr_ft in slr_levels:
+            path_to_ss_exposure = os.path.join(self.file_dir, "output", "electric", "substation-exposure-{}ft.csv" .format(slr_ft))
+            substation_exposure = pd.read_csv(path_to_ss_exposure)
+            exposure[slr_ft] = (registry.ids('substations', substation_exposure['guid']), substation_exposure['haz_expose'].values)
+        registry.ids('substations', self.bldg2elec_df['node_guid'])        # registering any unmapped substations
+
+        ss_exposure = np.full((len(registry.lookup('substations')), len(slr_levels)), -1, dtype=np.int8)
+        for slr_i, slr_ft in enumerate(slr_levels):
+            ss_ids, haz_expose = exposure[slr_ft]
+            ss_exposure[ss_ids, slr_i] = haz_expose
+        return ss_exposure
+
 
 
     ###########################################################################
     def run_slr_exposure(self, gdf, slr_ft):
-        flood = self.setup_local_hazard(slr_ft)
-        hazard_type = "flood"                                                  # Galveston deterministic Hurricane, 3 datasets - Kriging
-
-        hazard_im = []
-        haz_expose = []
-        cnt = 0
-        for ss_i, ss in gdf.iterrows():
-            location = GeoUtil.get_location(ss)
-            loc = str(location.y) + "," + str(location.x)
-            payload = [
-                        {
-                             "demands": ["inundationDepth"],
-                             "units": ["ft"],
-                             "loc": loc
-                         }
-                     ]
-            values = flood.read_hazard_values(payload)
-            haz_val = values[0]['hazardValues'][0]
-            if haz_val < 0:
-                hazard_im.append(0)
-                haz_expose.append(False)
-            else:
-                hazard_im.append(haz_val)
-                haz_expose.append(True)
-
-            cnt += 1
+        """ inundation depth at each substation; only the raster blocks that
+            contain substations are read (RasterAccess)
+        """
+        path_to_raster = RasterAccess.slr_raster_path(slr_ft, self.file_dir)
+        with RasterAccess.RasterAccess(path_to_raster) as ra:
+            haz_val = ra.sample(np.column_stack([gdf.geometry.x, gdf.geometry.y]), gdf.crs, 'substations')
 
+        haz_expose = haz_val >= 0           # nodata or negative values are not exposed
         gdf_out = pd.DataFrame(index=gdf.index)
-        gdf_out['hazard_values'] = hazard_im
+        gdf_out['hazard_values'] = np.where(haz_expose, haz_val, 0)
         gdf_out['haz_expose'] = haz_expose
         self.write_out(gdf_out, slr_ft, 'substation-exposure')
 
     def setup_local_hazard(self, slr_ft):
+        from pyincore import Flood
+
         path_to_data = os.path.join(self.file_dir, "inundation-rasters")
 
         # create the flood object
@@ -108,6 +148,7 @@ class electricity_access():
 
     def combine_elec_access(self):
         path_to_elec_accs = os.path.join(self.file_dir,  'output', "electric")
+        registry = AssetRegistry.get_registry(self.file_dir)
         combined_df = pd.DataFrame()
         
         for slr in range(0,11):
@@ -116,6 +157,7 @@ class electricity_access():
             df = pd.read_csv(fname)
             df.rename(columns={"bldg_guid":"guid"}, inplace=True)
             df.set_index('guid', inplace=True)
+            df = registry.encode(df, 'buildings')       # joining on int ids
             if slr == 0:
                 combined_df.index = df.index
             df = pd.DataFrame(df['elec'])
@@ -126,6 +168,7 @@ class electricity_access():
             combined_df = pd.merge(combined_df, df, left_index=True, right_index=True)
         
 
+        combined_df = registry.decode(combined_df, 'buildings')
         fn_out = os.path.join(self.file_dir,  'output', "elec-accs-combined.csv")
         combined_df.to_csv(fn_out)
 
@@ -164,9 +207,9 @@ if __name__ == "__main__":
         print()
 
 
-    # # combining results
+    # # combining results (access at all levels from one gather)
     ea = electricity_access()
-    df = ea.combine_elec_access()
+    df = ea.run_elec_access_all_levels()
 
 
 
@@ -0,0 +1,103 @@
+import os, sys
+import numpy as np
+import pandas as pd
+
+from backend import AssetRegistry
+
+
+"""
+Cascading electric network model.
+The substation/feeder topology is read from a csv of directed edges
+(from_guid -> to_guid, upstream to downstream). A node is energized if it has
+not failed and it is a source (no upstream edges, unless sources are given) or
+any of its upstream nodes is energized.
+
+Failure states are evaluated in batches: failures are a (nodes x states)
+boolean matrix and energized reachability is propagated for all states at once
+with the sparse adjacency matrix (one sparse-dense product per hop). States can
+be the 11 slr layers, in which case the result for any time step is a gather by
+layer, or e.g. one state per day.
+
+Without a topology file the model falls back to the single-hop result, i.e. a
+substation has no power only if it is inundated.
+"""
+
+class ElectricNetwork():
+    def __init__(self, file_dir=None, path_to_topology=None, sources=None):
+        if file_dir is None:
+            file_dir = os.path.dirname(os.path.realpath(__file__))
+        self.file_dir = file_dir
+        if path_to_topology is None:
+            path_to_topology = os.path.join(self.file_dir, "infrastructure", "elec-network-galveston.csv")
+        self.path_to_topology = path_to_topology
+        self.nodes = None               # pd.Index of node guids; position is the node index
+        self.adjacency_T = None         # csr (nodes x nodes); [v, u] = 1 for edge u -> v
+        self.is_source = None
+        self.read_topology(sources)
+
+    @property
+    def has_topology(self):
+        return self.nodes is not None
+
+    def read_topology(self, sources=None):
+        if not os.path.exists(self.path_to_topology):
+            return
+        from scipy import sparse
+
+        edges = pd.read_csv(self.path_to_topology, dtype={"from_guid": str, "to_guid": str})
+        self.nodes = pd.Index(pd.unique(np.concatenate([edges['from_guid'].values, edges['to_guid'].values])))
+        u = self.nodes.get_indexer(edges['from_guid'])
+        v = self.nodes.get_indexer(edges['to_guid'])
+        n = len(self.nodes)
+        self.adjacency_T = sparse.csr_matrix((np.ones(len(u), dtype=np.float32), (v, u)), shape=(n, n))
+
+        if sources is None:
+            self.is_source = np.diff(self.adjacency_T.indptr) == 0         # no upstream edges
+        else:
+            self.is_source = np.zeros(n, dtype=bool)
+            self.is_source[self.nodes.get_indexer(pd.Index(sources).astype(str))] = True
+
+    ###########################################################################
+    def energized(self, failed):
+        """ failed: (nodes x states) boolean matrix of failed nodes.
+            returns the (nodes x states) boolean matrix of energized nodes.
+        """
+        failed = np.asarray(failed, dtype=bool)
+        if self.has_topology == False:
+            return ~failed
+
+        energized = self.is_source[:, None] & ~failed
+        for hop in range(len(self.nodes)):
+            reached = (self.adjacency_T @ energized.astype(np.float32)) > 0
+            energized_new = (energized | reached) & ~failed
+            if (energized_new == energized).all():
+                break
+            energized = energized_new
+        return energized
+
+    def substation_outage(self, ss_exposure):
+        """ ss_exposure: (substation ids x states) int8 array; 1 inundated,
+                0 not inundated, -1 no exposure result (see
+                electricity_access.substation_exposure_matrix)
+            returns an array of the same shape with 1 where the substation is
+                de-energized. substations that are not in the topology keep
+                their single-hop result; other network nodes (e.g. feeders)
+                are assumed not to fail.
+        """
+        if self.has_topology == False:
+            return ss_exposure
+
+        registry = AssetRegistry.get_registry(self.file_dir)
+        ss_guids = registry.lookup('substations')
+        node_pos = self.nodes.get_indexer(ss_guids)
+        in_network = node_pos >= 0
+
+        failed = np.zeros((len(self.nodes), ss_exposure.shape[1]), dtype=bool)
+        failed[node_pos[in_network]] = ss_exposure[in_network] == 1
+        energized = self.energized(failed)
+
+        ss_outage = ss_exposure.copy()
+        outage = (~energized[node_pos[in_network]]).astype(np.int8)
+        ss_outage[in_network] = np.where(ss_exposure[in_network] >= 0, outage, -1)
+        return ss_outage
+
@@ -0,0 +1,85 @@
+import os, sys
+import numpy as np
+import pandas as pd
+
+from backend import Inventory
+
+
+"""
+Streaming island-wide summaries of the impacts-time results.
+SummaryReducer has the same write(metric, scenario, ne, df) interface as
+ImpactsCube.ImpactCubeStore, so it can be passed as the store of any
+MapWaterLevels map_* method. Each (assets x years) result is reduced to per-year
+counts, sums, quantiles and histograms as it is produced (optionally grouped by
+a building inventory attribute, e.g. occupancy type), and the per-asset table
+is discarded.
+
+e.g.
+    R = SummaryReducer(count_at_least=[1, 30], quantiles=[0.5, 0.9], group_by='occ_type')
+    MWL.map_bldg_impacts(store=R)
+    df = R.results()
+"""
+
+class SummaryReducer():
+    def __init__(self, count_at_least=[1], sums=True, quantiles=[], bins=None, group_by=None, file_dir=None):
+        """ count_at_least: number of assets with at least K (days, events, ...) per year
+            sums: total over assets per year (e.g. building-days without power)
+            quantiles: quantiles over assets per year
+            bins: histogram bin edges; number of assets in each bin per year
+            group_by: building inventory attribute to group assets by
+        """
+        self.count_at_least = list(count_at_least)
+        self.sums = sums
+        self.quantiles = list(quantiles)
+        self.bins = bins
+        self.group_by = group_by
+        if file_dir is None:
+            file_dir = os.path.dirname(os.path.realpath(__file__))
+        self.file_dir = file_dir
+        self._groups = None
+        self._rows = {}         # (metric, scenario, ne, group, stat) -> per-year series
+
+    def groups(self, index):
+        """ group label of each asset (guid index) """
+        if self.group_by is None:
+            return np.full(len(index), 'all', dtype=object)
+        if self._groups is None:
+            inv = Inventory.get_inventory(self.file_dir)
+            self._groups = inv.read([self.group_by], geometry=False)[self.group_by]
+        return self._groups.reindex(index).fillna('NA').astype(str).values
+
+    ###########################################################################
+    def write(self, metric, scenario, ne, df):
+        """ reduces an (assets x years) dataframe; same interface as
+            ImpactCubeStore.write so that it can be used as a map_* store
+        """
+        labels = self.groups(df.index)
+        stats = {}
+        for K in self.count_at_least:
+            stats['count>={}' .format(K)] = (df >= K).groupby(labels).sum()
+        if self.sums:
+            stats['sum'] = df.groupby(labels).sum()
+        for q in self.quantiles:
+            stats['q{}' .format(q)] = df.groupby(labels).quantile(q)
+        if self.bins is not None:
+            bin_idx = np.digitize(df.values, self.bins)
+            for b_i in range(1, len(self.bins)):
+                in_bin = pd.DataFrame(bin_idx == b_i, index=df.index, columns=df.columns)
+                stats['bin[{},{})' .format(self.bins[b_i-1], self.bins[b_i])] = in_bin.groupby(labels).sum()
+
+        for stat, stat_df in stats.items():
+            for group, row in stat_df.iterrows():
+                self._rows[(metric, scenario, ne, group, stat)] = row
+
+    def results(self):
+        """ dataframe indexed by (metric, scenario, ne, group, stat) with one column per year """
+        df = pd.DataFrame(self._rows).T
+        df.index.names = ["metric", "scenario", "ne", "group", "stat"]
+        return df
+
+    def to_csv(self, fn=None):
+        if fn is None:
+            fn = os.path.join(self.file_dir, 'output', "impacts-summary.csv")
+        self.results().to_csv(fn)
+        return fn
+
@@ -1,12 +1,14 @@
 import os, sys
 import pandas as pd
-import geopandas as gpd
 import json
-import geopandas as gpd
-import networkx as nx
 import numpy as np 
+from functools import cached_property
 
-from pyincore import IncoreClient, GeoUtil, Flood
+from backend import AssetRegistry
+from backend import Inventory
+from backend import RasterAccess
+from backend import RoadNetwork
+from backend import Sampling
 
 # sys.path.append(os.path.join(os.getcwd(), '..'))
 # from misc_funcs import HelperFuncs
@@ -19,29 +21,41 @@ TODO:
 
 class transportation_exposure():
     def __init__(self):
-        self.client = IncoreClient()
         self.file_dir = os.path.dirname(os.path.realpath(__file__))
         self.output_dir = os.path.join(self.file_dir, 'output', "transportation")
 
         self.makedir(self.output_dir)
 
-    def run_transportation_exposure(self, slr_ft, locl_hzrd=False):
+    @cached_property
+    def client(self):
+        # only created if an IN-CORE service is used; local runs don't log in
+        from pyincore import IncoreClient
+        return IncoreClient()
+
+    def run_transportation_exposure(self, slr_ft, locl_hzrd=False, sampling='point', spacing=None):
+        """ sampling: 'line' samples depth along each road (run_slr_exposure_lines);
+                'point' samples depth at one point per road (run_slr_exposure)
+        """
         gdf, gnx = self.read_trns_dataset_local()
-        self.run_slr_exposure(gdf, gnx, slr_ft, locl_hzrd)
+        if sampling == 'line':
+            self.run_slr_exposure_lines(gdf, slr_ft, spacing)
+        elif sampling == 'point':
+            self.run_slr_exposure(gdf, gnx, slr_ft, locl_hzrd)
     
 
     def read_trns_dataset_local(self):
-        path_to_trns_dataset = os.path.join(self.file_dir, "infrastructure", 'Galveston_Island_Roads_Minor_Bridges_Added.shp')
-        # bldg_dataset = Dataset.from_file(path_to_bldg_dataset, data_type="ergo:buildingInventoryVer7")
-        gdf = gpd.read_file(path_to_trns_dataset)
-        gdf.set_index("guid", inplace=True)
-        gdf.to_crs(epsg=4269, inplace=True)    # setting crs for this analysis; flood layers are in EPSG:4269 - NAD83
+        import networkx as nx
+
+        # compiled road network; setting crs for this analysis; flood layers are in EPSG:4269 - NAD83
+        gdf = RoadNetwork.RoadNetwork(self.file_dir).read_edges(epsg=4269)
         gnx = nx.from_pandas_edgelist(gdf, source='from', target='to')
         return gdf, gnx
 
 
     ###########################################################################
     def run_slr_exposure(self, gdf, gnx, slr_ft, locl_hzrd):
+        from pyincore import GeoUtil
+
         if locl_hzrd == True:
             flood = self.setup_local_hazard(slr_ft)
             hazard_type = "flood"                                                  # Galveston deterministic Hurricane, 3 datasets - Kriging
@@ -86,7 +100,77 @@ class transportation_exposure():
 
         self.write_out(gdf_out, slr_ft)
 
+    def run_slr_exposure_lines(self, gdf, slr_ft, spacing=None):
+        """ samples the depth raster along every road instead of at one point.
+            hazard_values is the max depth along the road (so that a road is 
+            impassable if any part of it is), mean_depth is the length weighted
+            mean depth (dry parts count as 0) and flooded_frac is the fraction 
+            of the road's length that is inundated.
+            as in run_slr_exposure, a road is exposed if it has a depth >= 0
+            (nodata or negative values are not exposed); bridges are not.
+        """
+        path_to_raster = RasterAccess.slr_raster_path(slr_ft, self.file_dir)
+        gdf_out = self.sample_lines(gdf.geometry, path_to_raster, spacing)
+        bridge = (gdf['bridge'] == 'yes').values
+        gdf_out.loc[bridge, ['hazard_values', 'mean_depth', 'flooded_frac']] = 0
+        gdf_out.loc[bridge, 'haz_expose'] = False
+        self.write_out(gdf_out, slr_ft)
+
+    def sample_lines(self, geoms, path_to_raster, spacing=None, length_epsg=32615):
+        """ depth statistics along line geometries.
+            lines are densified to segments of at most spacing (raster crs 
+            units; default half a pixel) so that every pixel a line crosses is
+            sampled at a segment midpoint; each sample is weighted by the 
+            length of its segment, measured in length_epsg (projected, so that
+            the weights don't depend on the road's orientation as degrees of
+            the raster crs would). all lines are sampled in one vectorized pass
+            that only reads the raster blocks the roads cross; the segment 
+            pixels are cached per raster grid (RasterAccess).
+        """
+        import shapely
+        from pyproj import Transformer
+
+        with RasterAccess.RasterAccess(path_to_raster) as ra:
+            if geoms.crs is not None and ra.src.crs is not None and geoms.crs != ra.src.crs:
+                geoms = geoms.to_crs(ra.src.crs)
+            if spacing is None:
+                spacing = min(abs(ra.src.res[0]), abs(ra.src.res[1]))/2
+
+            dense = np.asarray(geoms.values)
+            has_length = shapely.length(dense) > 0          # zero length lines are sampled at their vertex
+            dense[has_length] = shapely.segmentize(dense[has_length], spacing)
+            coords, line_i = shapely.get_coordinates(dense, return_index=True)
+            same_line = line_i[1:] == line_i[:-1]           # consecutive vertices of the same line form a segment
+            seg_line = line_i[1:][same_line]
+            seg_mid = ((coords[1:] + coords[:-1])/2)[same_line]
+            if ra.src.crs is not None:
+                to_projected = Transformer.from_crs(ra.src.crs, length_epsg, always_xy=True)
+                coords = np.column_stack(to_projected.transform(coords[:, 0], coords[:, 1]))
+            seg_len = np.hypot(*(coords[1:] - coords[:-1])[same_line].T)
+
+            seg_depth = ra.sample(seg_mid, ra.src.crs, 'road_segments')
+        seg_wet = seg_depth >= 0            # nodata (nan) or negative values are dry
+        seg_depth = np.where(seg_wet, seg_depth, 0)
+
+        n = len(geoms)
+        length = np.bincount(seg_line, weights=seg_len, minlength=n)
+        max_depth = np.zeros(n)
+        np.maximum.at(max_depth, seg_line, seg_depth)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_depth = np.bincount(seg_line, weights=seg_len*seg_depth, minlength=n)/length
+            flooded_frac = np.bincount(seg_line, weights=seg_len*seg_wet, minlength=n)/length
+        haz_expose = np.bincount(seg_line, weights=seg_wet, minlength=n) > 0
+
+        gdf_out = pd.DataFrame(index=geoms.index)
+        gdf_out['hazard_values'] = max_depth
+        gdf_out['haz_expose'] = haz_expose
+        gdf_out['mean_depth'] = np.nan_to_num(mean_depth)
+        gdf_out['flooded_frac'] = np.nan_to_num(flooded_frac)
+        return gdf_out
+
     def setup_local_hazard(self, slr_ft):
+        from pyincore import Flood
+
         path_to_data = os.path.join(self.file_dir, "inundation-rasters")
 
         # create the flood object
@@ -128,40 +212,34 @@ class transportation_access():
 
     def run_transportation_access(self, slr_ft, runname):
         bldg2trns_df, end_nodes = self.read_input_files(runname)
-        gdf_ntwk, gnx = self.read_trns_dataset_local(slr_ft)
+        gdf_ntwk, gnx = self.read_trns_dataset_local(slr_ft, self.keep_nodes(bldg2trns_df, end_nodes))
 
         df_travel_times = self.run_slr_access(gdf_ntwk, gnx, bldg2trns_df, end_nodes, slr_ft)
         self.write_out(df_travel_times, runname, slr_ft)
 
-    def read_trns_dataset_local(self, slr_ft):
-        path_to_trns_dataset = os.path.join(self.file_dir, "infrastructure", 'Galveston_Island_Roads_Minor_Bridges_Added.shp')
-        gdf = gpd.read_file(path_to_trns_dataset)
-        gdf.set_index("guid", inplace=True)
+    def read_trns_dataset_local(self, slr_ft, keep_nodes=None):
+        """ keep_nodes: if given, chains of degree-2 nodes are contracted into
+            single edges (RoadNetwork.ContractedNetwork) keeping these nodes;
+            travel times are summed along the chains. the full graph is only
+            built without keep_nodes.
+        """
+        import networkx as nx
 
-        gdf.to_crs(epsg=32615, inplace=True)
-        del gdf['u']
-        del gdf['v']
-        del gdf['key']
-        del gdf['osmid']
-        del gdf['oneway']
-        del gdf['ref']
-        del gdf['name']
+        # compiled road network (projected to EPSG:32615, unused columns removed)
+        gdf = RoadNetwork.RoadNetwork(self.file_dir).read_edges(epsg=32615)
         del gdf['from']
         del gdf['to']
-        del gdf['tunnel']
-        del gdf['junction']
-        del gdf['width']
-        del gdf['area']
-        del gdf['bridge_inp']
-        del gdf['span_mass']
-        del gdf['clearance']
-        del gdf['g_elev']
 
         gdf = self.merge_slr_results(gdf, slr_ft)
         gdf = self.assign_speeds(gdf)
         gdf = self.assign_travel_times(gdf)
-        gdf.reset_index(inplace=True)
 
+        if keep_nodes is not None:
+            CN = RoadNetwork.RoadNetwork(self.file_dir).contract(keep_nodes, epsg=32615)
+            gnx = CN.to_networkx(gdf['travel_time'])
+            return gdf, gnx
+
+        gdf.reset_index(inplace=True)
         gnx = nx.from_pandas_edgelist(gdf, 
                                       source='start_node', 
                                       target='end_node', 
@@ -171,13 +249,17 @@ class transportation_access():
 
 
         gdf.set_index("guid", inplace=True)
-
         return gdf, gnx
 
+    def keep_nodes(self, bldg2trns_df, end_nodes):
+        """ road nodes that routing results are needed for """
+        return np.concatenate([bldg2trns_df['node_guid'].values.astype(str), end_nodes['node'].values.astype(str)])
+
 
 
     def combine_trns_access(self, runname):
         path_to_trns_accs = os.path.join(self.file_dir,  'output', "transportation", runname)
+        registry = AssetRegistry.get_registry(self.file_dir)
         combined_df = pd.DataFrame()
         
         for slr in range(0,11):
@@ -187,6 +269,7 @@ class transportation_access():
             df = pd.read_csv(fname)
             df.rename(columns={"bldg_guid":"guid"}, inplace=True)
             df.set_index('guid', inplace=True)
+            df = registry.encode(df, 'buildings')       # joining on int ids
             if slr == 0:
                 combined_df.index = df.index
                 # combined_df["travel_time_0ft"] = df["travel_time"]
@@ -202,6 +285,7 @@ class transportation_access():
             df.rename(columns=rename_dict, inplace=True)
             combined_df = pd.merge(combined_df, df, left_index=True, right_index=True)
         
+        combined_df = registry.decode(combined_df, 'buildings')
         fn_out = os.path.join(self.file_dir, "output", "trans-accs-{}-combined.csv" .format(runname))
         combined_df.to_csv(fn_out)
 
@@ -281,10 +365,7 @@ class transportation_access():
         return bldg2trns_df, end_nodes
 
     def read_bldg_inv(self):
-        path_to_bldg_inv = os.path.join(self.file_dir, "infrastructure", 'bldgs_drs.json')
-        G_df = gpd.read_file(path_to_bldg_inv)
-        G_df.to_crs(epsg=4269, inplace=True)
-        G_df.set_index("guid", inplace=True)
+        G_df = Inventory.get_inventory(self.file_dir).read(crs=4269)
         return G_df
 
     ###########################################################################
@@ -313,18 +394,88 @@ class transportation_access():
         df_travel_times['target'] = targets_save
         df_travel_times['travel_time'] = travel_times
 
-        bldg2trns_df.reset_index(inplace=True)
-        df_out = pd.merge(bldg2trns_df[['bldg_guid', 'node_guid']], df_travel_times, left_on='node_guid', right_on='source', how='left')
-        del df_out['node_guid']
-        df_out.set_index('bldg_guid', inplace=True)
+        # joining buildings to their road node by int id (array gather)
+        registry = AssetRegistry.get_registry(self.file_dir)
+        source_ids = registry.ids('road_nodes', sources)
+        node_ids = registry.ids('road_nodes', bldg2trns_df['node_guid'])
+        source_pos = np.full(len(registry.lookup('road_nodes')), -1)
+        source_pos[source_ids] = np.arange(len(sources))
+
+        df_out = df_travel_times.iloc[source_pos[node_ids]]
+        df_out.index = pd.Index(bldg2trns_df.index, name='bldg_guid')
         return df_out
 
 
+    def preview_access(self, slr_ft, runname, rel_precision=0.05, n_initial=200, confidence=0.95, max_rounds=6, threshold=(1/1.25), seed=None):
+        """ island-wide estimates of access at slr_ft from a stratified sample
+            of buildings; shortest paths are only computed from the road nodes
+            of the sampled buildings.
+            buildings are stratified by the first slr layer at which they have
+            low access (norm_tt < threshold) in the combined table of runname,
+            and the sample is doubled until the intervals are within 
+            rel_precision or max_rounds is reached.
+            returns a DataFrame with the estimated number of buildings without
+                access (n_no_access) and the mean travel time of the 
+                buildings with access (travel_time), with confidence intervals
+        """
+        bldg2trns_df, end_nodes = self.read_input_files(runname)
+        gdf_ntwk, gnx = self.read_trns_dataset_local(slr_ft, self.keep_nodes(bldg2trns_df, end_nodes))
+        targets = end_nodes['node'].to_list()
+
+        registry = AssetRegistry.get_registry(self.file_dir)
+        combined_df = pd.read_csv(os.path.join(self.file_dir, "output", "trans-accs-{}-combined.csv" .format(runname)), index_col=0)
+        combined_df = registry.encode(combined_df, 'buildings')
+        low_access = np.column_stack([(combined_df["norm_tt_{}ft" .format(i)] < threshold).values for i in range(0, 11)])
+        strata = pd.Series(Sampling.first_layer(low_access), index=combined_df.index)
+        node_of_bldg = pd.Series(bldg2trns_df['node_guid'].values, index=registry.ids('buildings', bldg2trns_df.index))
+        strata = strata.loc[strata.index.intersection(node_of_bldg.index)]
+        S = Sampling.StratifiedSample(strata, seed)
+
+        node_tt = {}            # travel time from each routed node to the nearest target
+        travel_times = pd.Series(dtype=float)
+        n_target = n_initial
+        for round_i in range(max_rounds):
+            new_ids = S.extend(n_target, None if len(travel_times) == 0 else S.stratum_sd(travel_times.replace(np.inf, np.nan).fillna(0)))
+            if len(new_ids) == 0:
+                break
+            sources = [i for i in pd.unique(node_of_bldg.loc[new_ids].values) if i not in node_tt]
+            for source, lengths in self.path_length_iterator(gnx, sources, targets, weight='travel_time'):
+                node_tt[source] = min([lengths.get(target, np.inf) for target in targets])
+            travel_times = pd.concat([travel_times, pd.Series([node_tt[i] for i in node_of_bldg.loc[new_ids].values], index=new_ids)])
+
+            df_out = self.ratio_estimates(S, travel_times, confidence)
+            if S.precise(df_out['estimate'], (df_out['upper'] - df_out['lower'])/2, rel_precision) or S.complete:
+                break
+            n_target *= 2
+        return df_out
+
+    def ratio_estimates(self, S, travel_times, confidence=0.95):
+        """ number of buildings without access (total), and mean travel time
+            of the buildings with access as a ratio of totals; the interval of
+            the ratio uses the linearized variance
+        """
+        reachable = np.isfinite(travel_times)
+        y = travel_times.where(reachable, 0.0)
+        totals, half_widths = S.estimate(pd.DataFrame({"y": y, "x": reachable.astype(float), "no_access": (~reachable).astype(float)}), confidence)
+        ratio = totals[0]/totals[1] if totals[1] > 0 else np.nan
+        _, ratio_hw = S.estimate(y - ratio*reachable, confidence)
+        ratio_hw = ratio_hw[0]/totals[1] if totals[1] > 0 else np.nan
+
+        df_out = pd.DataFrame(index=pd.Index(['n_no_access', 'travel_time'], name='quantity'))
+        df_out['estimate'] = [totals[2], ratio]
+        df_out['lower'] = [totals[2] - half_widths[2], ratio - ratio_hw]
+        df_out['upper'] = [totals[2] + half_widths[2], ratio + ratio_hw]
+        df_out['n_sampled'] = len(S.sampled)
+        df_out['n_assets'] = len(S.strata)
+        return df_out
+
     def path_length_iterator(self, G, sources, targets, weight):
         """ returns iterator 
             taken from networkx all_pairs_dijkstra_path_length.
             -modified such that it loops through sources as opposed to all nodes
         """
+        import networkx as nx
+
         length = nx.shortest_paths.weighted._dijkstra_multisource
         weight = nx.shortest_paths.weighted._weight_function(G, weight=weight)
         for s in sources:
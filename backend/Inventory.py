@@ -0,0 +1,125 @@
+import os, sys
+import numpy as np
+import pandas as pd
+
+from backend import Cache
+
+
+"""
+Shared building inventory loader.
+bldgs_drs.json is converted once to a GeoParquet file in backend/cache/inventory
+(geometry in EPSG:4269, with precomputed centroid coordinates in EPSG:4269 and
+EPSG:32615), keyed by the contents of the json file. get_inventory() returns a
+process-wide instance that reads only the requested columns and keeps them in
+memory for later callers.
+"""
+
+INVENTORY_CRS = 4269
+COORDINATE_CRS = [4269, 32615]
+
+_inventories = {}
+
+def get_inventory(file_dir=None):
+    """ process-wide BuildingInventory singleton """
+    if file_dir is None:
+        file_dir = os.path.dirname(os.path.realpath(__file__))
+    if file_dir not in _inventories:
+        _inventories[file_dir] = BuildingInventory(file_dir)
+    return _inventories[file_dir]
+
+
+class BuildingInventory():
+    def __init__(self, file_dir=None):
+        if file_dir is None:
+            file_dir = os.path.dirname(os.path.realpath(__file__))
+        self.file_dir = file_dir
+        self.path_to_json = os.path.join(self.file_dir, "infrastructure", 'bldgs_drs.json')
+        self.cache = Cache.DiskCache('inventory')
+        key = self.cache.hash_key({"crs": INVENTORY_CRS, "coordinate_crs": COORDINATE_CRS, "version": 1},
+                                  files=[self.path_to_json])
+        self.path_to_parquet = self.cache.path(key, 'parquet')
+        if not os.path.exists(self.path_to_parquet):
+            self.compile()
+
+        self._columns = {}          # column name -> loaded series
+        self._geometry = {}         # epsg -> geometry series
+        self._tree = None
+
+    def compile(self):
+        import geopandas as gpd
+
+        gdf = gpd.read_file(self.path_to_json)
+        gdf.set_index("guid", inplace=True)
+        gdf.to_crs(epsg=INVENTORY_CRS, inplace=True)
+        centroids = gdf.geometry.to_crs(epsg=32615).centroid
+        for epsg in COORDINATE_CRS:
+            pts = centroids.to_crs(epsg=epsg)
+            gdf['x_{}' .format(epsg)] = pts.x.values
+            gdf['y_{}' .format(epsg)] = pts.y.values
+
+        with Cache.AtomicWrite(self.path_to_parquet) as f:
+            gdf.to_parquet(f)
+
+    ###########################################################################
+    def read(self, columns=None, crs=INVENTORY_CRS, geometry=True):
+        """ building inventory indexed by guid.
+            columns: attributes to include (default all); only columns that
+                have not been read before are read from the parquet file
+            geometry: if False, returns a plain DataFrame without geometry
+        """
+        import geopandas as gpd
+
+        if columns is None:
+            columns = self.attribute_columns()
+        missing = [i for i in columns if i not in self._columns]
+        if len(missing) > 0:
+            df = pd.read_parquet(self.path_to_parquet, columns=missing)
+            for col in missing:
+                self._columns[col] = df[col]
+
+        df = pd.DataFrame({col: self._columns[col] for col in columns}, index=self.index)
+        if geometry == False:
+            return df
+        return gpd.GeoDataFrame(df, geometry=self.geometry(crs))
+
+    def geometry(self, crs=INVENTORY_CRS):
+        import geopandas as gpd
+
+        if crs not in self._geometry:
+            if INVENTORY_CRS not in self._geometry:
+                self._geometry[INVENTORY_CRS] = gpd.read_parquet(self.path_to_parquet, columns=['geometry']).geometry
+            self._geometry[crs] = self._geometry[INVENTORY_CRS].to_crs(epsg=crs)
+        return self._geometry[crs]
+
+    def coords(self, crs=INVENTORY_CRS):
+        """ precomputed building centroid coordinates; (n x 2) array """
+        df = self.read(['x_{}' .format(crs), 'y_{}' .format(crs)], geometry=False)
+        return df.values
+
+    @property
+    def index(self):
+        if 'guid' not in self._columns:
+            self._columns['guid'] = pd.read_parquet(self.path_to_parquet, columns=[]).index
+        return self._columns['guid']
+
+    def attribute_columns(self):
+        import pyarrow.parquet as pq
+
+        schema = pq.read_schema(self.path_to_parquet)
+        return [i for i in schema.names if i not in ['geometry', 'guid'] and not i.startswith('__')]
+
+    ###########################################################################
+    def spatial_index(self):
+        """ STRtree over the building geometries (EPSG:4269) """
+        from shapely import STRtree
+
+        if self._tree is None:
+            self._tree = STRtree(self.geometry(INVENTORY_CRS).values)
+        return self._tree
+
+    def query_bbox(self, minx, miny, maxx, maxy):
+        """ guids of buildings intersecting a bounding box (EPSG:4269) """
+        from shapely.geometry import box
+
+        idx = self.spatial_index().query(box(minx, miny, maxx, maxy), predicate='intersects')
+        return self.index[np.sort(idx)]
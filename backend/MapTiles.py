@@ -0,0 +1,234 @@
+import os, sys
+import json
+import numpy as np
+
+from backend import AssetRegistry
+from backend import Cache
+from backend import Inventory
+
+
+"""
+Precomputed map tiles of the building inventory.
+XYZ (web mercator) tiles are built once per inventory into backend/cache/tiles
+as GeoJSON FeatureCollections (lon/lat, precision suited to the zoom):
+    zoom >= polygon_zoom: footprints simplified to about one pixel
+    zoom >= point_zoom: building centroids
+    lower zooms: hexagonal cells that aggregate the buildings in them
+Buildings are assigned to the tile that contains their centroid. Features
+carry the building's integer id (AssetRegistry) or, for hex cells, a cell
+number and building count. Impact values are not stored in the tiles; for
+each zoom an index of the inventory positions in each feature is stored so
+that values for a tile can be gathered (and aggregated for hex cells) at
+request time, see tile_values() and ResultsServer.
+
+layout:
+    tiles/<key>/<z>/<x>/<y>.json, tiles/<key>/<z>/index.npz
+"""
+
+EARTH_HALF_CIRCUMFERENCE = 20037508.342789244
+AGGREGATIONS = ['mean', 'max', 'sum']          # of the buildings in a hex cell
+
+
+class TileSet():
+    def __init__(self, file_dir=None, min_zoom=10, max_zoom=16, point_zoom=13, polygon_zoom=15, hex_per_tile=8):
+        if file_dir is None:
+            file_dir = os.path.dirname(os.path.realpath(__file__))
+        self.file_dir = file_dir
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.point_zoom = point_zoom
+        self.polygon_zoom = polygon_zoom
+        self.hex_per_tile = hex_per_tile
+
+        self.inventory = Inventory.get_inventory(self.file_dir)
+        cache = Cache.DiskCache('tiles')
+        params = {
+            "inventory": os.path.basename(self.inventory.path_to_parquet),       # named by the inventory content hash
+            "zooms": [min_zoom, max_zoom, point_zoom, polygon_zoom, hex_per_tile],
+            }
+        self.path = os.path.join(cache.cache_dir, cache.hash_key(params))
+        self._index = {}
+        if not os.path.exists(os.path.join(self.path, "complete")):
+            self.build()
+
+    def zooms(self):
+        return range(self.min_zoom, self.max_zoom+1)
+
+    def tile_size(self, z):
+        """ tile width in web mercator meters """
+        return 2*EARTH_HALF_CIRCUMFERENCE/2**z
+
+    def kind(self, z):
+        if z >= self.polygon_zoom:
+            return 'polygon'
+        elif z >= self.point_zoom:
+            return 'point'
+        return 'hex'
+
+    ###########################################################################
+    def build(self):
+        import shapely
+
+        geoms = self.inventory.geometry(3857).values
+        centroids = shapely.get_coordinates(shapely.centroid(geoms))
+        ids = AssetRegistry.get_registry(self.file_dir).ids('buildings', self.inventory.index)
+        for z in self.zooms():
+            size = self.tile_size(z)
+            if self.kind(z) == 'hex':
+                features = self.hex_features(centroids, size/self.hex_per_tile)
+            else:
+                features = self.building_features(z, geoms, centroids, ids, size)
+            self.write_zoom(z, features, size)
+
+        with open(os.path.join(self.path, "complete"), 'w') as f:
+            f.write("")
+
+    def building_features(self, z, geoms, centroids, ids, size):
+        """ one feature per building: (centroid, members, geometry, properties) """
+        import shapely
+
+        if self.kind(z) == 'polygon':
+            geoms = shapely.simplify(geoms, size/256, preserve_topology=True)          # ~1 pixel on a 256 px tile
+        else:
+            geoms = shapely.points(centroids)
+        return [(centroids[i], np.array([i]), geoms[i], {"id": int(ids[i])}) for i in range(len(geoms))]
+
+    def hex_features(self, centroids, hex_size):
+        """ pointy-top hexagonal cells of circumradius hex_size that aggregate
+            the building centroids (axial coordinates with cube rounding)
+        """
+        import shapely
+
+        q = (np.sqrt(3)/3*centroids[:,0] - centroids[:,1]/3)/hex_size
+        r = (2/3*centroids[:,1])/hex_size
+        x, z = q, r
+        y = -x - z
+        rx, ry, rz = np.round(x), np.round(y), np.round(z)
+        dx, dy, dz = np.abs(rx - x), np.abs(ry - y), np.abs(rz - z)
+        fix_x = (dx > dy) & (dx > dz)
+        fix_y = ~fix_x & (dy > dz)
+        rx[fix_x] = -ry[fix_x] - rz[fix_x]
+        rz[~fix_x & ~fix_y] = -rx[~fix_x & ~fix_y] - ry[~fix_x & ~fix_y]
+        cells, cell_idx = np.unique(np.column_stack([rx, rz]).astype(np.int64), axis=0, return_inverse=True)
+        cell_idx = cell_idx.reshape(-1)
+
+        order = np.argsort(cell_idx, kind='stable')
+        starts = np.searchsorted(cell_idx[order], np.arange(len(cells)))
+        ends = np.r_[starts[1:], len(order)]
+
+        angles = np.deg2rad(np.arange(6)*60 + 30)
+        features = []
+        for cell_i, (cq, cr) in enumerate(cells):
+            cx = hex_size*np.sqrt(3)*(cq + cr/2)
+            cy = hex_size*1.5*cr
+            hexagon = shapely.Polygon(np.column_stack([cx + hex_size*np.cos(angles), cy + hex_size*np.sin(angles)]))
+            members = order[starts[cell_i]:ends[cell_i]]
+            features.append((np.array([cx, cy]), members, hexagon, {"cell": cell_i, "count": int(len(members))}))
+        return features
+
+    def write_zoom(self, z, features, size):
+        """ writes the tiles of zoom z and the index of the inventory positions
+            of the features in each tile
+        """
+        import shapely
+        from pyproj import Transformer
+
+        to_lonlat = Transformer.from_crs(3857, 4269, always_xy=True)
+        precision = int(np.ceil(np.log10(2**z*256/360))) + 1
+
+        centers = np.array([f[0] for f in features])
+        tx = np.floor((centers[:,0] + EARTH_HALF_CIRCUMFERENCE)/size).astype(int)
+        ty = np.floor((EARTH_HALF_CIRCUMFERENCE - centers[:,1])/size).astype(int)
+        tiles, tile_idx = np.unique(np.column_stack([tx, ty]), axis=0, return_inverse=True)
+        tile_idx = tile_idx.reshape(-1)
+        order = np.argsort(tile_idx, kind='stable')
+
+        geoms = shapely.transform(np.array([f[2] for f in features], dtype=object),
+                                  lambda xy: np.column_stack(to_lonlat.transform(xy[:,0], xy[:,1])))
+        geoms = shapely.set_precision(geoms, 10.0**-precision)
+
+        tile_offsets = np.zeros(len(tiles)+1, dtype=np.int64)
+        np.add.at(tile_offsets, tile_idx + 1, 1)
+        tile_offsets = np.cumsum(tile_offsets)
+        feat_offsets = np.cumsum([0] + [len(features[i][1]) for i in order])
+        members = np.concatenate([features[i][1] for i in order]).astype(np.int32)
+
+        for t_i, (x, y) in enumerate(tiles):
+            feats = order[tile_offsets[t_i]:tile_offsets[t_i+1]]
+            fc = {
+                "type": "FeatureCollection",
+                "kind": self.kind(z),
+                "features": [{"type": "Feature",
+                              "geometry": shapely.geometry.mapping(geoms[i]),
+                              "properties": features[i][3]} for i in feats],
+                }
+            fn = os.path.join(self.path, str(z), str(x), "{}.json" .format(y))
+            self.makedir(os.path.dirname(fn))
+            with Cache.AtomicWrite(fn, mode='w') as f:
+                json.dump(fc, f, separators=(',', ':'))
+
+        with Cache.AtomicWrite(os.path.join(self.path, str(z), "index.npz")) as f:
+            np.savez(f, tiles=tiles, tile_offsets=tile_offsets, feat_offsets=feat_offsets, members=members)
+
+    ###########################################################################
+    def tile_path(self, z, x, y):
+        return os.path.join(self.path, str(z), str(x), "{}.json" .format(y))
+
+    def read_tile(self, z, x, y):
+        """ tile GeoJSON as bytes; None if the tile is empty """
+        fn = self.tile_path(z, x, y)
+        if not os.path.exists(fn):
+            return None
+        with open(fn, 'rb') as f:
+            return f.read()
+
+    def index(self, z):
+        if z not in self._index:
+            with np.load(os.path.join(self.path, str(z), "index.npz")) as npz:
+                idx = {k: npz[k] for k in npz.files}
+            idx['lookup'] = {(int(x), int(y)): t_i for t_i, (x, y) in enumerate(idx['tiles'])}
+            self._index[z] = idx
+        return self._index[z]
+
+    def tile_values(self, z, x, y, values, agg='mean'):
+        """ values of the features of a tile (in feature order) from values
+            aligned to the inventory; hex cells aggregate their buildings
+            (mean, max or sum, ignoring nan)
+        """
+        if agg not in AGGREGATIONS:
+            raise ValueError("agg must be one of {}: {}" .format(", ".join(AGGREGATIONS), agg))
+        idx = self.index(z)
+        t_i = idx['lookup'].get((x, y))
+        if t_i is None:
+            return np.array([])
+        f0, f1 = idx['tile_offsets'][t_i], idx['tile_offsets'][t_i+1]
+        m0, m1 = idx['feat_offsets'][f0], idx['feat_offsets'][f1]
+        v = values[idx['members'][m0:m1]].astype(float)
+        starts = idx['feat_offsets'][f0:f1] - m0
+        if self.kind(z) != 'hex':
+            return v
+
+        valid = ~np.isnan(v)
+        counts = np.add.reduceat(valid, starts)
+        if agg == 'max':
+            out = np.maximum.reduceat(np.where(valid, v, -np.inf), starts)
+        else:
+            out = np.add.reduceat(np.where(valid, v, 0), starts)
+            if agg == 'mean':
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    out = out/counts
+        out[counts == 0] = np.nan
+        return out
+
+    def makedir(self, path):
+        """ checking if path exists and making it if it doesn't.
+            if the path doesn't exist, make dir and return False (e.g. didn't exist
+                before)
+            if the path does exist, return True
+        """
+        if not os.path.exists(path):
+            os.makedirs(path, exist_ok=True)
+            return False
+        else:
+            return True
+
@@ -1,56 +1,131 @@
 import os, sys
 import numpy as np
 import pandas as pd
-import geopandas as gpd
-import matplotlib.pyplot as plt
-import matplotlib as mpl
-import datetime
+from functools import cached_property
 
+from backend import AssetRegistry
+from backend import Cache
+from backend import Inventory
+from backend import Sampling
 from backend import SLR_Api
 
+
+# combined table that each map_* method runs on (preview)
+MAP_TABLES = {
+    'map_bldg_impacts': 'bldg_exp_df',
+    'map_bldg_damage_continuous': 'bldg_exp_df',
+    'map_bldg_durations': 'bldg_exp_df',
+    'map_elec_impacts': 'elec_acc_df',
+    'map_elec_durations': 'elec_acc_df',
+    'map_trns_impacts': 'trns_acc_df',
+    'map_trns_continuous': 'trns_acc_df',
+    'map_trns_sensitivity': 'trns_acc_df',
+    'map_trns_durations': 'trns_acc_df',
+    }
+
+
+class LazyTables(dict):
+    """ dictionary that loads missing entries on first access, e.g. the
+        combined transportation tables for each destination
+    """
+    def __init__(self, loader):
+        super().__init__()
+        self.loader = loader
+
+    def __missing__(self, key):
+        self[key] = self.loader(key)
+        return self[key]
+
+
+class CaptureStore():
+    """ store that keeps the map_* outputs in memory; (metric, scenario, ne) -> df """
+    def __init__(self):
+        self.results = {}
+
+    def write(self, metric, scenario, ne, df):
+        self.results[(metric, scenario, ne)] = df
+
+
 class MapWaterLevels:
     def __init__(self, begindate_str, enddate_str, station_id, nonexceendance_probs, destination_points):
+        """ inputs (building inventory, combined impact tables, and water levels)
+            are loaded lazily on first use; see the properties below and release()
+            tables are indexed by int building ids (AssetRegistry) internally
+        """
         self.file_dir = os.path.dirname(os.path.realpath(__file__))
         self.begindate_str = begindate_str
         self.enddate_str = enddate_str
         self.begindate = pd.to_datetime(begindate_str).date()
         self.enddate = pd.to_datetime(enddate_str).date()
+        self.station_id = station_id
 
-        self.bldg_df = self.read_bldg_inv()
-        self.bldg_exp_df = self.read_combined_bldg_exp()
-        self.elec_acc_df = self.read_combined_elec_acc()
-        self.trns_acc_df = {}
-        for runname in destination_points:
-            self.trns_acc_df[runname] = self.read_combined_trns_acc(runname)
+        self.trns_acc_df = LazyTables(self.read_combined_trns_acc)
         self.destination_points = destination_points
 
-        self.waterlevels, self.scenarios = self.read_slr_scenarios(station_id, nonexceendance_probs)
-
         self.nonexceendance_probs = nonexceendance_probs
         self.path_out = os.path.join(self.file_dir, 'output', "impacts-time")
         self.makedir(self.path_out)
 
+    @cached_property
+    def registry(self):
+        return AssetRegistry.get_registry(self.file_dir)
+
+    @cached_property
+    def bldg_df(self):
+        return self.read_bldg_inv()
+
+    @cached_property
+    def bldg_exp_df(self):
+        return self.read_combined_bldg_exp()
+
+    @cached_property
+    def elec_acc_df(self):
+        return self.read_combined_elec_acc()
+
+    @cached_property
+    def slr_results(self):
+        return self.read_slr_scenarios(self.station_id, self.nonexceendance_probs)
+
+    @property
+    def waterlevels(self):
+        return self.slr_results[0]
+
+    @property
+    def scenarios(self):
+        return self.slr_results[1]
+
+    def release(self, *names):
+        """ releasing loaded inputs that are no longer needed; they are
+            reloaded on next use.
+            e.g. release('bldg_exp_df') after map_bldg_impacts, or release() 
+                to drop everything
+        """
+        if len(names) == 0:
+            names = ['bldg_df', 'bldg_exp_df', 'elec_acc_df', 'slr_results', 'trns_acc_df']
+        for name in names:
+            if name == 'trns_acc_df':
+                self.trns_acc_df.clear()
+            else:
+                self.__dict__.pop(name, None)
+
     def read_bldg_inv(self):
-        path_to_bldg_inv = os.path.join(self.file_dir, "infrastructure", 'bldgs_drs.json')
-        G_df = gpd.read_file(path_to_bldg_inv)
-        G_df.to_crs(epsg=4269, inplace=True)
-        G_df.set_index("guid", inplace=True)
-        return G_df
+        G_df = Inventory.get_inventory(self.file_dir).read(crs=4269)
+        return self.registry.encode(G_df, 'buildings')
 
     def read_combined_bldg_exp(self):
         path_to_bldg_dmg = os.path.join(self.file_dir, "output", "bldg-exp-combined.csv")
         df = pd.read_csv(path_to_bldg_dmg, index_col=0)
-        return df
+        return self.registry.encode(df, 'buildings')
 
     def read_combined_elec_acc(self):
         path_to_elec = os.path.join(self.file_dir, "output", "elec-accs-combined.csv")
         df = pd.read_csv(path_to_elec, index_col=0)
-        return df
+        return self.registry.encode(df, 'buildings')
 
     def read_combined_trns_acc(self, runname):
         path_to_trns = os.path.join(self.file_dir, "output", "trans-accs-{}-combined.csv" .format(runname))
         df = pd.read_csv(path_to_trns, index_col=0)
-        return df
+        return self.registry.encode(df, 'buildings')
 
     def read_slr_scenarios(self, station_id, nonexceendance_probs):
         path_to_slr_scenarios = os.path.join(self.file_dir, '..', '')
@@ -69,7 +144,181 @@ class MapWaterLevels:
         return df, slr_scenarios
 
 
-    def map_bldg_impacts(self, scenarios=None, stepsize='days'):
+    def run_incremental(self, map_name, store=None, **kwargs):
+        """ runs a map_* method (e.g. 'map_bldg_impacts') only for the years 
+            that don't have persisted results, merges them with the persisted 
+            years and writes the full results as usual (csv or store).
+            per-year results are keyed by the method and its arguments, the 
+            input tables, and a hash of that year's water levels; extending 
+            the end date or changing the water levels in some years only 
+            recomputes those years.
+        """
+        cache = Cache.DiskCache('impacts-years')
+        params = {
+            "map": map_name, 
+            "kwargs": kwargs, 
+            "nonexceendance_probs": self.nonexceendance_probs, 
+            "destination_points": self.destination_points,
+            }
+        base = cache.hash_key(params, files=self.input_files())
+        year_hashes = self.year_hashes()
+        years = list(year_hashes.keys())
+
+        if cache.exists(base, 'json'):
+            outputs = [tuple(i) for i in cache.load_json(base)['outputs']]
+            missing = [year for year in years if not all(cache.exists(self.year_key(cache, base, output, year_hashes[year]), 'npy') for output in outputs)]
+        else:
+            missing = years
+
+        if len(missing) > 0:
+            capture = CaptureStore()
+            waterlevels, scenarios = self.slr_results
+            self.__dict__['slr_results'] = (waterlevels.loc[waterlevels.index.year.isin(missing)], scenarios)
+            try:
+                getattr(self, map_name)(store=capture, **kwargs)
+            finally:
+                self.__dict__['slr_results'] = (waterlevels, scenarios)
+
+            for output, df in capture.results.items():
+                for year in df.columns:
+                    cache.save_array(self.year_key(cache, base, output, year_hashes[year]), df[year].values)
+                cache.save_array(self.year_key(cache, base, output, 'assets'), np.asarray(df.index).astype(str))
+            outputs = list(capture.results.keys())
+            cache.save_json(base, {"outputs": outputs})          # written last; marks entry as complete
+
+        for output in outputs:
+            assets = cache.load_array(self.year_key(cache, base, output, 'assets'))
+            df = pd.DataFrame({year: cache.load_array(self.year_key(cache, base, output, year_hashes[year])) for year in years}, index=assets)
+            metric, scenario_name, ne = output
+            self.write_out(self.registry.encode(df, 'buildings'), metric, scenario_name, ne, store)
+
+    def run_subset(self, map_name, tables, **kwargs):
+        """ runs a map_* method with some combined tables replaced, e.g. by 
+            subsets of their rows; tables: {'bldg_exp_df': df, 
+            'elec_acc_df': df, 'trns_acc_df': {runname: df}}. the loaded 
+            tables are restored afterwards.
+            returns {(metric, scenario, ne): df} of per-year results indexed by guid
+        """
+        saved = {name: self.__dict__.get(name) for name in tables if name != 'trns_acc_df'}
+        saved_trns = self.trns_acc_df
+        capture = CaptureStore()
+        try:
+            for name, df in tables.items():
+                if name == 'trns_acc_df':
+                    self.trns_acc_df = df
+                else:
+                    self.__dict__[name] = df
+            getattr(self, map_name)(store=capture, **kwargs)
+        finally:
+            for name, value in saved.items():
+                if value is None:
+                    self.__dict__.pop(name, None)
+                else:
+                    self.__dict__[name] = value
+            self.trns_acc_df = saved_trns
+        return capture.results
+
+    def preview(self, map_name, rel_precision=0.05, n_initial=500, confidence=0.95, max_rounds=6, seed=None, **kwargs):
+        """ island-wide per-year totals of a map_* method's outputs, 
+            extrapolated from a stratified sample of buildings.
+            buildings are stratified by the first slr layer at which they are
+            exposed in the method's combined table (for transportation, per
+            destination runname), and the method is only run on the sampled
+            buildings. the sample is doubled (Neyman allocation) until every 
+            confidence interval is within rel_precision of its total, every 
+            building is sampled, or max_rounds is reached.
+            returns a DataFrame indexed by (metric, scenario, ne, year) with 
+                the total, the confidence interval, and the number of sampled
+                and total buildings
+        """
+        table = MAP_TABLES[map_name]
+        if table == 'trns_acc_df':
+            threshold = kwargs.get('threshold', 1/1.25)
+            tables = {runname: self.trns_acc_df[runname] for runname in self.destination_points}
+            strata = {runname: self.exposure_matrix(df, self.count_n_times_low_access, threshold) for runname, df in tables.items()}
+        elif table == 'bldg_exp_df':
+            tables = {None: self.bldg_exp_df}
+            strata = {None: self.exposure_matrix(self.bldg_exp_df, self.count_exposed)}
+        else:
+            tables = {None: self.elec_acc_df}
+            strata = {None: self.exposure_matrix(self.elec_acc_df, self.count_n_times_no_elec)}
+        samples = {key: Sampling.StratifiedSample(pd.Series(Sampling.first_layer(strata[key]), index=tables[key].index), seed) 
+                   for key in tables}
+
+        values = {}         # output -> per-year values of the sampled buildings (by id)
+        rows = []
+        n_target = n_initial
+        for round_i in range(max_rounds):
+            new_ids = {}
+            for key, S in samples.items():
+                outputs = [output for output in values if self.preview_key(output[0], table) == key]
+                sd = None
+                if len(outputs) > 0:
+                    sd = pd.concat([S.stratum_sd(values[output]) for output in outputs], axis=1).max(axis=1)
+                new_ids[key] = S.extend(n_target, sd)
+
+            if sum(len(ids) for ids in new_ids.values()) == 0:
+                break
+            destination_points = self.destination_points
+            if table == 'trns_acc_df':
+                subset = {table: {key: tables[key].loc[new_ids[key]] for key in tables if len(new_ids[key]) > 0}}
+                self.destination_points = list(subset[table].keys())        # complete destinations are not rerun
+            else:
+                subset = {table: tables[None].loc[new_ids[None]]}
+            try:
+                results = self.run_subset(map_name, subset, **kwargs)
+            finally:
+                self.destination_points = destination_points
+            for output, df in results.items():
+                df = self.registry.encode(df, 'buildings')
+                values[output] = df if output not in values else pd.concat([values[output], df])
+
+            rows = []
+            precise = True
+            for output, df in values.items():
+                S = samples[self.preview_key(output[0], table)]
+                total, half_width = S.estimate(df, confidence)
+                precise = precise and S.precise(total, half_width, rel_precision)
+                for year_i, year in enumerate(df.columns):
+                    rows.append(output + (year, total[year_i], total[year_i] - half_width[year_i], 
+                                          total[year_i] + half_width[year_i], len(S.sampled), len(S.strata)))
+            if precise or all(S.complete for S in samples.values()):
+                break
+            n_target *= 2
+
+        df_out = pd.DataFrame(rows, columns=['metric', 'scenario', 'ne', 'year', 'total', 'lower', 'upper', 'n_sampled', 'n_assets'])
+        return df_out.set_index(['metric', 'scenario', 'ne', 'year'])
+
+    def preview_key(self, metric, table):
+        """ destination runname of a transportation metric (e.g. 
+            'nTTIncrease_utmb-hospital'); None for other tables
+        """
+        if table == 'trns_acc_df':
+            return metric.split("_", 1)[1]
+        return None
+
+    def input_files(self):
+        """ impact tables and infrastructure that the map_* results depend on """
+        fnames = [
+            os.path.join(self.file_dir, "output", "bldg-exp-combined.csv"),
+            os.path.join(self.file_dir, "output", "elec-accs-combined.csv"),
+            os.path.join(self.file_dir, "infrastructure", "bldg2elec_galveston.csv"),
+            ]
+        fnames += [os.path.join(self.file_dir, "output", "trans-accs-{}-combined.csv" .format(runname)) for runname in self.destination_points]
+        return [i for i in fnames if os.path.exists(i)]
+
+    def year_hashes(self):
+        """ hash of the water levels (all scenarios) in each year """
+        hashes = {}
+        waterlevels = self.waterlevels
+        for year, df in waterlevels.groupby(waterlevels.index.year):
+            hashes[int(year)] = Cache.DiskCache.hash_array(np.ascontiguousarray(df.values), df.index.values.astype('datetime64[s]'))
+        return hashes
+
+    def year_key(self, cache, base, output, year_hash):
+        return cache.hash_key({"base": base, "output": list(output), "year": year_hash})
+
+    def map_bldg_impacts(self, scenarios=None, stepsize='days', store=None):
         if stepsize=='days':
             t_steps = self.waterlevels.index.unique()
         elif stepsize == 'years':
@@ -105,50 +354,65 @@ class MapWaterLevels:
 
                 df_ntimes_exposed = pd.DataFrame(ntimes_exposed, index=self.bldg_exp_df.index, columns=years)
                 scenario_name = self.scenario_to_name(scenario)
-                fname = os.path.join(self.path_out, 'nTimesExp_years_sc{}_ne{}.csv' .format(scenario_name, ne))
-                df_ntimes_exposed.to_csv(fname)
+                self.write_out(df_ntimes_exposed, 'nTimesExp', scenario_name, ne, store)
 
 
-    def map_elec_impacts(self, scenarios=None, stepsize='days'):
-        if stepsize=='days':
-            t_steps = self.waterlevels.index.unique()
-        elif stepsize == 'years':
-            t_steps = self.waterlevels.index.year.unique()
-
+    def map_elec_impacts(self, scenarios=None, stepsize='days', store=None):
+        """ number of time steps per year without electricity.
+            buildings served by the same substation have the same access, so 
+            the time steps are counted once per substation (from the 
+            histogram of slr layers in each year) and broadcast to buildings.
+        """
         if scenarios == None:
             source = list(self.scenarios.keys())[0]
             scenarios = self.scenarios[source]
 
+        bldg_ss, ss_no_access = self.substation_no_access()
         for ne in self.nonexceendance_probs:
             for scenario_i, scenario in enumerate(scenarios):  # loop through NOAA scenarios (0.3, 0.5, ... 2.0)
-                exposed = np.zeros((len(self.elec_acc_df), len(t_steps)))
-                for t_i, t in enumerate(t_steps):      # loop through years
-                    scenario_name_w_tide = 'SL+Tide_ft_MHHW_{}_ne{}' .format(scenario, ne)
-
-                    if stepsize == 'days':
-                        max_elev = self.waterlevels.loc[self.waterlevels.index==t, scenario_name_w_tide].max()
-                    elif stepsize=='years':
-                        max_elev = self.waterlevels.loc[self.waterlevels.index.year==t, scenario_name_w_tide].max()
-                    
-                    slr_layer = self.return_slr_layer([max_elev])
-                    exposed[:, t_i] = self.count_n_times_no_elec(slr_layer, self.elec_acc_df)
-
-                df_raw = pd.DataFrame(exposed, index=self.elec_acc_df.index, columns=t_steps)          
-                cols = list(df_raw.columns.astype(str))
-                years = self.waterlevels.index.year.unique().to_list()
-                ntimes_exposed = np.zeros((len(self.elec_acc_df), len(years)))
-                for year_i, year in enumerate(years):
-                    df_cols = [i for i in cols if str(year) in i]
-                    df_ = df_raw[df_cols]
-                    df_.sum(axis=1)
-                    ntimes_exposed[:,year_i] = df_.sum(axis=1)
+                layer_hist, years = self.layer_histogram(scenario, ne, stepsize)
+                ss_ntimes = ss_no_access @ layer_hist.T             # substations x years
+                ntimes_exposed = ss_ntimes[bldg_ss]
 
                 df_ntimes_exposed = pd.DataFrame(ntimes_exposed, index=self.elec_acc_df.index, columns=years)
                 scenario_name = self.scenario_to_name(scenario)
-                fname = os.path.join(self.path_out, 'nNoAccess_years_sc{}_ne{}.csv' .format(scenario_name, ne))
-                df_ntimes_exposed.to_csv(fname)
-                
-    def map_trns_impacts(self, scenarios=None, stepsize='days', threshold=(1/1.25)):
+                self.write_out(df_ntimes_exposed, 'nNoAccess', scenario_name, ne, store)
+
+    def substation_no_access(self):
+        """ returns the substation (position) serving each building in 
+            elec_acc_df and the (substations x slr layers) no access array
+        """
+        bldg2elec_df = pd.read_csv(os.path.join(self.file_dir, "infrastructure", "bldg2elec_galveston.csv"))
+        bldg_ids = self.registry.ids('buildings', bldg2elec_df['bldg_guid'])
+        ss_ids = self.registry.ids('substations', bldg2elec_df['node_guid'])
+        ss_of_bldg = pd.Series(ss_ids, index=bldg_ids).reindex(self.elec_acc_df.index).values
+
+        substations, bldg_ss = np.unique(ss_of_bldg, return_inverse=True)
+        no_access = self.exposure_matrix(self.elec_acc_df, self.count_n_times_no_elec)
+        ss_no_access = np.zeros((len(substations), no_access.shape[1]))
+        ss_no_access[bldg_ss.reshape(-1)] = no_access
+        return bldg_ss.reshape(-1), ss_no_access
+
+    def layer_histogram(self, scenario, ne, stepsize='days'):
+        """ (years x slr layers) array with the number of time steps in each 
+            year at each slr layer; time steps are days or years (annual max)
+        """
+        scenario_name_w_tide = 'SL+Tide_ft_MHHW_{}_ne{}' .format(scenario, ne)
+        if stepsize == 'days':
+            max_elev = self.daily_max_elev(scenario, ne)
+            step_years = max_elev.index.year
+        elif stepsize == 'years':
+            max_elev = self.waterlevels[scenario_name_w_tide].groupby(self.waterlevels.index.year).max()
+            step_years = max_elev.index
+
+        years = self.waterlevels.index.year.unique().to_list()
+        year_pos = pd.Index(years).get_indexer(step_years)
+        slr_layers = self.return_slr_layers(max_elev.values)
+        layer_hist = np.zeros((len(years), 11))
+        np.add.at(layer_hist, (year_pos, slr_layers), 1)
+        return layer_hist, years
+
+    def map_trns_impacts(self, scenarios=None, stepsize='days', threshold=(1/1.25), store=None):
         if stepsize=='days':
             t_steps = self.waterlevels.index.unique()
         elif stepsize == 'years':
@@ -185,8 +449,269 @@ class MapWaterLevels:
 
                     df_ntimes_exposed = pd.DataFrame(ntimes_exposed, index=self.trns_acc_df[runname].index, columns=years)
                     scenario_name = self.scenario_to_name(scenario)
-                    fname = os.path.join(self.path_out, 'nTTIncrease_years_sc{}_ne{}_{}.csv' .format(scenario_name, ne, runname))
-                    df_ntimes_exposed.to_csv(fname)
+                    self.write_out(df_ntimes_exposed, 'nTTIncrease_{}' .format(runname), scenario_name, ne, store)
+
+    def map_bldg_damage_continuous(self, scenarios=None, stepsize='days', store=None):
+        """ expected number of time steps per year with building damage 
+            (damage state >= DS_1), with the damage state probability 
+            interpolated between the slr layers instead of rounding water levels
+            to the nearest layer
+        """
+        values = 1 - self.layer_values(self.bldg_exp_df, 'slr{}ft_DS_0')
+        self.map_continuous(values, self.bldg_exp_df.index, scenarios, 'eTimesDmg', stepsize, store=store)
+
+    def map_trns_continuous(self, scenarios=None, stepsize='days', store=None):
+        """ mean normalized travel time (travel time at 0ft / travel time) per
+            year, interpolated between the slr layers
+        """
+        for runname in self.destination_points:
+            values = self.layer_values(self.trns_acc_df[runname], 'norm_tt_{}ft')
+            self.map_continuous(values, self.trns_acc_df[runname].index, scenarios, 
+                                'meanNormTT_{}' .format(runname), stepsize, reduce='mean', store=store)
+
+    def map_continuous(self, values, index, scenarios, metric, stepsize='days', reduce='sum', store=None):
+        """ values: (assets x slr layers) array of an asset quantity at each 
+                slr layer (e.g. damage probability, normalized travel time)
+            the quantity at a water level is linearly interpolated between the
+            layers, so the yearly sum over time steps is a product with the 
+            (years x slr layers) interpolation weights
+        """
+        if scenarios == None:
+            source = list(self.scenarios.keys())[0]
+            scenarios = self.scenarios[source]
+
+        for ne in self.nonexceendance_probs:
+            for scenario_i, scenario in enumerate(scenarios):  # loop through NOAA scenarios (0.3, 0.5, ... 2.0)
+                weights, years = self.interp_weights(scenario, ne, stepsize)
+                out = values @ weights.T
+                if reduce == 'mean':
+                    out = out/weights.sum(axis=1)
+
+                df_out = pd.DataFrame(out, index=index, columns=years)
+                scenario_name = self.scenario_to_name(scenario)
+                self.write_out(df_out, metric, scenario_name, ne, store)
+
+    def layer_values(self, df, col_fmt, dtype=np.float32):
+        """ (assets x slr layers) array from the columns col_fmt.format(slr_ft) """
+        return np.column_stack([df[col_fmt.format(slr_ft)].values for slr_ft in range(0, 11)]).astype(dtype)
+
+    def interp_layers(self, values, elev):
+        """ batched np.interp; values (assets x slr layers) at water levels 
+            elev (ft above MHHW), returns (assets x len(elev)). levels outside 
+            0-10ft take the value of the nearest layer.
+        """
+        lower, w = self.interp_positions(elev)
+        return values[:, lower]*(1 - w) + values[:, lower+1]*w
+
+    def interp_positions(self, elev):
+        """ lower slr layer and weight of the upper layer for water levels elev """
+        pos = np.clip(np.asarray(elev, dtype=float), 0, 10)
+        lower = np.minimum(np.floor(pos).astype(int), 9)
+        return lower, pos - lower
+
+    def interp_weights(self, scenario, ne, stepsize='days'):
+        """ (years x slr layers) sum of the interpolation weights of the time 
+            steps in each year; the continuous counterpart of layer_histogram
+        """
+        scenario_name_w_tide = 'SL+Tide_ft_MHHW_{}_ne{}' .format(scenario, ne)
+        if stepsize == 'days':
+            max_elev = self.daily_max_elev(scenario, ne)
+            step_years = max_elev.index.year
+        elif stepsize == 'years':
+            max_elev = self.waterlevels[scenario_name_w_tide].groupby(self.waterlevels.index.year).max()
+            step_years = max_elev.index
+
+        years = self.waterlevels.index.year.unique().to_list()
+        year_pos = pd.Index(years).get_indexer(step_years)
+        lower, w = self.interp_positions(max_elev.values)
+        weights = np.zeros((len(years), 11))
+        np.add.at(weights, (year_pos, lower), 1 - w)
+        np.add.at(weights, (year_pos, lower+1), w)
+        return weights, years
+
+    def map_trns_sensitivity(self, delays=(1.1, 1.25, 1.5, 2.0), scenarios=None, stepsize='days', store=None):
+        """ number of time steps per year with the travel time increased by 
+            more than each delay factor (e.g. 1.25 is threshold=1/1.25 in 
+            map_trns_impacts), for all delays in one pass.
+            the layers at which each building fails a threshold are found once
+            from its sorted normalized travel times, and the counts for every
+            delay are gathered from the cumulative layer histograms, so the
+            cost doesn't depend on the number of delays.
+        """
+        if scenarios == None:
+            source = list(self.scenarios.keys())[0]
+            scenarios = self.scenarios[source]
+
+        thresholds = 1/np.asarray(delays, dtype=float)
+        for runname in self.destination_points:
+            df = self.trns_acc_df[runname]
+            order, n_fail = self.threshold_layers(self.layer_values(df, 'norm_tt_{}ft', dtype=float), thresholds)
+            for ne in self.nonexceendance_probs:
+                for scenario_i, scenario in enumerate(scenarios):  # loop through NOAA scenarios (0.3, 0.5, ... 2.0)
+                    layer_hist, years = self.layer_histogram(scenario, ne, stepsize)
+                    counts = self.threshold_counts(layer_hist, order, n_fail)
+                    scenario_name = self.scenario_to_name(scenario)
+                    for delay_i, delay in enumerate(delays):
+                        df_out = pd.DataFrame(counts[delay_i], index=df.index, columns=years)
+                        self.write_out(df_out, 'nTTIncrease{}x_{}' .format(delay, runname), scenario_name, ne, store)
+
+    def threshold_layers(self, values, thresholds):
+        """ values: (assets x slr layers) normalized travel times
+            returns the layers of each asset sorted by value, and the number
+                of layers below each threshold (assets x thresholds); the 
+                failing layers for threshold t are order[a, :n_fail[a, t]]
+        """
+        order = np.argsort(values, axis=1, kind='stable')       # nan (no result) is sorted last
+        if len(values) == 0:
+            return order, np.zeros((0, len(thresholds)), dtype=np.int64)
+        sorted_vals = np.take_along_axis(values, order, axis=1)
+
+        # one searchsorted over all assets; each row is offset so that rows don't overlap
+        finite = sorted_vals[np.isfinite(sorted_vals)]
+        lo = min(finite.min(initial=thresholds.min()), thresholds.min()) - 1
+        hi = max(finite.max(initial=thresholds.max()), thresholds.max()) + 1
+        sorted_vals = np.where(np.isnan(sorted_vals), hi, sorted_vals)     # never below a threshold
+        sorted_vals = np.clip(sorted_vals, lo, hi)                          # +inf to hi, -inf to lo; keeps the offsets finite
+        rows = np.arange(len(values))[:, None]
+        row_offset = rows*(hi - lo + 1)
+        flat = (sorted_vals - lo + row_offset).ravel()
+        queries = (thresholds[None, :] - lo + row_offset).ravel()
+        n_fail = np.searchsorted(flat, queries, side='left').reshape(len(values), -1) - rows*values.shape[1]
+        return order, n_fail
+
+    def threshold_counts(self, layer_hist, order, n_fail, chunk=4096):
+        """ (thresholds x assets x years) number of time steps at failing 
+            layers, from the cumulative histogram of each asset's sorted layers
+        """
+        counts = np.zeros((n_fail.shape[1], len(order), len(layer_hist)), dtype=np.float32)
+        for start in range(0, len(order), chunk):
+            rows = slice(start, start+chunk)
+            cum_hist = np.cumsum(layer_hist[:, order[rows]], axis=-1)           # years x assets x layers
+            cum_hist = np.concatenate([np.zeros(cum_hist.shape[:2] + (1,)), cum_hist], axis=-1)
+            counts[:, rows] = np.take_along_axis(cum_hist, n_fail[None, rows], axis=-1).transpose(2, 1, 0)
+        return counts
+
+    def map_exceedance_probs(self, overlay, n_realizations=1000, scenarios=None, threshold=(1/1.25), chunk=250, store=None):
+        """ probability per asset and year of at least one exposed day under 
+            stochastic surge and residuals (overlay: SLR_Api.SurgeOverlay) 
+            added to the daily max water levels; written as pExp, pNoAccess
+            and pTTIncrease_<runname>.
+            each realization-year is reduced to the set of slr layers reached
+            (a bitmask of the 11 layers), and the realizations are counted per
+            year and bitmask. an asset is exposed in a realization-year if its
+            exposed layers intersect the reached layers, so probabilities are 
+            computed once per unique exposure pattern.
+        """
+        if scenarios == None:
+            source = list(self.scenarios.keys())[0]
+            scenarios = self.scenarios[source]
+
+        outputs = [('pExp', self.exposure_matrix(self.bldg_exp_df, self.count_exposed), self.bldg_exp_df.index),
+                   ('pNoAccess', self.exposure_matrix(self.elec_acc_df, self.count_n_times_no_elec), self.elec_acc_df.index)]
+        for runname in self.destination_points:
+            df = self.trns_acc_df[runname]
+            outputs.append(('pTTIncrease_' + runname, self.exposure_matrix(df, self.count_n_times_low_access, threshold), df.index))
+
+        masks = np.arange(2**11)
+        for ne in self.nonexceendance_probs:
+            for scenario in scenarios:
+                mask_counts, years = self.layer_mask_counts(overlay, scenario, ne, n_realizations, chunk)
+                scenario_name = self.scenario_to_name(scenario)
+                for metric, exposure, index in outputs:
+                    patterns, pattern_idx = np.unique(exposure @ (1 << np.arange(11)), return_inverse=True)
+                    hit = (patterns[:, None] & masks[None, :]) != 0             # patterns x masks
+                    probs = (hit @ mask_counts.T)/n_realizations                # patterns x years
+                    df_out = pd.DataFrame(probs[pattern_idx.reshape(-1)], index=index, columns=years)
+                    self.write_out(df_out, metric, scenario_name, ne, store)
+
+    def layer_mask_counts(self, overlay, scenario, ne, n_realizations, chunk=250):
+        """ (years x 2**11) number of realizations reaching each set of slr 
+            layers (bitmask) in each year
+        """
+        max_elev = self.daily_max_elev(scenario, ne)
+        years = max_elev.index.year.unique().to_list()
+        year_starts = np.r_[0, np.flatnonzero(np.diff(max_elev.index.year)) + 1]
+        counts = np.zeros((len(years), 2**11), dtype=np.int64)
+        for start, elev in overlay.realizations(max_elev.values, n_realizations, chunk):
+            bits = (1 << self.return_slr_layers(elev)).astype(np.int16)            # realizations x days
+            year_masks = np.bitwise_or.reduceat(bits, year_starts, axis=1)           # realizations x years
+            flat = year_masks + np.arange(len(years))[None, :]*2**11
+            counts += np.bincount(flat.ravel(), minlength=len(years)*2**11).reshape(len(years), -1)
+        return counts, years
+
+    def map_bldg_durations(self, scenarios=None, store=None):
+        exposure = self.exposure_matrix(self.bldg_exp_df, self.count_exposed)
+        self.map_durations_(exposure, self.bldg_exp_df.index, scenarios, '{}Exp', store)
+
+    def map_elec_durations(self, scenarios=None, store=None):
+        exposure = self.exposure_matrix(self.elec_acc_df, self.count_n_times_no_elec)
+        self.map_durations_(exposure, self.elec_acc_df.index, scenarios, '{}NoAccess', store)
+
+    def map_trns_durations(self, scenarios=None, threshold=(1/1.25), store=None):
+        for runname in self.destination_points:
+            df = self.trns_acc_df[runname]
+            exposure = self.exposure_matrix(df, self.count_n_times_low_access, threshold)
+            self.map_durations_(exposure, df.index, scenarios, '{}TTIncrease_' + runname, store)
+
+    def map_durations_(self, exposure, index, scenarios, metric_fmt, store=None):
+        """ writes the longest run of consecutive exposed days (MaxRun) and the
+            number of separate exposure events (nEvents) per asset and year.
+            assets that share the same exposure pattern across the slr layers
+            share the same daily exposure series, so the run-length statistics
+            are computed once per unique pattern and broadcast back to the assets.
+        """
+        if scenarios == None:
+            source = list(self.scenarios.keys())[0]
+            scenarios = self.scenarios[source]
+
+        patterns, pattern_idx = np.unique(exposure, axis=0, return_inverse=True)
+        pattern_idx = pattern_idx.reshape(-1)
+
+        for ne in self.nonexceendance_probs:
+            for scenario in scenarios:
+                max_elev = self.daily_max_elev(scenario, ne)
+                slr_layers = self.return_slr_layers(max_elev.values)
+                flooded = patterns[:, slr_layers]               # unique patterns x days
+                max_run, n_events = self.run_length_stats(flooded, max_elev.index.year)
+                years = max_elev.index.year.unique().to_list()
+
+                scenario_name = self.scenario_to_name(scenario)
+                for stat_name, stat in [('MaxRun', max_run), ('nEvents', n_events)]:
+                    df_out = pd.DataFrame(stat[pattern_idx], index=index, columns=years)
+                    self.write_out(df_out, metric_fmt.format(stat_name), scenario_name, ne, store)
+
+    def run_length_stats(self, flooded, years):
+        """ run-length statistics of a boolean (n x days) array, evaluated
+            separately for each year.
+            events start on days that are flooded and where the previous day
+            was not (diff trick). the length of the current run is the cumulative
+            count of flooded days minus the count at the last dry day (cumsum trick).
+            returns max_run and n_events, each with shape (n x years)
+        """
+        years = np.asarray(years)
+        year_vals = pd.unique(years)
+        max_run = np.zeros((flooded.shape[0], len(year_vals)), dtype=int)
+        n_events = np.zeros((flooded.shape[0], len(year_vals)), dtype=int)
+        for year_i, year in enumerate(year_vals):
+            f = flooded[:, years==year]
+            prev = np.zeros_like(f)
+            prev[:, 1:] = f[:, :-1]
+            n_events[:, year_i] = (f & ~prev).sum(axis=1)
+
+            c = np.cumsum(f, axis=1)
+            c_at_reset = np.maximum.accumulate(np.where(f, 0, c), axis=1)
+            max_run[:, year_i] = (c - c_at_reset).max(axis=1)
+        return max_run, n_events
+
+    def exposure_matrix(self, df, count_func, *args):
+        """ boolean (assets x slr layers) array of exposure for each slr layer
+            using one of the count_ functions below
+        """
+        return np.column_stack([count_func(slr_ft, df, *args).values.astype(bool) for slr_ft in range(0, 11)])
+
+    def daily_max_elev(self, scenario, ne):
+        scenario_name_w_tide = 'SL+Tide_ft_MHHW_{}_ne{}' .format(scenario, ne)
+        return self.waterlevels[scenario_name_w_tide].groupby(level=0).max()
 
     def count_losses(self, NumDaysExposedBeforeRemoving=367, MaximumElevationsInYearConsider=1, scenarios=None, stepsize='days'):
 
@@ -254,6 +779,10 @@ class MapWaterLevels:
         else:
             return 10
 
+    def return_slr_layers(self, elev):
+        """ vectorized return_slr_layer_; maps an array of water levels to slr layers """
+        return np.searchsorted(np.arange(0.5, 10), elev, side='left')
+
     def count_exposed(self, slr_ft, df=None):
         col_name = "slr{}ft_haz_expose" .format(slr_ft)
         exposed = (df[col_name]=='yes').astype(int)
@@ -270,6 +799,25 @@ class MapWaterLevels:
         return exposed
 
 
+    def write_out(self, df, metric, scenario_name, ne, store=None):
+        """ writes per-year results to output/impacts-time, or to a store if 
+            one is provided (ImpactsCube.ImpactCubeStore, or 
+            ImpactsSummary.SummaryReducer for aggregates only)
+            metric is the file prefix, with the destination appended for 
+                transportation (e.g. 'nTTIncrease_utmb-hospital')
+            tables are keyed by building ids internally; guids are restored here
+        """
+        df = self.registry.decode(df, 'buildings')
+        if store is not None:
+            store.write(metric, scenario_name, ne, df)
+            return
+        if "_" in metric:
+            metric, runname = metric.split("_", 1)
+            fn = '{}_years_sc{}_ne{}_{}.csv' .format(metric, scenario_name, ne, runname)
+        else:
+            fn = '{}_years_sc{}_ne{}.csv' .format(metric, scenario_name, ne)
+        df.to_csv(os.path.join(self.path_out, fn))
+
     def makedir(self, path):
         """ checking if path exists and making it if it doesn't. 
             if the path doesn't exist, make dir and return False (e.g. didn't exist 
@@ -293,6 +841,8 @@ class MapWaterLevels:
 
 
 if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+
     C = MapWaterLevels(begindate_str='20250101', 
                               enddate_str='21001231', 
                               station_id=8771450, 
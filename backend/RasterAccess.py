@@ -0,0 +1,177 @@
+import os, sys
+import hashlib
+import numpy as np
+from collections import OrderedDict
+
+from backend import Cache
+
+
+"""
+Windowed/tiled access to the inundation rasters.
+Assets don't move, so the pixel (row, col) of each asset is computed once per
+raster grid (crs, transform and shape; all slr layers share a grid) and cached
+in backend/cache/raster-pixels. Sampling then only reads the raster blocks
+(tiles or strips) that contain assets, through a small LRU block cache.
+Blocks of uncompressed single band GeoTIFFs are memory-mapped from the file
+using the TIFF block offsets instead of being read, so sampling all layers at
+full resolution only needs as much memory as the touched blocks.
+"""
+
+def slr_raster_path(slr_ft, file_dir=None):
+    if file_dir is None:
+        file_dir = os.path.dirname(os.path.realpath(__file__))
+    return os.path.join(file_dir, "inundation-rasters", "TX_North2_slr_depth_{}ft.tif" .format(slr_ft))
+
+
+def sample_layers(slr_levels, xy, crs, kind, file_dir=None):
+    """ (assets x slr levels) array of depths at points xy (n x 2) in crs;
+        nan where there is no data
+    """
+    out = np.full((len(xy), len(slr_levels)), np.nan)
+    for slr_i, slr_ft in enumerate(slr_levels):
+        with RasterAccess(slr_raster_path(slr_ft, file_dir)) as ra:
+            out[:, slr_i] = ra.sample(xy, crs, kind)
+    return out
+
+
+class RasterAccess():
+    def __init__(self, path_to_raster, block_cache_size=64):
+        import rasterio
+
+        self.path_to_raster = path_to_raster
+        self.src = rasterio.open(path_to_raster)
+        self.block_shape = self.src.block_shapes[0]         # (rows, cols)
+        self.nodata = self.src.nodata
+        self.block_cache_size = block_cache_size
+        self._blocks = OrderedDict()
+        self.cache = Cache.DiskCache('raster-pixels')
+        self.use_mmap = self.can_mmap()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def close(self):
+        self._blocks.clear()
+        self.src.close()
+
+    ###########################################################################
+    def grid_params(self):
+        return {
+            "crs": self.src.crs.to_wkt() if self.src.crs is not None else None,
+            "transform": list(self.src.transform)[:6],
+            "shape": [self.src.height, self.src.width],
+            }
+
+    def pixel_index(self, xy, crs, kind):
+        """ (n x 2) array of (row, col) of points xy (n x 2) in crs; -1 for
+            points outside the raster. cached on disk per raster grid.
+            kind: name of the asset set, e.g. 'substations'
+        """
+        xy = np.ascontiguousarray(xy, dtype=float)
+        params = {
+            "grid": self.grid_params(),
+            "kind": kind,
+            "crs": str(crs),
+            "xy": hashlib.sha256(xy.tobytes()).hexdigest(),
+            }
+        key = self.cache.hash_key(params)
+        if self.cache.exists(key, 'npy'):
+            return self.cache.load_array(key)
+
+        import rasterio
+        from rasterio.crs import CRS
+        from rasterio.warp import transform
+
+        xs, ys = xy[:,0], xy[:,1]
+        if CRS.from_user_input(crs) != self.src.crs:
+            xs, ys = transform(CRS.from_user_input(crs), self.src.crs, xs, ys)
+        rows, cols = rasterio.transform.rowcol(self.src.transform, xs, ys)
+        rc = np.column_stack([rows, cols]).astype(np.int64)
+        outside = (rc[:,0] < 0) | (rc[:,0] >= self.src.height) | (rc[:,1] < 0) | (rc[:,1] >= self.src.width)
+        rc[outside] = -1
+
+        self.cache.save_array(key, rc)
+        return rc
+
+    def sample(self, xy, crs, kind):
+        """ values at points xy (n x 2) in crs; nan for nodata or outside.
+            only the blocks that contain points are read.
+        """
+        rc = self.pixel_index(xy, crs, kind)
+        return self.sample_pixels(rc)
+
+    def sample_pixels(self, rc):
+        out = np.full(len(rc), np.nan)
+        inside = rc[:,0] >= 0
+        bh, bw = self.block_shape
+        block_i = rc[inside, 0] // bh
+        block_j = rc[inside, 1] // bw
+
+        # one pass over the touched blocks; points grouped by block
+        n_block_cols = -(-self.src.width // bw)
+        block_id = block_i*n_block_cols + block_j
+        order = np.argsort(block_id, kind='stable')
+        starts = np.flatnonzero(np.diff(block_id[order], prepend=-1) != 0)
+        ends = np.r_[starts[1:], len(order)]
+        pos = np.flatnonzero(inside)
+        for start, end in zip(starts, ends):
+            pts = order[start:end]
+            bi, bj = block_i[pts[0]], block_j[pts[0]]
+            block = self.read_block(bi, bj)
+            out[pos[pts]] = block[rc[pos[pts], 0] - bi*bh, rc[pos[pts], 1] - bj*bw]
+
+        if self.nodata is not None:
+            out[out == self.nodata] = np.nan
+        return out
+
+    ###########################################################################
+    def read_block(self, bi, bj):
+        """ block (tile or strip) bi, bj from the lru block cache """
+        if (bi, bj) in self._blocks:
+            self._blocks.move_to_end((bi, bj))
+            return self._blocks[(bi, bj)]
+
+        if self.use_mmap:
+            block = self.mmap_block(bi, bj)
+        else:
+            block = self.src.read(1, window=self.src.block_window(1, bi, bj))
+        self._blocks[(bi, bj)] = block
+        if len(self._blocks) > self.block_cache_size:
+            self._blocks.popitem(last=False)
+        return block
+
+    def can_mmap(self):
+        """ blocks can be memory-mapped if the raster is an uncompressed
+            single band GeoTIFF (GDAL reports the block offsets)
+        """
+        if self.src.driver != 'GTiff' or self.src.count != 1 or self.src.compression is not None:
+            return False
+        with open(self.path_to_raster, 'rb') as f:
+            self.byteorder = {b'II': '<', b'MM': '>'}.get(f.read(2))
+        if self.byteorder is None:
+            return False
+        return self.src.get_tag_item('BLOCK_OFFSET_0_0', 'TIFF', bidx=1) is not None
+
+    def mmap_block(self, bi, bj):
+        """ block bi, bj memory-mapped from the file. blocks that sparse 
+            GeoTIFFs leave empty (offset 0 or no offset) are nodata (nan if
+            the raster has no nodata value)
+        """
+        bh, bw = self.block_shape
+        offset = self.src.get_tag_item('BLOCK_OFFSET_{}_{}' .format(bj, bi), 'TIFF', bidx=1)
+        if (offset is None) or (int(offset) == 0):
+            window = self.src.block_window(1, bi, bj)
+            return np.full((window.height, window.width), np.nan if self.nodata is None else self.nodata, dtype=float)
+        offset = int(offset)
+        n_rows = bh
+        if self.src.is_tiled == False:
+            n_rows = min(bh, self.src.height - bi*bh)            # the last strip may be short
+        dtype = np.dtype(self.src.dtypes[0]).newbyteorder(self.byteorder)
+        block = np.memmap(self.path_to_raster, dtype=dtype, mode='r', offset=offset, shape=(n_rows, bw))
+        window = self.src.block_window(1, bi, bj)
+        return block[:window.height, :window.width]          # edge tiles are padded
+
@@ -0,0 +1,311 @@
+import os, sys
+import json
+import asyncio
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs
+
+from backend import Inventory
+
+
+"""
+Local results API for the impacts-time outputs.
+Serves impact values by infrastructure, scenario, percentile (ne), year and
+bounding box, and summary statistics, over HTTP from a single asyncio process
+(no external services). Year columns are decoded once from the impacts-time
+csv files (or the ImpactsCube store if it exists), aligned to the building
+inventory, and kept in an LRU; bbox filters use the inventory's spatial index.
+
+run:
+    python -m backend.ResultsServer [port]
+
+endpoints (GET, json):
+    /values?infrastructure=buildings&scenario=Int&ne=0.5&year=2050&bbox=minx,miny,maxx,maxy
+    /summary?infrastructure=electric&scenario=Int&ne=0.5&year=2050[&bbox=...]
+    /tiles/<z>/<x>/<y>.json: building geometries (MapTiles), fetched once
+    /tile-values/<z>/<x>/<y>?infrastructure=...&scenario=...&ne=...&year=...[&agg=mean]:
+        values in the tile's feature order, so changing the scenario or year
+        only transfers the values
+    /health
+bbox is in EPSG:4269 and optional.
+"""
+
+# infrastructure -> (metric, destination); same mapping as the notebook's map
+INFRASTRUCTURE = {
+    "buildings": ("nTimesExp", None),
+    "electric": ("nNoAccess", None),
+    "transportation-exit": ("nTTIncrease", "galveston-exit"),
+    "transportation-utmb": ("nTTIncrease", "utmb-hospital"),
+    }
+
+
+class ResultsIndex():
+    def __init__(self, file_dir=None, path=None, cache_size=256):
+        if file_dir is None:
+            file_dir = os.path.dirname(os.path.realpath(__file__))
+        self.file_dir = file_dir
+        if path is None:
+            path = os.path.join(self.file_dir, 'output', "impacts-time")
+        self.path = path
+        self.cache_size = cache_size
+        self._columns = OrderedDict()       # (infrastructure, scenario, ne, year) -> values aligned to the inventory
+
+        self.inventory = Inventory.get_inventory(self.file_dir)
+        self.guids = self.inventory.index
+        self.coords = self.inventory.coords(4269)
+        self.cube = self.read_cube()
+        self._tiles = None
+
+    @property
+    def tiles(self):
+        """ MapTiles.TileSet of the inventory; built on first use """
+        if self._tiles is None:
+            from backend import MapTiles
+            self._tiles = MapTiles.TileSet(self.file_dir)
+        return self._tiles
+
+    def read_cube(self):
+        from backend import ImpactsCube
+
+        path_to_cube = os.path.join(self.file_dir, 'output', "impacts-cube")
+        if not os.path.exists(os.path.join(path_to_cube, "meta.json")):
+            return None
+        return ImpactsCube.ImpactCubeStore(path_to_cube)
+
+    ###########################################################################
+    def metric(self, infrastructure):
+        if infrastructure not in INFRASTRUCTURE:
+            raise KeyError("unknown infrastructure: {}" .format(infrastructure))
+        metric, destination = INFRASTRUCTURE[infrastructure]
+        if destination is not None:
+            metric = '{}_{}' .format(metric, destination)
+        return metric
+
+    def column(self, infrastructure, scenario, ne, year):
+        """ float32 values of one year aligned to the inventory (nan if no
+            result); decoded on first use and kept in the LRU
+        """
+        key = (infrastructure, scenario, ne, year)
+        if key not in self._columns:
+            self.store_columns(self.read_columns(infrastructure, scenario, ne, year), key)
+        self._columns.move_to_end(key)
+        return self._columns[key]
+
+    def cached(self, infrastructure, scenario, ne, year):
+        return (infrastructure, scenario, ne, year) in self._columns
+
+    def read_columns(self, infrastructure, scenario, ne, year):
+        """ decodes the requested year from the cube store if the (metric,
+            scenario, ne) slab was written to it; from a csv file otherwise,
+            where all years are decoded in the same pass (a missing file is a 
+            400, as are unknown scenarios or percentiles). returns a dict of column
+            key -> values and leaves the LRU alone, so it can run in a worker
+            thread
+        """
+        metric = self.metric(infrastructure)
+        if self.cube is not None and self.cube.has_slab(metric, scenario, ne):
+            df = self.cube.read(metric, scenario, ne, years=[year])
+        else:
+            if "_" in metric:
+                prefix, runname = metric.split("_", 1)
+                fn = '{}_years_sc{}_ne{}_{}.csv' .format(prefix, scenario, ne, runname)
+            else:
+                fn = '{}_years_sc{}_ne{}.csv' .format(metric, scenario, ne)
+            df = pd.read_csv(os.path.join(self.path, fn), index_col=0)
+            df.columns = df.columns.astype(int)
+        if year not in df.columns:
+            raise KeyError("year not in results: {}" .format(year))
+
+        values = df.reindex(self.guids).values.astype(np.float32)
+        return {(infrastructure, scenario, ne, int(col)): np.ascontiguousarray(values[:, col_i])
+                for col_i, col in enumerate(df.columns)}
+
+    def store_columns(self, columns, key):
+        """ adds decoded columns to the LRU; key (the requested column) is
+            the most recently used
+        """
+        self._columns.update(columns)
+        self._columns.move_to_end(key)
+        while len(self._columns) > self.cache_size:
+            self._columns.popitem(last=False)
+
+    def positions(self, bbox=None):
+        """ inventory positions of the buildings whose envelope intersects 
+            bbox (tree query only, no exact geometry test)
+        """
+        if bbox is None:
+            return np.arange(len(self.guids))
+        from shapely.geometry import box
+
+        idx = self.inventory.spatial_index().query(box(*bbox))
+        return np.sort(idx)
+
+    ###########################################################################
+    def values(self, infrastructure, scenario, ne, year, bbox=None):
+        values = self.column(infrastructure, scenario, ne, year)
+        pos = self.positions(bbox)
+        pos = pos[~np.isnan(values[pos])]
+        return {
+            "guid": self.guids[pos].tolist(),
+            "x": self.coords[pos, 0].round(6).tolist(),
+            "y": self.coords[pos, 1].round(6).tolist(),
+            "value": values[pos].tolist(),
+            }
+
+    def tile_values(self, infrastructure, scenario, ne, year, z, x, y, agg='mean'):
+        """ values of the features of map tile z/x/y, in feature order """
+        values = self.column(infrastructure, scenario, ne, year)
+        out = self.tiles.tile_values(z, x, y, values, agg)
+        return {"values": [None if np.isnan(i) else float(i) for i in out]}
+
+    def summary(self, infrastructure, scenario, ne, year, bbox=None):
+        values = self.column(infrastructure, scenario, ne, year)
+        values = values[self.positions(bbox)]
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return {"count": 0}
+        return {
+            "count": int(len(values)),
+            "n_nonzero": int((values > 0).sum()),
+            "sum": float(values.sum()),
+            "mean": float(values.mean()),
+            "max": float(values.max()),
+            "q50": float(np.quantile(values, 0.5)),
+            "q90": float(np.quantile(values, 0.9)),
+            }
+
+
+class ResultsServer():
+    def __init__(self, index=None, host='127.0.0.1', port=8765):
+        if index is None:
+            index = ResultsIndex()
+        self.index = index
+        self.host = host
+        self.port = port
+        self._loading = {}          # column key -> lock, so that a column is decoded once
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle, self.host, self.port)
+        print("serving results on http://{}:{}" .format(self.host, self.port))
+        async with server:
+            await server.serve_forever()
+
+    async def handle(self, reader, writer):
+        """ http/1.1 with keep-alive; one request at a time per connection """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                method, target, version = request_line.decode('latin-1').split()
+                status, body = await self.respond(method, target)
+                keep_alive = (version == 'HTTP/1.1') and (headers.get('connection', '').lower() != 'close')
+                writer.write(self.http_response(status, body, keep_alive))
+                await writer.drain()
+                if keep_alive == False:
+                    break
+        except (ConnectionError, ValueError):
+            pass
+        except Exception as e:
+            print("error handling request: {!r}" .format(e))
+            try:
+                writer.write(self.http_response(500, {"error": "internal server error"}, False))
+                await writer.drain()
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+
+    async def respond(self, method, target):
+        if method != 'GET':
+            return 405, {"error": "method not allowed"}
+        url = urlsplit(target)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        try:
+            if url.path == '/health':
+                return 200, {"status": "ok", "cached_columns": len(self.index._columns)}
+            parts = url.path.strip('/').split('/')
+            if parts[0] in ('tiles', 'tile-values') and len(parts) == 4:
+                return await self.respond_tile(parts, query)
+            if url.path not in ('/values', '/summary'):
+                return 404, {"error": "not found"}
+
+            args = self.parse_args(query)
+            await self.load_column(*args[:4])
+            if url.path == '/values':
+                return 200, self.index.values(*args)
+            return 200, self.index.summary(*args)
+        except (KeyError, ValueError, FileNotFoundError) as e:
+            return 400, {"error": str(e)}
+        except Exception as e:
+            print("error serving {}: {!r}" .format(target, e))
+            return 500, {"error": "internal server error"}
+
+    async def respond_tile(self, parts, query):
+        z, x, y = int(parts[1]), int(parts[2]), int(parts[3].replace('.json', ''))
+        if self.index._tiles is None:           # building the tiles the first time takes a while
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, lambda: self.index.tiles)
+        if parts[0] == 'tiles':
+            tile = self.index.tiles.read_tile(z, x, y)
+            if tile is None:
+                return 404, {"error": "empty tile"}
+            return 200, tile
+
+        infrastructure, scenario, ne, year, bbox = self.parse_args(query)
+        await self.load_column(infrastructure, scenario, ne, year)
+        return 200, self.index.tile_values(infrastructure, scenario, ne, year, z, x, y, query.get('agg', 'mean'))
+
+    async def load_column(self, infrastructure, scenario, ne, year):
+        """ decodes a column in a worker thread; concurrent requests for the
+            same column wait for the first one. the LRU is only updated here,
+            on the event loop thread
+        """
+        if self.index.cached(infrastructure, scenario, ne, year):
+            return
+        key = (infrastructure, scenario, ne, year)
+        lock = self._loading.setdefault(key, asyncio.Lock())
+        async with lock:
+            if not self.index.cached(infrastructure, scenario, ne, year):
+                loop = asyncio.get_running_loop()
+                columns = await loop.run_in_executor(None, self.index.read_columns, infrastructure, scenario, ne, year)
+                self.index.store_columns(columns, key)
+        self._loading.pop(key, None)
+
+    def parse_args(self, query):
+        for name in ['infrastructure', 'scenario', 'ne', 'year']:
+            if name not in query:
+                raise ValueError("missing parameter: {}" .format(name))
+        bbox = None
+        if 'bbox' in query:
+            bbox = [float(i) for i in query['bbox'].split(',')]
+            if len(bbox) != 4:
+                raise ValueError("bbox must be minx,miny,maxx,maxy")
+        return query['infrastructure'], query['scenario'], query['ne'], int(query['year']), bbox
+
+    def http_response(self, status, body, keep_alive):
+        reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+        payload = body if isinstance(body, bytes) else json.dumps(body).encode()
+        head = [
+            "HTTP/1.1 {} {}" .format(status, reasons[status]),
+            "Content-Type: application/json",
+            "Content-Length: {}" .format(len(payload)),
+            "Connection: {}" .format("keep-alive" if keep_alive else "close"),
+            ]
+        return ("\r\n".join(head) + "\r\n\r\n").encode() + payload
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    RS = ResultsServer(port=port)
+    asyncio.run(RS.serve())
+
@@ -0,0 +1,257 @@
+import os, sys
+import numpy as np
+import pandas as pd
+
+from backend import RoadNetwork
+
+
+"""
+Critical road segments under flooding.
+Edges of the road network are ranked by how much access to a destination
+(e.g. utmb-hospital, galveston-exit) depends on them:
+    betweenness: number of buildings whose route to the nearest end node uses
+        the edge. all routes to the nearest end node form one shortest-path
+        tree rooted at the end nodes, so this is the subtree sum of the
+        buildings attached to the nodes below the edge (one dijkstra per slr
+        layer).
+    flood_betweenness: dry (0ft) betweenness times the fraction of the dry
+        speed lost on the edge at the slr layer (1 if impassable), i.e. the
+        routes that flooding of the segment puts at risk.
+    marginal_delay: building-minutes added at the slr layer if the edge is
+        removed. instead of rerouting once per edge, the detour of a subtree
+        is estimated from the same tree: the best non-tree edge (a, b) leaving
+        the subtree below node x gives x the new travel time
+        d(a) + w(a, b) + d(b) - d(x), and the candidates are assigned to the
+        subtrees in order of d(a) + w(a, b) + d(b) with a union-find
+        (replacement paths; the detour of x is used for its whole subtree).
+        buildings with no detour are counted in n_cut_off.
+
+Routing is on the network with degree-2 chains contracted
+(RoadNetwork.ContractedNetwork, keeping the building and end nodes); the
+results of a contracted edge apply to every road edge of its chain.
+
+sampled_betweenness() counts routes from building nodes to every end node
+(rather than the nearest) from shortest-path trees of sampled building nodes,
+run in parallel over chunks of sources.
+
+e.g.
+    RC = RoadCriticality('utmb-hospital')
+    df = RC.edge_criticality()
+    RC.rank(df, slr_ft=4, by='flood_betweenness', top=25)
+"""
+
+class RoadCriticality():
+    def __init__(self, runname, file_dir=None, epsg=32615):
+        if file_dir is None:
+            file_dir = os.path.dirname(os.path.realpath(__file__))
+        self.file_dir = file_dir
+        self.runname = runname
+        self.epsg = epsg
+        self.RN = RoadNetwork.RoadNetwork(self.file_dir)
+        self.edge_guids = self.RN.read_edges(epsg).index
+        bldg2trns_df = pd.read_csv(os.path.join(self.file_dir, "infrastructure", "bldg2trns_galveston.csv"))
+        end_nodes = pd.read_csv(os.path.join(self.file_dir, "infrastructure", "{}-end-nodes.csv" .format(runname)))
+
+        # routing is on the contracted network; results are expanded to the road edges
+        self.CN = self.RN.contract(np.concatenate([bldg2trns_df['node_guid'].values.astype(str), end_nodes['node'].values.astype(str)]), epsg)
+        self.edge_nodes = self.CN.edge_nodes
+        self.n_nodes = len(self.CN.nodes)
+        node_index = pd.Index(self.CN.node_guids)
+
+        # buildings attached to each road node, and the end nodes
+        bldg_nodes = node_index.get_indexer(bldg2trns_df['node_guid'].astype(str))
+        self.node_bldgs = np.bincount(bldg_nodes[bldg_nodes >= 0], minlength=self.n_nodes).astype(float)
+        targets = node_index.get_indexer(end_nodes['node'].astype(str))
+        self.targets = targets[targets >= 0]
+        self._weights = {}
+
+    def weights(self, slr_ft):
+        """ travel times of the road edges and of the contracted edges """
+        if slr_ft not in self._weights:
+            w = self.RN.travel_times(slr_ft, self.epsg)
+            self._weights[slr_ft] = (w, self.CN.weights(w))
+        return self._weights[slr_ft]
+
+    ###########################################################################
+    def edge_criticality(self, slr_levels=range(0, 11)):
+        """ long table of betweenness, flood_weight, flood_betweenness,
+            marginal_delay and n_cut_off per edge (guid) and slr layer
+        """
+        dry, dry_contracted = self.weights(0)
+        betweenness = self.CN.expand(self.tree_betweenness(*self.route_tree(dry_contracted)))
+
+        frames = []
+        for slr_ft in slr_levels:
+            w, w_contracted = self.weights(slr_ft)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                flood_weight = np.where(np.isfinite(w), 1 - dry/w, 1.0)
+            flood_weight = np.nan_to_num(np.clip(flood_weight, 0, 1))
+
+            delay, cut_off = self.marginal_delay(w_contracted, *self.route_tree(w_contracted))
+            delay, cut_off = self.CN.expand(delay), self.CN.expand(cut_off)
+            df = pd.DataFrame({
+                "slr_ft": slr_ft,
+                "betweenness": betweenness,
+                "flood_weight": flood_weight,
+                "flood_betweenness": betweenness*flood_weight,
+                "marginal_delay": delay,
+                "n_cut_off": cut_off,
+                }, index=self.edge_guids)
+            frames.append(df)
+        return pd.concat(frames)
+
+    def rank(self, df, slr_ft, by='flood_betweenness', top=None):
+        df = df.loc[df['slr_ft'] == slr_ft].sort_values(by, ascending=False)
+        return df if top is None else df.iloc[:top]
+
+    ###########################################################################
+    def route_tree(self, weights):
+        """ shortest-path tree from the end nodes (undirected) over the 
+            contracted network; weights are contracted edge travel times.
+            returns the travel time to the nearest end node, the parent node
+            and parent (contracted) edge of every node (-1 at the roots and
+            unreachable nodes), and the tree depth
+        """
+        from scipy.sparse import csgraph
+
+        graph, edge_of = RoadNetwork.build_graph(self.edge_nodes, self.n_nodes, weights, self.CN.road_pos)
+        dist, pred, _ = csgraph.dijkstra(graph, directed=False, indices=self.targets, min_only=True, return_predecessors=True)
+        pred = np.where(pred < 0, -1, pred)
+
+        has_parent = np.flatnonzero(pred >= 0)
+        parent_edge = np.full(self.n_nodes, -1, dtype=np.int64)
+        parent_edge[has_parent] = self.pair_edges(graph, edge_of, pred[has_parent], has_parent)
+        return dist, pred, parent_edge, self.tree_depth(pred)
+
+    @staticmethod
+    def pair_edges(graph, edge_of, u, v):
+        """ edge position of the routing graph entry between nodes u and v;
+            entries are stored once per node pair
+        """
+        n = graph.shape[0]
+        keys = np.repeat(np.arange(n, dtype=np.int64), np.diff(graph.indptr))*n + graph.indices
+        lo, hi = np.minimum(u, v).astype(np.int64), np.maximum(u, v).astype(np.int64)
+        return edge_of[np.searchsorted(keys, lo*n + hi)]
+
+    def tree_depth(self, pred):
+        """ number of tree edges to the root (pointer doubling) """
+        n = len(pred)
+        jump = np.where(pred >= 0, pred, np.arange(n))
+        depth = (pred >= 0).astype(np.int64)
+        while (jump != jump[jump]).any():
+            depth = depth + depth[jump]
+            jump = jump[jump]
+        return depth
+
+    def tree_betweenness(self, dist, pred, parent_edge, depth):
+        """ buildings routed through each edge; subtree sums of the buildings
+            at the nodes, accumulated level by level from the deepest nodes
+        """
+        subtree = self.subtree_sums(self.node_bldgs * np.isfinite(dist), pred, depth)
+        betweenness = np.zeros(len(self.edge_nodes))
+        has_parent = parent_edge >= 0
+        np.add.at(betweenness, parent_edge[has_parent], subtree[has_parent])
+        return betweenness
+
+    def subtree_sums(self, values, pred, depth):
+        subtree = np.asarray(values, dtype=float).copy()
+        for d in range(depth.max(initial=0), 0, -1):
+            nodes = np.flatnonzero((depth == d) & (pred >= 0))
+            np.add.at(subtree, pred[nodes], subtree[nodes])
+        return subtree
+
+    ###########################################################################
+    def marginal_delay(self, weights, dist, pred, parent_edge, depth):
+        """ building-minutes of delay and number of cut-off buildings if each
+            tree edge is removed; 0 for edges that are not in the tree (the
+            routes don't use them)
+        """
+        subtree = self.subtree_sums(self.node_bldgs * np.isfinite(dist), pred, depth)
+        detour = self.replacement_keys(weights, dist, pred, parent_edge, depth) - 2*dist       # extra minutes for node x
+
+        delay = np.zeros(len(self.edge_nodes))
+        cut_off = np.zeros(len(self.edge_nodes))
+        x = np.flatnonzero(parent_edge >= 0)
+        has_detour = np.isfinite(detour[x])
+        np.add.at(delay, parent_edge[x[has_detour]], subtree[x[has_detour]]*detour[x[has_detour]])
+        np.add.at(cut_off, parent_edge[x[~has_detour]], subtree[x[~has_detour]])
+        return delay, cut_off
+
+    def replacement_keys(self, weights, dist, pred, parent_edge, depth):
+        """ for every node x, the smallest d(a) + w(a, b) + d(b) over non-tree
+            edges with a in the subtree of x and b outside it; inf if there is
+            none. parallel copies of a tree edge are valid detours.
+        """
+        u, v = self.edge_nodes[:, 0], self.edge_nodes[:, 1]
+        w = np.asarray(weights, dtype=float)
+        ok = np.isfinite(w) & np.isfinite(dist[u]) & np.isfinite(dist[v]) & (u != v)
+        ok[parent_edge[parent_edge >= 0]] = False
+        key = np.where(ok, dist[u] + w + dist[v], np.inf)
+
+        best = np.full(self.n_nodes, np.inf)
+        uf = np.arange(self.n_nodes)           # nearest ancestor (or self) without an assigned key
+
+        def find(x):
+            root = x
+            while uf[root] != root:
+                root = uf[root]
+            while uf[x] != root:
+                uf[x], x = root, uf[x]
+            return root
+
+        for e in np.argsort(key, kind='stable'):
+            if not np.isfinite(key[e]):
+                break
+            a, b = find(u[e]), find(v[e])
+            while a != b:
+                if depth[a] < depth[b]:
+                    a, b = b, a
+                if pred[a] < 0:
+                    break           # different trees (roots at different end nodes)
+                best[a] = key[e]
+                uf[a] = pred[a]
+                a = find(a)
+        return best
+
+    ###########################################################################
+    def sampled_betweenness(self, slr_ft, n_samples=500, workers=None, chunk=64, seed=None):
+        """ buildings' routes to every end node through each edge, estimated
+            from shortest-path trees of building nodes sampled with
+            probability proportional to their number of buildings
+            (Hansen-Hurwitz); chunks of sources run in parallel processes
+        """
+        from concurrent.futures import ProcessPoolExecutor
+
+        graph, edge_of = RoadNetwork.build_graph(self.edge_nodes, self.n_nodes, self.weights(slr_ft)[1], self.CN.road_pos)
+        rng = np.random.default_rng(seed)
+        p = self.node_bldgs/self.node_bldgs.sum()
+        sources = rng.choice(self.n_nodes, size=n_samples, p=p)
+        chunks = [sources[i:i+chunk] for i in range(0, n_samples, chunk)]
+
+        counts = np.zeros(len(self.edge_nodes))
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            n = len(chunks)
+            for c in ex.map(_route_counts, [graph]*n, [edge_of]*n, chunks, [self.targets]*n, [len(self.edge_nodes)]*n):
+                counts += c
+        return pd.Series(self.CN.expand(counts*self.node_bldgs.sum()/n_samples), index=self.edge_guids, name='betweenness')
+
+
+def _route_counts(graph, edge_of, sources, targets, n_edges):
+    """ number of (source, end node) routes through each edge; the paths from
+        all end nodes back to their source are walked together
+    """
+    from scipy.sparse import csgraph
+
+    _, pred = csgraph.dijkstra(graph, directed=False, indices=sources, return_predecessors=True)
+    counts = np.zeros(n_edges)
+    rows = np.repeat(np.arange(len(sources)), len(targets))
+    cur = np.tile(targets, len(sources))
+    while True:
+        parent = pred[rows, cur]
+        step = parent >= 0
+        if not step.any():
+            break
+        rows, cur, parent = rows[step], cur[step], parent[step]
+        np.add.at(counts, RoadCriticality.pair_edges(graph, edge_of, parent, cur), 1)
+        cur = parent
+    return counts
@@ -0,0 +1,309 @@
+import os, sys
+import numpy as np
+import pandas as pd
+
+from backend import Cache
+
+
+"""
+Compiled road network artifact.
+The road shapefile is parsed, reprojected and column-pruned once per crs and
+stored in backend/cache/roads together with an interned node index and the
+(undirected) adjacency in CSR form. The artifact is keyed by the contents of
+the shapefile, so it is rebuilt when the shapefile changes.
+For routing, chains of degree-2 nodes can be contracted into single edges
+(contract()), keeping the nodes that routes start or end at.
+"""
+
+ROAD_SHAPEFILE = 'Galveston_Island_Roads_Minor_Bridges_Added'
+
+# attributes not used by the transportation analyses
+DROP_COLUMNS = ['u', 'v', 'key', 'osmid', 'oneway', 'ref', 'name', 'tunnel', 'junction',
+                'width', 'area', 'bridge_inp', 'span_mass', 'clearance', 'g_elev']
+
+class RoadNetwork():
+    _loaded = {}        # in-process copy of loaded artifacts; key -> dict
+
+    def __init__(self, file_dir=None):
+        if file_dir is None:
+            file_dir = os.path.dirname(os.path.realpath(__file__))
+        self.file_dir = file_dir
+        self.cache = Cache.DiskCache('roads')
+
+    def shapefile_paths(self):
+        path_to_trns = os.path.join(self.file_dir, "infrastructure", ROAD_SHAPEFILE)
+        paths = [path_to_trns + ext for ext in ['.shp', '.shx', '.dbf', '.prj', '.cpg']]
+        return [i for i in paths if os.path.exists(i)]
+
+    def artifact_key(self, epsg):
+        params = {"epsg": epsg, "drop_columns": DROP_COLUMNS, "version": 1}
+        return self.cache.hash_key(params, files=self.shapefile_paths())
+
+    def read_edges(self, epsg):
+        """ projected and column-pruned edge table indexed by guid.
+            a copy is returned; callers are free to modify it
+        """
+        return self.load(epsg)['edges'].copy()
+
+    def read_graph(self, epsg=32615):
+        """ returns interned node guids (array; position = node index),
+            CSR adjacency (indptr, indices, edge position in read_edges),
+            and the start/end node index of each edge
+        """
+        artifact = self.load(epsg)
+        return artifact['nodes'], artifact['adjacency'], artifact['edge_nodes']
+
+    def load(self, epsg):
+        key = self.artifact_key(epsg)
+        if key not in self._loaded:
+            if not self.cache.exists(key, 'json'):
+                self.compile(key, epsg)
+            self._loaded[key] = self.read_artifact(key)
+        return self._loaded[key]
+
+    def travel_times(self, slr_ft, epsg=32615, raise_ft=None):
+        """ travel time (minutes) of each edge in read_edges order at slr_ft,
+            with the speeds of ImpactsTransportation.transportation_access; 
+            inf for impassable edges and edges without an exposure result.
+            raise_ft: optional series (edge guid -> ft) lowering the depth on
+                raised roads
+        """
+        from backend import ImpactsTransportation
+
+        edges = self.read_edges(epsg)
+        path_to_results = os.path.join(self.file_dir, "output", "transportation", 'transportation-exposure-{}ft.csv' .format(slr_ft))
+        gdf = pd.merge(edges, pd.read_csv(path_to_results, index_col='guid'), left_index=True, right_index=True)
+        if raise_ft is not None:
+            lowered = gdf['hazard_values'] - raise_ft.reindex(gdf.index).fillna(0)
+            gdf['hazard_values'] = lowered.clip(lower=0)
+
+        ta = ImpactsTransportation.transportation_access.__new__(ImpactsTransportation.transportation_access)
+        gdf = ta.assign_travel_times(ta.assign_speeds(gdf))
+        return gdf['travel_time'].reindex(edges.index).fillna(np.inf).values.astype(float)
+
+    def routing_graph(self, weights, epsg=32615):
+        """ csgraph matrix of the full network (see build_graph); edge 
+            positions are in read_edges order
+        """
+        nodes, adjacency, edge_nodes = self.read_graph(epsg)
+        return build_graph(edge_nodes, len(nodes), weights)
+
+    def contract(self, keep_guids, epsg=32615):
+        """ ContractedNetwork keeping the nodes keep_guids (e.g. the building
+            attachment and end nodes); built once per process and node set
+        """
+        keep_guids = np.unique(np.asarray(keep_guids).astype(str))
+        key = (self.artifact_key(epsg), Cache.DiskCache.hash_array(keep_guids.astype('U')))
+        if key not in self._loaded:
+            self._loaded[key] = ContractedNetwork(self, keep_guids, epsg)
+        return self._loaded[key]
+
+    ###########################################################################
+    def compile(self, key, epsg):
+        import geopandas as gpd
+
+        gdf = gpd.read_file(os.path.join(self.file_dir, "infrastructure", ROAD_SHAPEFILE + '.shp'))
+        gdf.set_index("guid", inplace=True)
+        gdf.to_crs(epsg=epsg, inplace=True)
+        gdf.drop(columns=[i for i in DROP_COLUMNS if i in gdf.columns], inplace=True)
+
+        node_guids, edge_nodes, (indptr, indices, edge_pos) = intern_graph(gdf['start_node'].values, gdf['end_node'].values)
+        n_edges = len(edge_nodes)
+
+        with self.cache.atomic_write(key, 'pkl') as f:
+            gdf.to_pickle(f)
+        with self.cache.atomic_write(key, 'npz') as f:
+            np.savez(f, nodes=node_guids, edge_nodes=edge_nodes, indptr=indptr,
+                     indices=indices, edge_pos=edge_pos)
+        self.cache.save_json(key, {"epsg": epsg, "n_edges": n_edges, "n_nodes": len(node_guids)})
+
+    def read_artifact(self, key):
+        edges = pd.read_pickle(self.cache.path(key, 'pkl'))
+        with np.load(self.cache.path(key, 'npz'), allow_pickle=False) as npz:
+            artifact = {
+                "edges": edges,
+                "nodes": npz['nodes'],
+                "edge_nodes": npz['edge_nodes'],
+                "adjacency": (npz['indptr'], npz['indices'], npz['edge_pos']),
+                }
+        return artifact
+
+
+class ContractedNetwork():
+    """ road network with chains of degree-2 nodes merged into single edges.
+        nodes with exactly two (non-loop) edges only follow the road 
+        curvature, so routing doesn't need them; nodes in keep_guids (and all
+        other nodes) are kept, so routing results are indexed by original
+        node ids. the edges of each chain are stored (chain_indptr, 
+        chain_edges; read_edges positions) so that edge weights for any number
+        of slr layers are summed along the chains, and results per contracted
+        edge can be expanded back to the road edges.
+    """
+    def __init__(self, RN, keep_guids, epsg=32615):
+        nodes, (indptr, indices, edge_pos), edge_nodes = RN.read_graph(epsg)
+        self.edge_guids = RN.read_edges(epsg).index
+        n = len(nodes)
+
+        loop = edge_nodes[:, 0] == edge_nodes[:, 1]
+        degree = np.bincount(edge_nodes[~loop].ravel(), minlength=n)
+        keep = np.zeros(n, dtype=bool)
+        keep_pos = pd.Index(nodes).get_indexer(keep_guids)
+        keep[keep_pos[keep_pos >= 0]] = True
+        contractible = (degree == 2) & ~keep
+
+        # walking every chain from its kept end; each edge is visited once
+        visited = loop.copy()
+        ends, chains = [], []
+        for start in np.flatnonzero(~contractible & (degree > 0)):
+            for k in range(indptr[start], indptr[start+1]):
+                e = edge_pos[k]
+                if visited[e]:
+                    continue
+                visited[e] = True
+                chain = [e]
+                cur = indices[k]
+                while contractible[cur]:
+                    for k2 in range(indptr[cur], indptr[cur+1]):
+                        if edge_pos[k2] != e and not loop[edge_pos[k2]]:
+                            break
+                    e = edge_pos[k2]
+                    visited[e] = True
+                    chain.append(e)
+                    cur = indices[k2]
+                if cur != start:            # chains that return to their start are loops
+                    ends.append((start, cur))
+                    chains.append(chain)
+
+        self.nodes = np.flatnonzero(~contractible)              # original node positions
+        self.node_guids = nodes[self.nodes]
+        self.node_pos = np.full(n, -1, dtype=np.int64)          # original position -> contracted position
+        self.node_pos[self.nodes] = np.arange(len(self.nodes))
+        self.edge_nodes = self.node_pos[np.asarray(ends, dtype=np.int64).reshape(-1, 2)]
+        self.chain_indptr = np.r_[0, np.cumsum([len(i) for i in chains])].astype(np.int64)
+        self.chain_edges = np.concatenate(chains).astype(np.int64) if len(chains) > 0 else np.zeros(0, dtype=np.int64)
+        # read_edges position of the chains of a single road edge; -1 for longer chains
+        self.road_pos = np.where(np.diff(self.chain_indptr) == 1, self.chain_edges[self.chain_indptr[:-1]], -1)
+
+    def weights(self, weights):
+        """ weights of the road edges (read_edges order; a series by guid, an
+            array, or an (edges x slr layers) array) summed along each chain.
+            edges missing from a series are NaN, so their chains are dropped
+            (as the edges are absent from the uncontracted graph)
+        """
+        if isinstance(weights, pd.Series):
+            weights = weights.reindex(self.edge_guids).values
+        weights = np.asarray(weights, dtype=float)
+        if len(self.chain_edges) == 0:
+            return weights[:0]
+        return np.add.reduceat(weights[self.chain_edges], self.chain_indptr[:-1], axis=0)
+
+    def expand(self, values, fill=0.0):
+        """ per contracted edge values to the road edges of each chain """
+        values = np.asarray(values)
+        out = np.full((len(self.edge_guids),) + values.shape[1:], fill, dtype=float)
+        out[self.chain_edges] = np.repeat(values, np.diff(self.chain_indptr), axis=0)
+        return out
+
+    def routing_graph(self, weights):
+        """ csgraph matrix over the contracted nodes (see build_graph) from
+            road edge weights; edge positions are contracted edges
+        """
+        return build_graph(self.edge_nodes, len(self.nodes), self.weights(weights), self.road_pos)
+
+    def to_networkx(self, weights, weight='travel_time'):
+        """ undirected networkx graph labelled by node guids, with the same
+            shortest paths as nx.Graph built from the road edges: of parallel
+            road edges the last one (read_edges order) is kept, as nx.Graph
+            overwrites them, while parallel chains are separate paths in the
+            uncontracted graph, so the fastest of them is kept (the same rule
+            as build_graph)
+        """
+        import networkx as nx
+
+        df = pd.DataFrame({
+            "u": self.node_guids[self.edge_nodes[:, 0]], 
+            "v": self.node_guids[self.edge_nodes[:, 1]], 
+            weight: self.weights(weights),
+            "single": self.road_pos >= 0,
+            "pos": self.road_pos,
+            })
+        df = df.loc[df[weight].notna()]
+        swap = df['u'] > df['v']
+        df.loc[swap, ['u', 'v']] = df.loc[swap, ['v', 'u']].values
+        single = df.loc[df['single']].sort_values('pos').groupby(['u', 'v'], as_index=False).last()
+        df = pd.concat([single, df.loc[~df['single']]])
+        df = df.groupby(['u', 'v'], as_index=False)[weight].min()
+        G = nx.from_pandas_edgelist(df, source='u', target='v', edge_attr=[weight])
+        G.add_nodes_from(self.node_guids)
+        return G
+
+
+def intern_graph(start_nodes, end_nodes):
+    """ interned node guids (position = node index), the start/end node index
+        of each edge, and the undirected adjacency in CSR form (indptr, 
+        indices, edge position)
+    """
+    node_guids, edge_nodes = np.unique(np.concatenate([np.asarray(start_nodes).astype(str),
+                                                       np.asarray(end_nodes).astype(str)]),
+                                       return_inverse=True)
+    edge_nodes = edge_nodes.reshape(2, -1).T.astype(np.int32)     # edges x (start, end)
+
+    # data is the edge position
+    n_edges = len(edge_nodes)
+    src = np.concatenate([edge_nodes[:, 0], edge_nodes[:, 1]])
+    dst = np.concatenate([edge_nodes[:, 1], edge_nodes[:, 0]])
+    edge_pos = np.concatenate([np.arange(n_edges), np.arange(n_edges)]).astype(np.int32)
+    order = np.argsort(src, kind='stable')
+    indptr = np.zeros(len(node_guids)+1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(src, minlength=len(node_guids)))
+    return node_guids, edge_nodes, (indptr, dst[order].astype(np.int32), edge_pos[order])
+
+
+def build_graph(edge_nodes, n_nodes, weights, road_pos=None):
+    """ (nodes x nodes) csr matrix of edge weights for scipy.sparse.csgraph
+        (use directed=False). entries are stored once per node pair (upper
+        triangle). parallel edges follow nx.Graph built from the road edges:
+        of parallel road edges the last one (read_edges order) is kept, of 
+        parallel chains (contracted edges of more than one road edge) the 
+        fastest. road_pos is the read_edges position of edges that are a 
+        single road edge, -1 for chains (default: every edge is the road edge
+        at its position). missing (nan) edges are dropped before, impassable
+        (inf) edges after choosing among parallel edges.
+        returns the matrix and the edge position of each stored entry
+    """
+    from scipy import sparse
+
+    weights = np.asarray(weights, dtype=float)
+    if road_pos is None:
+        road_pos = np.arange(len(weights))
+    lo = np.minimum(edge_nodes[:, 0], edge_nodes[:, 1])
+    hi = np.maximum(edge_nodes[:, 0], edge_nodes[:, 1])
+
+    # last of the parallel road edges
+    keep = ~np.isnan(weights)
+    single = np.flatnonzero(keep & (road_pos >= 0))
+    single = single[np.lexsort((road_pos[single], hi[single], lo[single]))]
+    last = np.r_[(lo[single][1:] != lo[single][:-1]) | (hi[single][1:] != hi[single][:-1]), True]
+    keep[single[~last]] = False
+
+    # fastest of the remaining parallel edges
+    passable = np.flatnonzero(keep & np.isfinite(weights))
+    u, v, w = lo[passable], hi[passable], weights[passable]
+    order = np.lexsort((w, v, u))
+    u, v, w, pos = u[order], v[order], w[order], passable[order]
+    first = np.r_[True, (u[1:] != u[:-1]) | (v[1:] != v[:-1])]
+    graph = sparse.csr_matrix((w[first], (u[first], v[first])), shape=(n_nodes, n_nodes))
+    graph.sort_indices()
+
+    # stored entries are a subset of the unique (u, v) pairs, which are sorted
+    rows = np.repeat(np.arange(n_nodes, dtype=np.int64), np.diff(graph.indptr))
+    keys = u[first].astype(np.int64)*n_nodes + v[first]
+    edge_of = pos[first][np.searchsorted(keys, rows*n_nodes + graph.indices)]
+    return graph, edge_of
+
+
+if __name__ == "__main__":
+    # compiling the artifacts used by transportation_exposure and transportation_access
+    RN = RoadNetwork()
+    RN.load(epsg=4269)
+    RN.load(epsg=32615)
@@ -2,11 +2,9 @@ import os, sys
 import pandas as pd
 import numpy as np
 import datetime
+from functools import cached_property
 
-from noaa_coops import Station
-import matplotlib.pyplot as plt
-import matplotlib as mpl
-
+from backend import Cache
 
 
 """
@@ -17,29 +15,168 @@ Stations:
 """
 
 class SLR_API():
-    def __init__(self, station_id=8771450, scenario_names=None, begin_date="20230101", end_date="20431231", nonexceendance_probs=[0.5], load_tides=True):
+    def __init__(self, station_id=8771450, scenario_names=None, begin_date="20230101", end_date="20431231", nonexceendance_probs=[0.5], load_tides=True, use_cache=True):
         self.file_dir = os.path.dirname(os.path.realpath(__file__))
+        self.station_id = station_id
 
-        slr_df = self.read_slr_data(station_id=station_id)
         slr_scenarios = self.define_slr_scenarios(scenario_names)
 
         datums = self.define_datums()
         if load_tides:
-            tide_df = self.read_tide_data(station_id=station_id, begin_date=begin_date, end_date=end_date)
-            self.combined_df = self.combine_tide_slr(slr_df, slr_scenarios, tide_df, datums, nonexceendance_probs)
+            self.combined_df = self.load_combined_df(station_id, slr_scenarios, begin_date, end_date, datums, nonexceendance_probs, use_cache)
 
         self.scenario_names = scenario_names
         self.slr_scenarios = slr_scenarios
-        self.station_id = station_id
-        self.slr_df = slr_df
-    
-    def read_slr_data(self, station_id):
+
+    @cached_property
+    def slr_df(self):
+        return self.read_slr_data(station_id=self.station_id)
+
+    def load_combined_df(self, station_id, slr_scenarios, begin_date, end_date, datums, nonexceendance_probs, use_cache=True):
+        """ combined tide and slr dataframe; memoized on disk, keyed by the 
+            parameters and the contents of the slr and tide files.
+            the cached values are memory-mapped when reloaded.
+            without an exact match, the cached table with the same parameters
+            and the latest earlier (or same) end date is extended with the new dates only; 
+            with a tide file for the full period, rows whose tide changed are
+            recomputed too.
+        """
+        path_to_tide = os.path.join(self.file_dir, 'water-level-data', self.tide_data_fname(station_id, begin_date, end_date))
+        if use_cache == False:
+            tide_df = self.read_tide_data(station_id=station_id, begin_date=begin_date, end_date=end_date)
+            return self.combine_tide_slr(self.slr_df, slr_scenarios, tide_df, datums, nonexceendance_probs)
+
+        cache = Cache.DiskCache('slr')
+        params = {
+            "station_id": station_id, 
+            "slr_scenarios": slr_scenarios, 
+            "begin_date": begin_date, 
+            "datums": datums['Value'].to_dict(), 
+            "nonexceendance_probs": nonexceendance_probs
+            }
+        base = cache.hash_key(params, files=[self.slr_data_path(station_id)])      # same table up to the end date
+        meta = {"base": base, "end_date": end_date}
+
+        tide_df = None
+        if os.path.exists(path_to_tide):
+            key = cache.hash_key(dict(params, end_date=end_date), files=[self.slr_data_path(station_id), path_to_tide])
+            if cache.exists(key, 'json'):
+                return self.read_cached_combined_df(cache, key)
+            tide_df = self.read_tide_data(station_id=station_id, begin_date=begin_date, end_date=end_date)
+
+        prefix_key, prefix_end = self.find_cached_prefix(cache, base, end_date)
+        if (tide_df is None) and (prefix_end == end_date):
+            return self.read_cached_combined_df(cache, prefix_key)
+        if prefix_key is not None:
+            combined_df = self.read_cached_combined_df(cache, prefix_key)
+            combined_df = self.extend_combined_df(combined_df, station_id, slr_scenarios, end_date, datums, nonexceendance_probs, tide_df)
+            if tide_df is None:
+                key = cache.hash_key({"extends": prefix_key, "end_date": end_date})
+            self.write_cached_combined_df(cache, key, combined_df, meta)
+            return combined_df
+
+        if tide_df is None:
+            key = cache.hash_key({"base": base, "end_date": end_date})        # tides are downloaded
+            tide_df = self.read_tide_data(station_id=station_id, begin_date=begin_date, end_date=end_date)
+        combined_df = self.combine_tide_slr(self.slr_df, slr_scenarios, tide_df, datums, nonexceendance_probs)
+        self.write_cached_combined_df(cache, key, combined_df, meta)
+        return combined_df
+
+    def find_cached_prefix(self, cache, base, end_date):
+        """ key and end date of the cached table with the same base parameters
+            and the latest end date at or before end_date
+        """
+        prefix_key, prefix_end = None, None
+        for fname in os.listdir(cache.cache_dir):
+            if not fname.endswith('.json'):
+                continue
+            key = fname[:-len('.json')]
+            meta = cache.load_json(key)
+            if meta.get('base') != base or meta['end_date'] > end_date:
+                continue
+            if (prefix_end is None) or (meta['end_date'] > prefix_end):
+                prefix_key, prefix_end = key, meta['end_date']
+        return prefix_key, prefix_end
+
+    def extend_combined_df(self, combined_df, station_id, slr_scenarios, end_date, datums, nonexceendance_probs, tide_df=None):
+        """ appends the dates after the end of combined_df. sea levels are 
+            interpolated between the slr values (row by row), so rows from the
+            last slr value at or before the old end date on are recomputed 
+            with the new tide data; earlier rows are kept.
+            tide_df is the tide data for the full period (local tide file); 
+            the new dates are taken from it instead of downloaded, and rows 
+            from the first date whose tide differs from combined_df are 
+            recomputed as well.
+        """
+        old_end = pd.Timestamp(combined_df.index[-1])
+        changed = old_end
+        if tide_df is None:
+            new_begin = (old_end + pd.Timedelta(days=1)).strftime('%Y%m%d')
+            tide_new = self.read_tide_data(station_id=station_id, begin_date=new_begin, end_date=end_date)
+        else:
+            is_old = np.array([i <= old_end.date() for i in tide_df.index])
+            tide_old = tide_df['v'].values[is_old]
+            if len(tide_old) != len(combined_df):
+                return self.combine_tide_slr(self.slr_df, slr_scenarios, tide_df, datums, nonexceendance_probs)
+            diff = np.flatnonzero(~np.isclose(tide_old, combined_df['tide_ft_MHHW'].values, equal_nan=True))
+            if len(diff) > 0:
+                changed = pd.Timestamp(combined_df.index[diff[0]])
+
+        knot = self.last_slr_date(slr_scenarios, nonexceendance_probs, changed)
+        if pd.isnull(knot):         # tide changed before the first slr value
+            return self.combine_tide_slr(self.slr_df, slr_scenarios, tide_df, datums, nonexceendance_probs)
+        knot = knot.date()
+        keep = np.array([i < knot for i in combined_df.index])
+        if tide_df is None:
+            tide_tail = combined_df.loc[~keep, ['tide_ft_MHHW']].rename(columns={"tide_ft_MHHW": "v"})
+            tide_tail = pd.concat([tide_tail, tide_new[['v']]])
+        else:
+            tide_tail = tide_df.loc[np.array([i >= knot for i in tide_df.index]), ['v']]
+
+        tail_df = self.combine_tide_slr(self.slr_df, slr_scenarios, tide_tail, datums, nonexceendance_probs)
+        return pd.concat([combined_df.loc[keep], tail_df[combined_df.columns]])
+
+    def last_slr_date(self, slr_scenarios, nonexceendance_probs, date):
+        """ earliest of the last dates at or before date over the slr series
+            used in combine_tide_slr
+        """
+        last_dates = []
+        for nonexceendance_prob in nonexceendance_probs:
+            for source in slr_scenarios.keys():
+                slr_source = self.slr_df.loc[self.slr_df['Source']==source]
+                if source == 'NOAA et al. 2022':
+                    slr_source = slr_source.loc[slr_source['Nonexceedence Probability']==nonexceendance_prob]
+                for scenario in slr_scenarios[source]:
+                    dates = slr_source.loc[slr_source['Scenario']==scenario].index
+                    last_dates.append(dates[dates <= date].max())
+        return min(last_dates)
+
+    def write_cached_combined_df(self, cache, key, combined_df, meta={}):
+        """ values are stored column-major (one contiguous block per column); 
+            the date index is stored as days since epoch
+        """
+        days = (pd.to_datetime(combined_df.index) - pd.Timestamp("1970-01-01")).days
+        cache.save_array(key + "-index", np.asarray(days, dtype=np.int64))
+        cache.save_array(key, np.asfortranarray(combined_df.values, dtype=np.float64))
+        cache.save_json(key, dict(meta, columns=list(combined_df.columns)))       # written last; marks entry as complete
+
+    def read_cached_combined_df(self, cache, key):
+        columns = cache.load_json(key)['columns']
+        values = cache.load_array(key)
+        days = cache.load_array(key + "-index")
+        index = pd.Index((pd.Timestamp("1970-01-01") + pd.to_timedelta(days, unit='D')).date)
+        return pd.DataFrame(values, index=index, columns=columns, copy=False)
+
+    def slr_data_path(self, station_id):
         files_in_dir = os.listdir(os.path.join(self.file_dir, 'water-level-data'))
 
         station_files = [i for i in files_in_dir if str(station_id) in i]
         station_files = [i for i in station_files if "SLT" in i]
         slr_file = [i for i in station_files if ".csv" in i][0]
-        df = pd.read_csv(os.path.join(self.file_dir, 'water-level-data', slr_file))
+        return os.path.join(self.file_dir, 'water-level-data', slr_file)
+
+    def read_slr_data(self, station_id):
+        df = pd.read_csv(self.slr_data_path(station_id))
         df['Month'].fillna(1, inplace=True)
         df['Day'] = 1
         df['datetime'] = pd.to_datetime(df[['Year', "Month", "Day"]])
@@ -47,8 +184,11 @@ class SLR_API():
         df = df[['Source', 'Scenario', 'Value Type', 'Sea Level (feet)', 'Nonexceedence Probability']]
         return df
 
+    def tide_data_fname(self, station_id, begin_date, end_date):
+        return "NOAA_Tide_{}_MHHW_{}-{}.csv" .format(station_id, begin_date, end_date)
+
     def read_tide_data(self, station_id, begin_date, end_date):
-        fname = "NOAA_Tide_{}_MHHW_{}-{}.csv" .format(station_id, begin_date, end_date)
+        fname = self.tide_data_fname(station_id, begin_date, end_date)
         if fname not in os.listdir(os.path.join(self.file_dir, 'water-level-data')):
             na = NOAA_API(station_id=station_id, begin_date=begin_date, end_date=end_date)
             na.save_to_csv()
@@ -109,6 +249,9 @@ class SLR_API():
         return combined_df
     
     def plot_tideSLR(self, savefig=False):
+        import matplotlib.pyplot as plt
+        import matplotlib as mpl
+
         for source in self.slr_scenarios.keys():
             fig, ax = plt.subplots(6,1,figsize=(12,6))
             # cmap = mpl.cm.get_cmap('Spectral')
@@ -167,6 +310,9 @@ class SLR_API():
             plt.close()
 
     def plot_SLR(self, savefig=False):
+        import matplotlib.pyplot as plt
+        import matplotlib as mpl
+
         for source in self.slr_scenarios.keys():
             fig, ax = plt.subplots(3, 1,figsize=(12,6), gridspec_kw={'height_ratios': [1, 2.5, 1]})
             cmap = mpl.colormaps['Spectral']
@@ -248,6 +394,9 @@ class SLR_API():
             plt.close()
 
     def plot_inset(self, begindate_str, enddate_str, savefig=False):
+        import matplotlib.pyplot as plt
+        import matplotlib as mpl
+
         begindate = pd.to_datetime(begindate_str).date()
         enddate = pd.to_datetime(enddate_str).date()
         df = self.combined_df.loc[begindate:enddate]
@@ -312,8 +461,112 @@ class SLR_API():
         return df
 
 
+class SurgeOverlay():
+    """ stochastic non-tidal residuals and surge events added to a daily water
+        level series (e.g. the daily max of SL+Tide_ft_MHHW_*). realizations 
+        are generated in chunks as (realizations x days) arrays so that 
+        thousands of realizations can be aggregated with bounded memory.
+
+        residual model:
+            'parametric': AR(1) daily residual with standard deviation 
+                residual_sd (ft) and lag-1 correlation residual_phi, plus surge
+                events arriving as a Poisson process (surge_rate per year) with
+                generalized Pareto peaks (surge_scale ft, surge_shape) that 
+                decay exponentially (surge_decay days).
+            'empirical': blocks of block_days consecutive values drawn from a
+                library of observed daily residuals (ft; e.g. verified minus 
+                predicted daily max water levels), which keeps their 
+                autocorrelation and surge events.
+        the default parameters are placeholders; fit_residuals() estimates the
+        AR(1) parameters from observed residuals.
+    """
+    def __init__(self, model='parametric', residuals=None, residual_sd=0.4, residual_phi=0.7,
+                 surge_rate=0.5, surge_scale=1.0, surge_shape=0.1, surge_decay=1.5, block_days=30, seed=None):
+        if model not in ['parametric', 'empirical']:
+            raise ValueError("unknown surge model: {}" .format(model))
+        if model == 'empirical' and residuals is None:
+            raise ValueError("the empirical model needs a residual library")
+        self.model = model
+        self.residuals = None if residuals is None else np.asarray(residuals, dtype=np.float32)
+        self.residual_sd = residual_sd
+        self.residual_phi = residual_phi
+        self.surge_rate = surge_rate
+        self.surge_scale = surge_scale
+        self.surge_shape = surge_shape
+        self.surge_decay = surge_decay
+        self.block_days = block_days
+        self.seed = seed
+
+    @staticmethod
+    def fit_residuals(residuals):
+        """ residual_sd and residual_phi (lag-1 autocorrelation) of observed
+            daily residuals
+        """
+        r = np.asarray(residuals, dtype=float)
+        r = r[~np.isnan(r)] - np.nanmean(r)
+        return {"residual_sd": float(r.std()), "residual_phi": float(np.corrcoef(r[1:], r[:-1])[0, 1])}
+
+    def realizations(self, daily_elev, n_realizations, chunk=250):
+        """ yields (start, values) where values is the (chunk x days) float32 
+            array of daily_elev plus sampled residuals for realizations 
+            start:start+chunk. every realization has its own random stream
+            (spawned from seed), so the realizations don't depend on the chunk
+            size. seed=None draws fresh entropy on every call.
+        """
+        base = np.asarray(daily_elev, dtype=np.float32)
+        streams = np.random.SeedSequence(self.seed).spawn(n_realizations)
+        for start in range(0, n_realizations, chunk):
+            rngs = [np.random.default_rng(i) for i in streams[start:start+chunk]]
+            yield start, base[None, :] + self.sample(rngs, len(base))
+
+    def sample(self, rngs, n_days):
+        """ (realizations x n_days) float32 array of residuals; one generator
+            per realization
+        """
+        if self.model == 'empirical':
+            return self.sample_empirical(rngs, n_days)
+        return self.sample_ar1(rngs, n_days) + self.sample_surge(rngs, n_days)
+
+    def sample_ar1(self, rngs, n_days):
+        from scipy import signal
+
+        phi = self.residual_phi
+        eps = np.stack([rng.standard_normal(n_days, dtype=np.float32) for rng in rngs])
+        eps *= np.float32(self.residual_sd*np.sqrt(1 - phi**2))
+        eps[:, 0] /= np.float32(np.sqrt(1 - phi**2))        # starting from the stationary distribution
+        return signal.lfilter([1.0], [1.0, -phi], eps, axis=1).astype(np.float32)
+
+    def sample_surge(self, rngs, n_days):
+        """ surge event peaks on the days they occur, decaying over the 
+            following days; overlapping events add up
+        """
+        from scipy import signal
+
+        peaks = np.zeros((len(rngs), n_days), dtype=np.float32)
+        for i, rng in enumerate(rngs):
+            events = np.flatnonzero(rng.random(n_days) < self.surge_rate/365.25)
+            u = rng.random(len(events))
+            if self.surge_shape == 0:
+                peaks[i, events] = -self.surge_scale*np.log(u)
+            else:
+                peaks[i, events] = self.surge_scale*(u**(-self.surge_shape) - 1)/self.surge_shape
+        decay = np.exp(-1/self.surge_decay)
+        return signal.lfilter([1.0], [1.0, -decay], peaks, axis=1).astype(np.float32)
+
+    def sample_empirical(self, rngs, n_days):
+        """ block bootstrap from the residual library """
+        lib = self.residuals[~np.isnan(self.residuals)]
+        block = min(self.block_days, len(lib))
+        n_blocks = -(-n_days//block)
+        starts = np.stack([rng.integers(0, len(lib) - block + 1, size=n_blocks) for rng in rngs])
+        idx = (starts[:, :, None] + np.arange(block)).reshape(len(rngs), -1)[:, :n_days]
+        return lib[idx]
+
+
 class NOAA_API:
     def __init__(self, station_id, begin_date, end_date, product="predictions", datum="MHHW", units="english", interval="hilo", time_zone="gmt"):
+        from noaa_coops import Station
+
         self.file_dir = os.path.dirname(os.path.realpath(__file__))
         station = Station(id=station_id)
         self.df = station.get_data(
@@ -333,6 +586,8 @@ class NOAA_API:
         print("NOAA Tides Loaded")
 
     def plot(self):
+        import matplotlib.pyplot as plt
+
         H_tide = self.df.loc[self.df['type']=="H"]
         xdata = self.df.index
         ydata = self.df['v']
@@ -354,6 +609,8 @@ class NOAA_API:
 
 
 if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+
     PTS = plot_TideSLR(
             station_id=8771450, 
             scenario_names=['NOAA et al. 2022'], # 'USACE 2013'], # Terri - use NOAA 2022; it's been approved by USACE too
@@ -0,0 +1,100 @@
+import os, sys
+import numpy as np
+import pandas as pd
+from statistics import NormalDist
+
+
+"""
+Stratified sampling of assets for preview runs.
+Assets are grouped into strata (e.g. the first slr layer at which they are
+exposed) and sampled without replacement within each stratum. Island-wide
+totals are extrapolated with the stratified estimator, and the sample is
+extended (Neyman allocation from the stratum standard deviations seen so far)
+until the confidence intervals reach a target relative precision.
+
+e.g.
+    S = StratifiedSample(strata, seed=0)
+    new_ids = S.extend(500)
+    total, half_width = S.estimate(values)      # values indexed by sampled ids
+"""
+
+def first_layer(exposed):
+    """ first slr layer (column) that is True in each row of a boolean
+        (assets x slr layers) array; the number of layers if never
+    """
+    exposed = np.asarray(exposed, dtype=bool)
+    return np.where(exposed.any(axis=1), exposed.argmax(axis=1), exposed.shape[1])
+
+
+class StratifiedSample():
+    def __init__(self, strata, seed=None):
+        """ strata: pd.Series of the stratum of each asset, indexed by asset id """
+        self.strata = strata
+        self.N_h = strata.value_counts()
+        self.sampled = strata.index[:0]
+        self.rng = np.random.default_rng(seed)
+
+    @property
+    def complete(self):
+        return len(self.sampled) == len(self.strata)
+
+    def extend(self, n_target, sd=None):
+        """ adds assets so that about n_target are sampled in total; returns
+            the ids of the new assets.
+            allocation is proportional to the stratum size, or to size x sd
+            (Neyman) if the stratum standard deviations are given. every
+            stratum gets at least two assets so that its variance can be
+            estimated.
+        """
+        n_target = min(n_target, len(self.strata))
+        weight = self.N_h.astype(float)
+        if sd is not None:
+            weight = weight*sd.reindex(weight.index).fillna(sd.max() if len(sd) > 0 else 1.0)
+            if weight.sum() == 0:
+                weight = self.N_h.astype(float)
+        n_h = np.ceil(n_target*weight/weight.sum()).clip(lower=2)
+        n_h = np.minimum(n_h, self.N_h).astype(int)
+
+        n_have = self.strata.loc[self.sampled].value_counts().reindex(n_h.index).fillna(0).astype(int)
+        remaining = self.strata.drop(self.sampled)
+        new = []
+        for stratum, ids in remaining.groupby(remaining).groups.items():
+            n_new = min(n_h[stratum] - n_have[stratum], len(ids))
+            if n_new > 0:
+                new.append(self.rng.choice(np.asarray(ids), size=n_new, replace=False))
+        new = pd.Index(np.concatenate(new) if len(new) > 0 else [], dtype=self.strata.index.dtype)
+        self.sampled = self.sampled.append(new)
+        return new
+
+    def estimate(self, values, confidence=0.95):
+        """ values: (sampled assets x k) DataFrame or Series indexed by ids
+            returns the estimated population totals and the half-widths of
+            their confidence intervals (arrays of length k)
+        """
+        values = pd.DataFrame(values)
+        groups = values.groupby(self.strata.reindex(values.index).values)
+        n_h = groups.size()
+        N_h = self.N_h.reindex(n_h.index)
+        means = groups.mean()
+        var = groups.var(ddof=1).fillna(0)
+
+        total = (means.mul(N_h, axis=0)).sum(axis=0).values
+        fpc = (1 - n_h/N_h)
+        var_total = var.mul(N_h**2*fpc/n_h, axis=0).sum(axis=0).values
+        z = NormalDist().inv_cdf(0.5 + confidence/2)
+        return total, z*np.sqrt(var_total)
+
+    def stratum_sd(self, values):
+        """ standard deviation of values in each stratum (rms over columns) """
+        values = pd.DataFrame(values)
+        var = values.groupby(self.strata.reindex(values.index).values).var(ddof=1).fillna(0)
+        return np.sqrt(var.mean(axis=1))
+
+    @staticmethod
+    def precise(total, half_width, rel_precision):
+        """ True if every interval is within rel_precision of its total;
+            totals that are exactly 0 with no spread are precise
+        """
+        total = np.abs(np.asarray(total, dtype=float))
+        half_width = np.asarray(half_width, dtype=float)
+        return bool(np.all((half_width <= rel_precision*total) | (half_width == 0)))
@@ -0,0 +1,110 @@
+import os, sys
+import numpy as np
+import pandas as pd
+
+
+"""
+Tipping point index: first year in which an asset exceeds K exposed days per
+year for each scenario and percentile. Built once from the per-year tables
+written by MapWaterLevels (nTimesExp, nNoAccess, nTTIncrease) so that island
+wide tipping point maps can be queried without rereading those tables.
+"""
+
+class TippingPointIndex():
+    def __init__(self, path_in=None):
+        self.file_dir = os.path.dirname(os.path.realpath(__file__))
+        if path_in is None:
+            path_in = os.path.join(self.file_dir, 'output', "impacts-time")
+        self.path_in = path_in
+        self.dtype = np.uint16
+        self.never = np.iinfo(self.dtype).max     # stored year offset when K is never exceeded
+        self._index = {}
+
+    def build_index(self, infrastructure, scenario_names=["Low", "IntLow", "Int", "IntHigh", "High"],
+                    nonexceendance_probs=[0.17, 0.5, 0.83], K_values=[1, 10, 30, 90, 180, 365], runname=None):
+        """ builds and saves the index for one infrastructure output
+            (e.g. infrastructure='nTimesExp', 'nNoAccess', or 'nTTIncrease' w/ runname)
+            first exceedance years are stored as uint16 offsets from the first year.
+        """
+        arrays = {}
+        guids, years = None, None
+        for scenario_name in scenario_names:
+            for ne in nonexceendance_probs:
+                df = pd.read_csv(self.results_fname(infrastructure, scenario_name, ne, runname), index_col=0)
+                if guids is None:
+                    guids = df.index.values.astype(str)
+                    years = df.columns.astype(int).values
+                    if len(years) >= self.never:
+                        raise ValueError("{} years don't fit the {} year offsets" .format(len(years), np.dtype(self.dtype).name))
+                first_idx = self.first_exceedance(df.values, K_values)
+                first_idx[first_idx >= len(years)] = self.never
+                arrays[self.key(scenario_name, ne)] = first_idx.astype(self.dtype)
+
+        fname = self.index_fname(infrastructure, runname)
+        np.savez_compressed(fname, guid=guids, years=years, K=np.asarray(K_values), **arrays)
+        self._index.pop(fname, None)
+        return fname
+
+    def first_exceedance(self, counts, K_values):
+        """ index of the first year with counts >= K for each asset (row) and K.
+            the running maximum over years is monotone (the annual slr layers
+            trend upwards, and the first exceedance of K is unaffected by
+            taking the running max), so every row is sorted and the
+            first exceedance is a binary search. rows are offset by a constant
+            so that one searchsorted call on the flattened array searches all
+            assets at once.
+            returns (assets x K) array; len(years) where K is never exceeded
+        """
+        counts = np.nan_to_num(np.asarray(counts, dtype=float), nan=0.0)
+        running = np.maximum.accumulate(counts, axis=1)
+        n_assets, n_years = running.shape
+        span = max(running.max(initial=0), np.max(K_values)) + 1
+        offset = np.arange(n_assets) * span
+        flat = (running + offset[:, None]).ravel()
+
+        first_idx = np.empty((n_assets, len(K_values)), dtype=int)
+        for k_i, k in enumerate(K_values):
+            pos = np.searchsorted(flat, offset + max(k, 0), side='left')
+            first_idx[:, k_i] = pos - np.arange(n_assets)*n_years
+        return first_idx
+
+    def first_year(self, infrastructure, scenario_name, ne, K, runname=None):
+        """ first year each asset exceeds K days; NaN if never exceeded """
+        index = self.load_index(infrastructure, runname)
+        k_i = list(index['K']).index(K)
+        first_idx = index[self.key(scenario_name, ne)][:, k_i]
+        never = np.iinfo(first_idx.dtype).max           # also reads indices saved with uint8 offsets
+        first_year = np.where(first_idx == never, np.nan, index['years'][0] + first_idx.astype(float))
+        return pd.Series(first_year, index=index['guid'], name=str(K))
+
+    def load_index(self, infrastructure, runname=None):
+        fname = self.index_fname(infrastructure, runname)
+        if fname not in self._index:
+            with np.load(fname) as npz:
+                self._index[fname] = {key: npz[key] for key in npz.files}
+        return self._index[fname]
+
+    def results_fname(self, infrastructure, scenario_name, ne, runname=None):
+        if runname is None:
+            fn = '{}_years_sc{}_ne{}.csv' .format(infrastructure, scenario_name, ne)
+        else:
+            fn = '{}_years_sc{}_ne{}_{}.csv' .format(infrastructure, scenario_name, ne, runname)
+        return os.path.join(self.path_in, fn)
+
+    def index_fname(self, infrastructure, runname=None):
+        if runname is None:
+            fn = 'TippingPoints_{}.npz' .format(infrastructure)
+        else:
+            fn = 'TippingPoints_{}_{}.npz' .format(infrastructure, runname)
+        return os.path.join(self.path_in, fn)
+
+    def key(self, scenario_name, ne):
+        return 'sc{}_ne{}' .format(scenario_name, ne)
+
+
+if __name__ == "__main__":
+    TP = TippingPointIndex()
+    TP.build_index('nTimesExp')
+    TP.build_index('nNoAccess')
+    TP.build_index('nTTIncrease', runname='utmb-hospital')
+    TP.build_index('nTTIncrease', runname='galveston-exit')
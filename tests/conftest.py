@@ -0,0 +1,4 @@
+import os, sys
+
+# the backend modules are imported as `from backend import ...` from the repo root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
@@ -0,0 +1,65 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+
+from backend import ExpectedDamage
+from backend import MapWaterLevelsToImpacts
+
+MWL = MapWaterLevelsToImpacts.MapWaterLevels
+REPAIR_RATIOS = [0.0, 0.1, 0.5, 1.0]
+
+
+class FakeMWL():
+    # the parts of MapWaterLevels that ExpectedDamage uses, on small inputs
+    daily_max_elev = MWL.daily_max_elev
+    return_slr_layers = MWL.return_slr_layers
+    scenario_to_name = MWL.scenario_to_name
+
+    def __init__(self, n_assets=6, seed=0):
+        rng = np.random.default_rng(seed)
+        ds = rng.dirichlet(np.ones(4), size=(n_assets, ExpectedDamage.N_LAYERS))
+        cols = ["slr{}ft_DS_{}" .format(slr_ft, s) for slr_ft in range(ExpectedDamage.N_LAYERS) for s in range(4)]
+        index = pd.Index(np.arange(n_assets), name="guid")
+        self.bldg_exp_df = pd.DataFrame(ds.reshape(n_assets, -1), index=index, columns=cols)
+        self.bldg_df = pd.DataFrame({"repl_cst": rng.uniform(1e5, 5e5, n_assets)}, index=index)
+
+        self.scenarios = {"NOAA et al. 2022": ["0.5", "1.0"]}
+        self.nonexceendance_probs = [0.17, 0.5]
+        times = pd.date_range("2030-01-01", "2032-12-31 12:00", freq="12h")
+        self.waterlevels = pd.DataFrame(index=times.normalize())        # two values per day
+        for scenario in self.scenarios["NOAA et al. 2022"]:
+            for ne in self.nonexceendance_probs:
+                col = 'SL+Tide_ft_MHHW_{}_ne{}' .format(scenario, ne)
+                self.waterlevels[col] = rng.uniform(0, 6, len(times)) + float(scenario)
+
+
+def test_layer_losses_match_loops():
+    mwl = FakeMWL()
+    ED = ExpectedDamage.ExpectedDamage(mwl, repair_ratios=REPAIR_RATIOS)
+    expected = np.zeros((len(mwl.bldg_exp_df), ExpectedDamage.N_LAYERS))
+    for a, (guid, row) in enumerate(mwl.bldg_exp_df.iterrows()):
+        for slr_ft in range(ExpectedDamage.N_LAYERS):
+            for s, ratio in enumerate(REPAIR_RATIOS):
+                expected[a, slr_ft] += row["slr{}ft_DS_{}" .format(slr_ft, s)]*ratio*mwl.bldg_df.loc[guid, "repl_cst"]
+    np.testing.assert_allclose(ED.layer_losses(), expected)
+
+
+def test_event_histogram_counts_events_per_year():
+    ED = ExpectedDamage.ExpectedDamage(FakeMWL(), repair_ratios=REPAIR_RATIOS)
+    hist, years = ED.event_histogram("1.0", 0.5, n_events=3)
+    assert years == [2030, 2031, 2032]
+    np.testing.assert_array_equal(hist.sum(axis=1), 3)
+
+
+def test_island_losses_sum_building_losses():
+    mwl = FakeMWL()
+    ED = ExpectedDamage.ExpectedDamage(mwl, repair_ratios=REPAIR_RATIOS)
+    losses = ED.building_losses()                   # scenarios x nes x assets x years
+    df = ED.island_losses(discount_rate=0.05)
+
+    discount = 1.05**-np.arange(3)
+    expected = losses.sum(axis=2)*discount
+    np.testing.assert_allclose(df[[2030, 2031, 2032]].values, expected.reshape(-1, 3))
+    np.testing.assert_allclose(df["total"].values, expected.sum(axis=-1).ravel())
+    assert list(df.index) == [("IntLow", 0.17), ("IntLow", 0.5), ("Int", 0.17), ("Int", 0.5)]
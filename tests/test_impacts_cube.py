@@ -0,0 +1,55 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+
+from backend import ImpactsCube
+
+
+def make_df(assets, years, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(rng.integers(0, 365, size=(len(assets), len(years))).astype(float),
+                        index=pd.Index(assets, name="guid"), columns=years)
+
+
+def test_write_read_round_trip(tmp_path):
+    store = ImpactsCube.ImpactCubeStore(str(tmp_path), asset_chunk=3, year_chunk=2)
+    df = make_df(["g{}" .format(i) for i in range(7)], list(range(2030, 2035)))
+    df.iloc[2, 3] = np.nan
+    store.write("nTimesExp", "Int", 0.5, df)
+
+    out = store.read("nTimesExp", "Int", 0.5)
+    np.testing.assert_array_equal(out.values, df.values.astype(np.float32))
+    assert list(out.index) == list(df.index) and list(out.columns) == list(df.columns)
+
+    # partial reads only touch some chunks, and come back in the requested order
+    sub = store.read("nTimesExp", "Int", 0.5, assets=["g6", "g1"], years=[2033, 2030])
+    np.testing.assert_array_equal(sub.values, df.loc[["g6", "g1"], [2033, 2030]].values)
+    assert store.read_asset("nTimesExp", "Int", 0.5, "g4").tolist() == df.loc["g4"].tolist()
+    assert store.metrics() == ["nTimesExp"]
+
+    # a second instance reads the same coordinates from disk
+    again = ImpactsCube.ImpactCubeStore(str(tmp_path))
+    np.testing.assert_array_equal(again.read("nTimesExp", "Int", 0.5).values, out.values)
+
+
+def test_axes_grow_as_a_union(tmp_path):
+    first = ImpactsCube.ImpactCubeStore(str(tmp_path), asset_chunk=4, year_chunk=4)
+    second = ImpactsCube.ImpactCubeStore(str(tmp_path))          # opened before the store has coordinates
+    df_a = make_df(["a", "b", "c"], [2030, 2031], seed=1)
+    df_b = make_df(["d", "b", "e"], [2031, 2032], seed=2)
+    first.write("nNoAccess", "Int", 0.5, df_a)
+    second.write("nNoAccess", "Int", 0.5, df_b)
+
+    # positions of the first table don't move
+    assert list(second.assets) == ["a", "b", "c", "d", "e"]
+    assert list(second.years) == [2030, 2031, 2032]
+
+    expected = df_a.combine_first(df_b).reindex(index=list(second.assets), columns=list(second.years))
+    expected.loc["b", 2031] = df_b.loc["b", 2031]              # written last
+    expected = expected.values.astype(np.float32)
+
+    # the first instance has stale coordinates; chunks grown since are cropped, not shifted
+    np.testing.assert_array_equal(first.read("nNoAccess", "Int", 0.5).values, expected[:3, :2])
+    first.read_meta()
+    np.testing.assert_array_equal(first.read("nNoAccess", "Int", 0.5).values, expected)
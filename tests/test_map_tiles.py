@@ -0,0 +1,47 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from backend import MapTiles
+
+
+def make_tileset(z, features):
+    """ TileSet with an in-memory index: one tile (0, 0) at zoom z whose
+        features hold the given inventory positions
+    """
+    TS = MapTiles.TileSet.__new__(MapTiles.TileSet)
+    TS.point_zoom, TS.polygon_zoom = 13, 15
+    members = np.concatenate(features)
+    TS._index = {z: {
+        "tiles": np.array([[0, 0]]),
+        "tile_offsets": np.array([0, len(features)]),
+        "feat_offsets": np.r_[0, np.cumsum([len(i) for i in features])],
+        "members": members,
+        "lookup": {(0, 0): 0},
+        }}
+    return TS
+
+
+FEATURES = [np.array([0, 3]), np.array([5]), np.array([1, 2, 4]), np.array([6])]
+VALUES = np.array([1.0, 4.0, np.nan, 2.0, 6.0, np.nan, 3.0], dtype=np.float32)
+
+
+@pytest.mark.parametrize("agg, reduce", [("mean", np.nanmean), ("max", np.nanmax), ("sum", np.nansum)])
+def test_hex_cells_aggregate_like_loops(agg, reduce):
+    TS = make_tileset(10, FEATURES)
+    out = TS.tile_values(10, 0, 0, VALUES, agg)
+    expected = [reduce(VALUES[i].astype(float)) if (~np.isnan(VALUES[i])).any() else np.nan for i in FEATURES]
+    np.testing.assert_allclose(out, expected)
+    assert np.isnan(out[1])         # cells without results are nan, also for sums
+
+
+def test_building_zooms_return_values_in_feature_order():
+    TS = make_tileset(14, [np.array([i]) for i in [4, 0, 6]])
+    np.testing.assert_array_equal(TS.tile_values(14, 0, 0, VALUES), VALUES[[4, 0, 6]])
+    assert len(TS.tile_values(14, 1, 0, VALUES)) == 0
+
+
+def test_unknown_aggregation_raises():
+    TS = make_tileset(10, FEATURES)
+    with pytest.raises(ValueError):
+        TS.tile_values(10, 0, 0, VALUES, 'median')
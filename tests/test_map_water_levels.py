@@ -0,0 +1,62 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("pandas")
+
+from backend import MapWaterLevelsToImpacts
+
+
+def make_mwl():
+    # only the array helpers are tested; inputs are never loaded
+    return MapWaterLevelsToImpacts.MapWaterLevels.__new__(MapWaterLevelsToImpacts.MapWaterLevels)
+
+
+def test_threshold_layers_counts_failing_layers():
+    values = np.array([[1.0, 0.9, 0.7, 0.4],
+                       [1.0, 1.0, 1.0, np.nan]])
+    thresholds = np.array([1/1.1, 1/1.25, 1/2.0])
+    order, n_fail = make_mwl().threshold_layers(values, thresholds)
+
+    expected = (values[:, :, None] < thresholds[None, None, :]).sum(axis=1)
+    np.testing.assert_array_equal(n_fail, expected)
+    for a in range(len(values)):
+        for t in range(len(thresholds)):
+            failing = sorted(order[a, :n_fail[a, t]])
+            assert failing == list(np.flatnonzero(values[a] < thresholds[t]))
+
+
+def test_threshold_layers_empty_table():
+    # e.g. an AdaptationScenario without raised roads has empty transportation tables
+    thresholds = np.array([1/1.1, 1/1.25])
+    order, n_fail = make_mwl().threshold_layers(np.zeros((0, 11)), thresholds)
+    assert order.shape == (0, 11)
+    assert n_fail.shape == (0, 2)
+
+    counts = make_mwl().threshold_counts(np.ones((3, 11)), order, n_fail)
+    assert counts.shape == (2, 0, 3)
+
+
+def test_threshold_layers_all_missing():
+    order, n_fail = make_mwl().threshold_layers(np.full((2, 11), np.nan), np.array([0.8]))
+    np.testing.assert_array_equal(n_fail, 0)
+
+
+def test_threshold_layers_infinite_values():
+    # e.g. norm_tt = tt0/tt_k with tt0 = inf, or a zero travel time in the denominator
+    values = np.array([[1.0, np.inf, 0.5, np.nan],
+                       [1.0, 0.85, -np.inf, 0.7],
+                       [1.0, 0.9, 0.95, 0.6]])
+    thresholds = np.array([1/1.1, 1/1.25])
+    order, n_fail = make_mwl().threshold_layers(values, thresholds)
+    expected = (values[:, :, None] < thresholds[None, None, :]).sum(axis=1)
+    np.testing.assert_array_equal(n_fail, expected)
+
+
+def test_interp_layers_matches_np_interp():
+    rng = np.random.default_rng(0)
+    values = rng.uniform(0, 365, size=(5, 11))
+    elev = np.array([-1.5, 0.0, 0.25, 3.0, 4.7, 9.99, 10.0, 12.0])
+    out = make_mwl().interp_layers(values, elev)
+    assert out.shape == (5, len(elev))
+    for a in range(len(values)):
+        np.testing.assert_allclose(out[a], np.interp(elev, np.arange(11), values[a]))
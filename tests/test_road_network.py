@@ -0,0 +1,97 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+nx = pytest.importorskip("networkx")
+
+from backend import RoadNetwork
+
+
+# a - b - c - d is a chain (b, c contracted); a = d also by a second chain
+# a - e - d; two parallel road edges a = f; a loop at f; f - g with g kept
+EDGES = pd.DataFrame({
+    "start_node": ["a", "b", "c", "a", "e", "a", "f", "f", "f"],
+    "end_node":   ["b", "c", "d", "e", "d", "f", "a", "f", "g"],
+    "travel_time": [1.0, 2.0, 3.0, 4.0, 1.5, 2.0, 5.0, 1.0, 0.5],
+    }, index=pd.Index(["e{}" .format(i) for i in range(9)], name="guid"))
+
+
+def make_rn(edges=EDGES, epsg=32615):
+    RN = RoadNetwork.RoadNetwork()
+    nodes, edge_nodes, adjacency = RoadNetwork.intern_graph(edges['start_node'].values, edges['end_node'].values)
+    RN._loaded[RN.artifact_key(epsg)] = {
+        "edges": edges, "nodes": nodes, "edge_nodes": edge_nodes, "adjacency": adjacency,
+        }
+    return RN
+
+
+def baseline_graph(edges, weights):
+    # as in ImpactsTransportation.read_trns_dataset_local without contraction
+    df = edges.assign(travel_time=weights).dropna(subset=['travel_time'])
+    return nx.from_pandas_edgelist(df, source='start_node', target='end_node', edge_attr=['travel_time'])
+
+
+def assert_same_paths(G, H, nodes):
+    for s in nodes:
+        expected = nx.single_source_dijkstra_path_length(G, s, weight='travel_time')
+        actual = nx.single_source_dijkstra_path_length(H, s, weight='travel_time')
+        assert actual.keys() == {k for k in expected if k in nodes} | {s}
+        for t in actual:
+            assert actual[t] == pytest.approx(expected[t])
+
+
+@pytest.mark.parametrize("keep", [["a", "g"], ["a", "c", "g"], ["b", "e", "f"]])
+def test_contracted_paths_match_full_graph(keep):
+    RN = make_rn()
+    CN = RN.contract(keep)
+    assert set(keep) <= set(CN.node_guids)
+    assert "b" not in CN.node_guids or "b" in keep
+
+    weights = EDGES['travel_time']
+    H = CN.to_networkx(weights)
+    assert_same_paths(baseline_graph(EDGES, weights), H, set(CN.node_guids))
+
+
+def test_parallel_road_edges_keep_the_last():
+    # nx.Graph keeps the last of the parallel edges a = f (5.0), not the fastest
+    CN = make_rn().contract(["a", "f"])
+    H = CN.to_networkx(EDGES['travel_time'])
+    assert H["a"]["f"]['travel_time'] == 5.0
+
+
+def test_missing_weights_drop_the_chain():
+    weights = EDGES['travel_time'].drop("e1")      # b - c is not in the results
+    CN = make_rn().contract(["a", "d"])
+    H = CN.to_networkx(weights)
+    assert_same_paths(baseline_graph(EDGES, weights), H, set(CN.node_guids))
+    assert H["a"]["d"]['travel_time'] == pytest.approx(5.5)
+
+
+def test_weights_and_expand_round_trip():
+    CN = make_rn().contract(["a", "d", "g"])
+    w = CN.weights(EDGES['travel_time'].values)
+    assert w.sum() == pytest.approx(EDGES['travel_time'].drop("e7").sum())       # the loop is dropped
+    expanded = CN.expand(np.arange(len(w)), fill=-1)
+    assert expanded[EDGES.index.get_loc("e7")] == -1
+    np.testing.assert_array_equal(expanded[CN.chain_edges], np.repeat(np.arange(len(w)), np.diff(CN.chain_indptr)))
+
+
+def test_routing_graph_keeps_nx_parallel_edges():
+    csgraph = pytest.importorskip("scipy.sparse.csgraph")
+    RN = make_rn()
+    nodes = list(RN.load(32615)['nodes'])
+    weights = EDGES['travel_time'].values
+    G = baseline_graph(EDGES, weights)
+
+    graph, edge_of = RN.routing_graph(weights)
+    dist = csgraph.dijkstra(graph, directed=False, indices=nodes.index("a"))
+    expected = nx.single_source_dijkstra_path_length(G, "a", weight='travel_time')
+    assert dist[nodes.index("f")] == pytest.approx(5.0)         # the last a = f edge, not the fastest
+    for node, d in expected.items():
+        assert dist[nodes.index(node)] == pytest.approx(d)
+
+    CN = RN.contract(["a", "d", "g"])
+    graph, edge_of = CN.routing_graph(weights)
+    dist = csgraph.dijkstra(graph, directed=False, indices=CN.node_pos[nodes.index("a")])
+    for i, node in enumerate(CN.node_guids):
+        assert dist[i] == pytest.approx(expected[node])
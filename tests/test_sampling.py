@@ -0,0 +1,63 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+
+from backend import Sampling
+
+
+def make_strata():
+    # three strata of 100, 50 and 10 assets
+    return pd.Series(np.repeat([0, 1, 2], [100, 50, 10]), index=pd.Index(np.arange(160)))
+
+
+def test_first_layer():
+    exposed = np.array([[False, True, True],
+                        [False, False, False],
+                        [True, False, True]])
+    np.testing.assert_array_equal(Sampling.first_layer(exposed), [1, 3, 0])
+
+
+def test_extend_proportional_then_neyman():
+    strata = make_strata()
+    S = Sampling.StratifiedSample(strata, seed=0)
+    new = S.extend(32)
+    assert strata[new].value_counts().to_dict() == {0: 20, 1: 10, 2: 2}
+    assert len(new.unique()) == len(new)
+
+    # all of the spread is in stratum 1; strata without spread keep two
+    sd = pd.Series({0: 0.0, 1: 5.0, 2: 0.0})
+    more = S.extend(40, sd=sd)
+    assert len(S.sampled.intersection(more)) == len(more) and len(new.intersection(more)) == 0
+    counts = strata[S.sampled].value_counts()
+    assert counts[1] == 40
+    assert counts[0] == 20 and counts[2] == 2
+
+
+def test_estimate_totals_and_intervals():
+    strata = make_strata()
+    rng = np.random.default_rng(1)
+    values = pd.Series(rng.normal(10, 2, len(strata)) + 5*strata.values, index=strata.index)
+
+    S = Sampling.StratifiedSample(strata, seed=0)
+    S.extend(60)
+    sample = values[S.sampled]
+    total, half_width = S.estimate(sample)
+
+    # stratified estimator and its variance, by hand
+    expected, var = 0.0, 0.0
+    for h, N in strata.value_counts().items():
+        v = sample[strata[sample.index] == h]
+        expected += N*v.mean()
+        var += N**2*(1 - len(v)/N)*v.var(ddof=1)/len(v)
+    assert total[0] == pytest.approx(expected)
+    assert half_width[0] == pytest.approx(1.959964*np.sqrt(var), rel=1e-5)
+    assert not Sampling.StratifiedSample.precise(total, half_width, 1e-6)
+
+    # a census is exact
+    S.extend(len(strata))
+    assert S.complete
+    total, half_width = S.estimate(values[S.sampled])
+    assert total[0] == pytest.approx(values.sum())
+    assert half_width[0] == pytest.approx(0)
+    assert Sampling.StratifiedSample.precise(total, half_width, 0.01)
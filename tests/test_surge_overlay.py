@@ -0,0 +1,32 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("pandas")
+
+from backend import SLR_Api
+
+
+def collect(overlay, daily_elev, n, chunk):
+    return np.concatenate([values for start, values in overlay.realizations(daily_elev, n, chunk)])
+
+
+def test_realizations_do_not_depend_on_chunk_size():
+    overlay = SLR_Api.SurgeOverlay(model='empirical', residuals=np.linspace(-1, 1, 200), block_days=7, seed=42)
+    daily_elev = np.linspace(0, 2, 60)
+    a = collect(overlay, daily_elev, 23, chunk=5)
+    b = collect(overlay, daily_elev, 23, chunk=100)
+    assert a.shape == (23, 60)
+    np.testing.assert_array_equal(a, b)
+
+
+def test_unseeded_runs_differ():
+    overlay = SLR_Api.SurgeOverlay(model='empirical', residuals=np.linspace(-1, 1, 200), block_days=7)
+    daily_elev = np.zeros(60)
+    assert not np.array_equal(collect(overlay, daily_elev, 4, 4), collect(overlay, daily_elev, 4, 4))
+
+
+def test_parametric_chunk_independence():
+    pytest.importorskip("scipy")
+    overlay = SLR_Api.SurgeOverlay(seed=7, surge_rate=20)
+    daily_elev = np.zeros(400)
+    np.testing.assert_allclose(collect(overlay, daily_elev, 9, 2), collect(overlay, daily_elev, 9, 9))
@@ -0,0 +1,54 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+
+from backend import TippingPoints
+
+
+def brute_force(counts, K_values):
+    counts = np.nan_to_num(counts)
+    out = np.full((len(counts), len(K_values)), counts.shape[1])
+    for a in range(len(counts)):
+        for k_i, k in enumerate(K_values):
+            hit = np.flatnonzero(counts[a] >= k)
+            if len(hit) > 0:
+                out[a, k_i] = hit[0]
+    return out
+
+
+def test_first_exceedance_matches_brute_force():
+    rng = np.random.default_rng(0)
+    counts = rng.integers(0, 40, size=(50, 30)).astype(float)
+    counts[3, :] = np.nan
+    counts[7, 5:] = 0                                   # exceeds early, then drops
+    K_values = [1, 10, 30, 90]
+    TP = TippingPoints.TippingPointIndex(path_in="unused")
+    np.testing.assert_array_equal(TP.first_exceedance(counts, K_values), brute_force(counts, K_values))
+
+
+def test_build_index_and_first_year(tmp_path):
+    TP = TippingPoints.TippingPointIndex(path_in=str(tmp_path))
+    years = list(range(2020, 2030))
+    df = pd.DataFrame([[0, 0, 2, 5, 12, 12, 30, 30, 40, 50],
+                       [0]*10,
+                       [400]*10], index=["a", "b", "c"], columns=years)
+    df.to_csv(TP.results_fname("nTimesExp", "Int", 0.5))
+
+    TP.build_index("nTimesExp", scenario_names=["Int"], nonexceendance_probs=[0.5], K_values=[1, 10, 365])
+    assert TP.load_index("nTimesExp")[TP.key("Int", 0.5)].dtype == np.uint16
+
+    pd.testing.assert_series_equal(TP.first_year("nTimesExp", "Int", 0.5, 10),
+                                   pd.Series([2024.0, np.nan, 2020.0], index=["a", "b", "c"], name="10"),
+                                   check_index_type=False)
+    assert np.isnan(TP.first_year("nTimesExp", "Int", 0.5, 365)[["a", "b"]]).all()
+
+
+def test_first_year_reads_uint8_offsets(tmp_path):
+    # indices built before the offsets were widened
+    TP = TippingPoints.TippingPointIndex(path_in=str(tmp_path))
+    np.savez_compressed(TP.index_fname("nNoAccess"), guid=np.array(["a", "b"]), years=np.array([2020, 2021]),
+                        K=np.array([1]), **{TP.key("Int", 0.5): np.array([[1], [255]], dtype=np.uint8)})
+    first = TP.first_year("nNoAccess", "Int", 0.5, 1)
+    assert first["a"] == 2021
+    assert np.isnan(first["b"])